@@ -0,0 +1,90 @@
+# coding=utf-8
+
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+import checkpoint
+
+HOUR_FORMAT = '%Y-%m-%d %H'
+
+
+class ActivityCache(object):
+    """
+    On-disk cache of the kanbanize board activities of each closed UTC hour.
+    Kanbanize activities of an hour never change once it is past, so closed
+    hours are collected only once and then served from this cache, by any
+    feeder (or process) of the same account and board.
+    It lives in the checkpoint sqlite database.
+    """
+
+    def __init__(self, path=None, retention=datetime.timedelta(days=7),
+                 timeout=30):
+        """
+            Arguments:
+            @path - database path, default is the checkpoint store one
+            @retention - timedelta the hours are kept in the cache
+            @timeout - seconds to wait for a lock held by other process
+        """
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'),
+                                checkpoint.CheckpointStore.file_name)
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS activity_cache ('
+            ' account TEXT NOT NULL,'
+            ' board TEXT NOT NULL,'
+            ' hour TEXT NOT NULL,'
+            ' activities TEXT NOT NULL,'
+            ' PRIMARY KEY (account, board, hour))')
+
+    def get_hours(self, account, board, hours):
+        """
+            Return dict {hour: list of raw activities} with the cached hours
+            Arguments:
+            @hours - list of naive UTC datetimes, truncated to the hour
+        """
+        if not hours:
+            return {}
+        keys = dict((hour.strftime(HOUR_FORMAT), hour) for hour in hours)
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT hour, activities FROM activity_cache'
+                ' WHERE account = ? AND board = ? AND hour BETWEEN ? AND ?',
+                (account, unicode(board), min(keys), max(keys))).fetchall()
+        return dict((keys[hour], json.loads(activities))
+                    for hour, activities in rows if hour in keys)
+
+    def put_hours(self, account, board, hours_activities):
+        """
+            Atomically cache the activities of closed hours and evict the
+            hours older than the retention
+            Arguments:
+            @hours_activities - dict {hour: list of raw activities}, hours
+                                without activities must be passed too
+        """
+        board = unicode(board)
+        oldest = datetime.datetime.utcnow() - self.retention
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO activity_cache'
+                    ' (account, board, hour, activities) VALUES (?, ?, ?, ?)',
+                    [(account, board, hour.strftime(HOUR_FORMAT),
+                      json.dumps(activities))
+                     for hour, activities in hours_activities.iteritems()])
+                self.connection.execute(
+                    'DELETE FROM activity_cache WHERE hour < ?',
+                    (oldest.strftime(HOUR_FORMAT),))
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
@@ -0,0 +1,304 @@
+# coding=utf-8
+"""
+Benchmarks of the feeder pipeline (fetch, parse, format, post and the whole
+run) over synthetic boards, with the kanbanize and slack transports stubbed.
+Results are printed as JSON, so they can be saved and compared between
+versions, run with:
+    python benchmarks.py --activities 10000 --tasks 500 --output bench.json
+Real activity traces, recorded with main.py --kanbanize_record, can be
+replayed through the feeder (at 10x the recorded speed) with:
+    python benchmarks.py --replay trace.jsonl.gz --replay_speed 10
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+
+import cassette
+import checkpoint
+import feeder
+
+EVENTS = [u'Task archived', u'Assignee changed', u'Comment added',
+          u'Task moved', u'Attachments updated', u'Task updated',
+          u'Task created', u'External link changed', u'Tags changed',
+          u'Foo other event']
+
+
+def generate_activities(activities=1000, tasks=100, authors=10,
+                        events=len(EVENTS), spread=datetime.timedelta(hours=1),
+                        end_date=datetime.datetime(2014, 10, 2, 20, 0, 0),
+                        seed=0):
+    """
+        Return raw data in the same format of kanbanize get_board_activities
+        with synthetic activities
+        Arguments:
+        @activities - number of activities
+        @tasks - number of distinct tasks the activities are spread over
+        @authors - number of distinct authors
+        @events - number of distinct events, taken from EVENTS
+        @spread - timedelta the dates are spread over, ending at end_date
+        @end_date - naive UTC datetime of the newest activity
+        @seed - random seed, the same arguments always generate the same data
+    """
+    rand = random.Random(seed)
+    seconds = max(0, int(spread.total_seconds()))
+    events_list = EVENTS[:max(1, events)]
+    raw_activities = []
+    for i in xrange(activities):
+        date = end_date - datetime.timedelta(seconds=rand.randint(0, seconds))
+        raw_activities.append({
+            u'author': u'user%s' % rand.randint(1, authors),
+            u'date': date.strftime("%Y-%m-%d %H:%M:%S"),
+            u'event': rand.choice(events_list),
+            u'taskid': unicode(rand.randint(1, tasks)),
+            u'text': u"From 'Backlog' to 'In Progress'"})
+    # kanbanize returns the newest activities first
+    raw_activities.sort(key=lambda activity: activity[u'date'], reverse=True)
+    return {u'activities': raw_activities}
+
+
+class StubKanbanize(object):
+    """
+    Stands for python_kanbanize Kanbanize, returning the same raw_data on
+    every call after an optional latency
+    """
+
+    def __init__(self, raw_data, latency=0):
+        self.raw_data = raw_data
+        self.latency = latency
+        self.calls = 0
+
+    def get_board_activities(self, boardid, fromdate, todate, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.raw_data
+
+
+class StubSlackClient(object):
+    """
+    Stands for pyslack SlackClient, accepting every message after an optional
+    latency and counting the posted bytes
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = 0
+        self.posted_bytes = 0
+
+    def chat_post_message(self, channel, text, **params):
+        self.calls += 1
+        self.posted_bytes += len(params.get('attachments') or u'')
+        if self.latency:
+            time.sleep(self.latency)
+        return {u'ok': True}
+
+
+class BenchmarkFeeder(feeder.Feeder):
+    """
+    Feeder that always starts without last action time, so every repetition
+    processes all the activities
+    """
+
+    def _get_last_action_time(self):
+        return None
+
+
+def build_feeder(raw_data, kanbanize_latency=0, slack_latency=0):
+    return BenchmarkFeeder("bench_kanbanize_api_key", 4, "bench_slack_token",
+                           "bench_slack_channel",
+                           checkpoint_store=checkpoint.CheckpointStore(
+                                                                ':memory:'),
+                           slack_client=StubSlackClient(slack_latency),
+                           kanbanize_client=StubKanbanize(raw_data,
+                                                          kanbanize_latency))
+
+
+def timeit(function, repeat):
+    """
+        Call function repeat times
+        Return dict with min / median / mean / max seconds
+    """
+    timings = []
+    for i in xrange(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    timings.sort()
+    return {
+        'min': timings[0],
+        'median': timings[len(timings) / 2],
+        'mean': sum(timings) / len(timings),
+        'max': timings[-1],
+    }
+
+
+def bench_stages(activities=1000, tasks=100, authors=10, events=len(EVENTS),
+                 spread_minutes=60, repeat=5, kanbanize_latency=0,
+                 slack_latency=0):
+    """
+        Time each stage of the pipeline over the same synthetic board
+        Return dict {stage_name: timings}
+    """
+    raw_data = generate_activities(activities, tasks, authors, events,
+                                   datetime.timedelta(minutes=spread_minutes))
+    obj = build_feeder(raw_data, kanbanize_latency, slack_latency)
+    parsed = obj._parse_kanbanize_activities(raw_data)
+    attachments = obj._format_slack_messages(parsed)
+
+    return {
+        '_get_kanbanize_board_activities': timeit(
+                        obj._get_kanbanize_board_activities, repeat),
+        '_parse_kanbanize_activities': timeit(
+                        lambda: obj._parse_kanbanize_activities(raw_data),
+                        repeat),
+        '_format_slack_messages': timeit(
+                        lambda: obj._format_slack_messages(parsed), repeat),
+        'json_dumps': timeit(lambda: json.dumps(attachments), repeat),
+        'run': timeit(obj.run, repeat),
+    }
+
+
+def bench_parse_grouping(sizes=(1000, 10000, 100000), tasks_ratio=10):
+    """
+        Time _parse_kanbanize_activities with growing number of activities
+        (and tasks, one task each tasks_ratio activities), the time per
+        activity must stay flat
+        Return list of dicts with activities / seconds / us_per_activity
+    """
+    results = []
+    for size in sizes:
+        raw_data = generate_activities(size, max(1, size / tasks_ratio))
+        obj = build_feeder(raw_data)
+        start = time.time()
+        obj._parse_kanbanize_activities(raw_data)
+        seconds = time.time() - start
+        results.append({'activities': size, 'seconds': seconds,
+                        'us_per_activity': seconds * 1000000 / size})
+    return results
+
+
+def bench_replay(path, speed=0, slack_latency=0):
+    """
+        Replay the kanbanize responses of a cassette (see cassette module)
+        through one feeder per recorded board, running each board until its
+        responses end
+        Arguments:
+        @speed - see cassette.ReplayKanbanize, 0 replays without waiting
+        Return dict with the runs timings, the activities replayed and the
+        slack calls / bytes posted
+    """
+    records = cassette.read_cassette(path)
+    kanbanize_client = cassette.ReplayKanbanize(records, speed)
+    slack_client = StubSlackClient(slack_latency)
+    store = checkpoint.CheckpointStore(':memory:')
+    timings = []
+    start = time.time()
+    board_ids = sorted(set(unicode(record[u'boardid'])
+                           for record in records))
+    for board_id in board_ids:
+        obj = feeder.Feeder("bench_kanbanize_api_key", board_id,
+                            "bench_slack_token", "bench_slack_channel",
+                            checkpoint_store=store,
+                            slack_client=slack_client,
+                            kanbanize_client=kanbanize_client)
+        while kanbanize_client.remaining(board_id):
+            run_start = time.time()
+            try:
+                obj.run()
+            except cassette.CassetteExhausted:
+                break
+            timings.append(time.time() - run_start)
+    seconds = time.time() - start
+    timings.sort()
+
+    activities = sum(len(record[u'response'].get(u'activities') or [])
+                     for record in records
+                     if isinstance(record[u'response'], dict))
+    return {
+        'boards': len(board_ids),
+        'responses': len(records),
+        'activities': activities,
+        'runs': len(timings),
+        'seconds': seconds,
+        'activities_per_second': activities / seconds if seconds else None,
+        'run': {
+            'min': timings[0] if timings else None,
+            'median': timings[len(timings) / 2] if timings else None,
+            'max': timings[-1] if timings else None,
+        },
+        'slack_calls': slack_client.calls,
+        'slack_bytes': slack_client.posted_bytes,
+    }
+
+
+def process():
+    parser = argparse.ArgumentParser(description='Slack - Kanbanize feeder'
+                                                 ' benchmarks')
+    parser.add_argument('--activities', type=int, default=1000)
+    parser.add_argument('--tasks', type=int, default=100)
+    parser.add_argument('--authors', type=int, default=10)
+    parser.add_argument('--events', type=int, default=len(EVENTS))
+    parser.add_argument('--spread_minutes', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--kanbanize_latency', type=float, default=0,
+                        help='seconds of simulated kanbanize latency')
+    parser.add_argument('--slack_latency', type=float, default=0,
+                        help='seconds of simulated slack latency')
+    parser.add_argument('--scaling', action='store_true',
+                        help='also run the parse scaling benchmark up to'
+                             ' 100k activities')
+    parser.add_argument('--replay', help='cassette of kanbanize responses'
+                                         ' to be replayed instead of the'
+                                         ' synthetic boards')
+    parser.add_argument('--replay_speed', type=float, default=0,
+                        help='speed of the replay relative to the recording'
+                             ' (2 is twice as fast), 0 replays without'
+                             ' waiting')
+    parser.add_argument('--label', help='name of the version being'
+                                        ' benchmarked, saved in the results')
+    parser.add_argument('--output', help='file to write the json results,'
+                                         ' default is stdout')
+    args = parser.parse_args()
+
+    params = {
+        'activities': args.activities,
+        'tasks': args.tasks,
+        'authors': args.authors,
+        'events': args.events,
+        'spread_minutes': args.spread_minutes,
+        'repeat': args.repeat,
+        'kanbanize_latency': args.kanbanize_latency,
+        'slack_latency': args.slack_latency,
+    }
+    results = {
+        'label': args.label,
+        'python': platform.python_version(),
+        'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'params': params,
+    }
+    if args.replay:
+        params = {'replay': args.replay, 'replay_speed': args.replay_speed,
+                  'slack_latency': args.slack_latency}
+        results['params'] = params
+        results['replay'] = bench_replay(args.replay, args.replay_speed,
+                                         args.slack_latency)
+    else:
+        results['stages'] = bench_stages(**params)
+    if args.scaling:
+        results['parse_scaling'] = bench_parse_grouping()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    process()
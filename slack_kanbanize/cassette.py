@@ -0,0 +1,128 @@
+# coding=utf-8
+"""
+Record and replay of the kanbanize get_board_activities responses, so real
+activity traces can drive the feeder (ex: benchmarks.bench_replay) without
+the network.
+A cassette is a gzip file with one json record per line:
+{"time": 1413000000.5, "boardid": "4", "fromdate": "2014-10-02 19:00:00",
+ "todate": "2014-10-02 21:00:00", "kwargs": {"page": 2}, "response": {...}}
+"""
+
+import gzip
+import json
+import threading
+import time
+
+
+class CassetteExhausted(Exception):
+    pass
+
+
+def read_cassette(path):
+    """
+        Return list with the records of the cassette in path, in the order
+        they were recorded
+    """
+    with gzip.open(path, 'rb') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class RecordingKanbanize(object):
+    """
+    Wraps a Kanbanize client, appending each get_board_activities response,
+    with its request window, to a cassette.
+    Other attributes are taken from the wrapped client.
+    """
+
+    def __init__(self, client, path, clock=time.time):
+        self.client = client
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def get_board_activities(self, boardid, fromdate, todate, page=None):
+        # page is only passed when set, the wrapped client may not accept it
+        # (see feeder.Feeder._supports_pages)
+        kwargs = {}
+        if page is not None:
+            kwargs['page'] = page
+        response = self.client.get_board_activities(boardid, fromdate, todate,
+                                                    **kwargs)
+        record = json.dumps({
+            u'time': self.clock(),
+            u'boardid': boardid,
+            u'fromdate': fromdate,
+            u'todate': todate,
+            u'kwargs': kwargs,
+            u'response': response,
+        })
+        # each record is a gzip member of its own, so the cassette is
+        # readable even if the process stops while recording
+        with self.lock:
+            with gzip.open(self.path, 'ab') as file:
+                file.write(record + '\n')
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class ReplayKanbanize(object):
+    """
+    Stands for a Kanbanize client, returning the responses of a cassette in
+    the order they were recorded (per board), whatever the request window.
+    With speed > 0 the calls wait to keep the intervals of the recording,
+    divided by speed (2 is twice as fast), with speed 0 they never wait.
+    Raise CassetteExhausted when there are no more responses of the board.
+    """
+
+    def __init__(self, records, speed=1.0, clock=time.time,
+                 sleep=time.sleep):
+        """
+            Arguments:
+            @records - list of records, see read_cassette
+        """
+        self.records = {}
+        for record in records:
+            self.records.setdefault(unicode(record[u'boardid']),
+                                    []).append(record)
+        for board_records in self.records.values():
+            board_records.reverse()
+        self.first_time = min([record[u'time'] for record in records] or
+                              [0])
+        self.speed = speed
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        return cls(read_cassette(path), **kwargs)
+
+    def remaining(self, boardid=None):
+        """
+            Return number of responses not replayed yet, of boardid or all
+        """
+        if boardid is not None:
+            return len(self.records.get(unicode(boardid), []))
+        return sum(len(board_records)
+                   for board_records in self.records.values())
+
+    def get_board_activities(self, boardid, fromdate, todate, **kwargs):
+        with self.lock:
+            board_records = self.records.get(unicode(boardid))
+            if not board_records:
+                raise CassetteExhausted(u'No more responses of board %s' %
+                                        boardid)
+            record = board_records.pop()
+            self.calls += 1
+            if self.start is None:
+                self.start = self.clock()
+        if self.speed > 0:
+            wait = self.start + (record[u'time'] - self.first_time) /\
+                float(self.speed) - self.clock()
+            if wait > 0:
+                self.sleep(wait)
+        return record[u'response']
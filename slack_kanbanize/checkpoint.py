@@ -0,0 +1,373 @@
+# coding=utf-8
+
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def account_key(kanbanize_api_key):
+    """
+        Return the key used to identify a kanbanize account in the store,
+        the api key itself is never saved
+    """
+    return hashlib.sha1(kanbanize_api_key).hexdigest()[:16]
+
+
+def activity_hash(raw_activity):
+    """
+        Return the hash identifying a raw kanbanize activity by its content
+        (taskid, date, event, author and text)
+    """
+    content = u'\x1f'.join([raw_activity.get(field) or u'' for field in
+                            (u'taskid', u'date', u'event', u'author',
+                             u'text')])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class CheckpointStore(object):
+    """
+    Keeps the last action time of each (account, board, channel) in an
+    sqlite database (WAL mode), so many feeders, in the same or in different
+    processes, can share it: writes are atomic transactions serialized by
+    sqlite locks and reads never block on them.
+    Along with the last action time, the hashes of the activities already
+    seen near it are kept, bounded by date and by max_seen_activities.
+    Messages that could not be posted wait in the outbox, in batches holding
+    the checkpoint they advance to once all their messages are posted.
+    Messages that can never be posted are moved aside to the dead letters.
+    """
+    file_name = '.slack-kanbanize.db'
+    max_seen_activities = 10000
+
+    def __init__(self, path=None, timeout=30):
+        """
+            Arguments:
+            @path - database path, default is ~/.slack-kanbanize.db
+            @timeout - seconds to wait for a lock held by other process
+        """
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), self.file_name)
+        self.path = path
+        # connection shared by the threads of a MultiFeeder, guarded by lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS checkpoints ('
+            ' account TEXT NOT NULL,'
+            ' board TEXT NOT NULL,'
+            ' channel TEXT NOT NULL,'
+            ' last_action TEXT NOT NULL,'
+            ' PRIMARY KEY (account, board, channel))')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS seen_activities ('
+            ' account TEXT NOT NULL,'
+            ' board TEXT NOT NULL,'
+            ' channel TEXT NOT NULL,'
+            ' hash TEXT NOT NULL,'
+            ' date TEXT NOT NULL,'
+            ' PRIMARY KEY (account, board, channel, hash))')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS outbox_batches ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' account TEXT NOT NULL,'
+            ' board TEXT NOT NULL,'
+            ' channel TEXT NOT NULL,'
+            ' last_action TEXT NOT NULL,'
+            ' seen TEXT NOT NULL,'
+            ' evict_before TEXT)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' batch INTEGER NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' attempts INTEGER NOT NULL,'
+            ' next_attempt TEXT NOT NULL)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS dead_letters ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' account TEXT NOT NULL,'
+            ' board TEXT NOT NULL,'
+            ' channel TEXT NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' attempts INTEGER NOT NULL,'
+            ' error TEXT,'
+            ' failed_at TEXT NOT NULL)')
+
+    def get(self, account, board, channel):
+        """
+            Return the last action time (naive UTC datetime) saved for the
+            key or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT last_action FROM checkpoints'
+                ' WHERE account = ? AND board = ? AND channel = ?',
+                (account, unicode(board), channel)).fetchone()
+        if not row:
+            return None
+        return datetime.datetime.strptime(row[0], DATE_FORMAT)
+
+    def save(self, account, board, channel, date):
+        """
+            Atomically save date as the last action time of the key
+        """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._save(account, unicode(board), channel, date)
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def _save(self, account, board, channel, date):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO checkpoints'
+            ' (account, board, channel, last_action)'
+            ' VALUES (?, ?, ?, ?)',
+            (account, board, channel, date.strftime(DATE_FORMAT)))
+
+    def get_seen(self, account, board, channel, since):
+        """
+            Return set with the hashes of the activities seen for the key
+            with date >= since (naive UTC datetime)
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT hash FROM seen_activities'
+                ' WHERE account = ? AND board = ? AND channel = ?'
+                ' AND date >= ?',
+                (account, unicode(board), channel,
+                 since.strftime(DATE_FORMAT))).fetchall()
+        return set(row[0] for row in rows)
+
+    def save_seen(self, account, board, channel, seen, evict_before=None):
+        """
+            Atomically add the seen activities of the key and evict the old
+            ones
+            Arguments:
+            @seen - dict {activity_hash: naive UTC datetime of the activity}
+            @evict_before - naive UTC datetime, activities older than it are
+                            removed
+        """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self._save_seen(account, unicode(board), channel, seen,
+                                evict_before)
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def _save_seen(self, account, board, channel, seen, evict_before):
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO seen_activities'
+            ' (account, board, channel, hash, date)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            [(account, board, channel, hash, date.strftime(DATE_FORMAT))
+             for hash, date in seen.iteritems()])
+        if evict_before is not None:
+            self.connection.execute(
+                'DELETE FROM seen_activities'
+                ' WHERE account = ? AND board = ? AND channel = ?'
+                ' AND date < ?',
+                (account, board, channel,
+                 evict_before.strftime(DATE_FORMAT)))
+        self.connection.execute(
+            'DELETE FROM seen_activities'
+            ' WHERE account = ? AND board = ? AND channel = ?'
+            ' AND hash NOT IN (SELECT hash FROM seen_activities'
+            '  WHERE account = ? AND board = ? AND channel = ?'
+            '  ORDER BY date DESC LIMIT ?)',
+            (account, board, channel, account, board, channel,
+             self.max_seen_activities))
+
+    def enqueue(self, account, board, channel, payloads, date, seen,
+                evict_before, next_attempt):
+        """
+            Atomically add a batch of messages, already attempted once, to
+            the outbox of the key, in one transaction (one disk sync for the
+            whole batch)
+            Arguments:
+            @payloads - list of messages (strings) to be posted, in order
+            @date - last action time saved when the batch is posted
+            @seen - seen activities saved when the batch is posted, see
+                    save_seen
+            @evict_before - see save_seen
+            @next_attempt - naive UTC datetime of the next post attempt
+            Return the batch id
+        """
+        seen_json = json.dumps(dict((hash, seen_date.strftime(DATE_FORMAT))
+                                    for hash, seen_date in seen.iteritems()))
+        if evict_before is not None:
+            evict_before = evict_before.strftime(DATE_FORMAT)
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                batch = self.connection.execute(
+                    'INSERT INTO outbox_batches'
+                    ' (account, board, channel, last_action, seen,'
+                    ' evict_before) VALUES (?, ?, ?, ?, ?, ?)',
+                    (account, unicode(board), channel,
+                     date.strftime(DATE_FORMAT), seen_json, evict_before)
+                    ).lastrowid
+                self.connection.executemany(
+                    'INSERT INTO outbox'
+                    ' (batch, payload, attempts, next_attempt)'
+                    ' VALUES (?, ?, 1, ?)',
+                    [(batch, payload, next_attempt.strftime(DATE_FORMAT))
+                     for payload in payloads])
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+        return batch
+
+    def get_outbox(self, account, board, channel):
+        """
+            Return list with the messages waiting in the outbox of the key,
+            in order: [(message id, payload, attempts, next_attempt), ...]
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT outbox.id, payload, attempts, next_attempt'
+                ' FROM outbox JOIN outbox_batches'
+                ' ON outbox.batch = outbox_batches.id'
+                ' WHERE account = ? AND board = ? AND channel = ?'
+                ' ORDER BY outbox.id',
+                (account, unicode(board), channel)).fetchall()
+        return [(message_id, payload, attempts,
+                 datetime.datetime.strptime(next_attempt, DATE_FORMAT))
+                for message_id, payload, attempts, next_attempt in rows]
+
+    def ack(self, *message_ids):
+        """
+            Atomically remove posted messages from the outbox, in one
+            transaction, when the last message of a batch is removed the
+            checkpoint of the batch is saved
+        """
+        self._remove(message_ids)
+
+    def dead_letter(self, message_id, error, failed_at):
+        """
+            Atomically move a message that can never be posted (ex: the
+            channel does not exist) from the outbox to the dead letters, so
+            the messages after it are not blocked, when it is the last one
+            of its batch the checkpoint of the batch is saved
+            Arguments:
+            @error - reason, ex: the slack error
+            @failed_at - naive UTC datetime
+        """
+        self._remove([message_id], error, failed_at)
+
+    def _remove(self, message_ids, error=None, failed_at=None):
+        """
+            Remove messages from the outbox, to the dead letters if
+            failed_at is passed, saving the checkpoint of the batches left
+            empty, in order
+        """
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                batches = OrderedDict()
+                for message_id in sorted(message_ids):
+                    row = self.connection.execute(
+                        'SELECT outbox_batches.id, account, board, channel,'
+                        ' last_action, seen, evict_before, payload, attempts'
+                        ' FROM outbox JOIN outbox_batches'
+                        ' ON outbox.batch = outbox_batches.id'
+                        ' WHERE outbox.id = ?', (message_id,)).fetchone()
+                    if not row:
+                        continue
+                    if failed_at is not None:
+                        self.connection.execute(
+                            'INSERT INTO dead_letters (account, board,'
+                            ' channel, payload, attempts, error, failed_at)'
+                            ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            row[1:4] + row[7:9] +
+                            (error, failed_at.strftime(DATE_FORMAT)))
+                    self.connection.execute(
+                        'DELETE FROM outbox WHERE id = ?', (message_id,))
+                    batches[row[0]] = row[:7]
+                for batch_row in batches.values():
+                    self._save_batch_checkpoint(*batch_row)
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def get_dead_letters(self, account, board, channel):
+        """
+            Return list with the dead letters of the key, in order:
+            [(payload, attempts, error, failed_at), ...]
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT payload, attempts, error, failed_at FROM dead_letters'
+                ' WHERE account = ? AND board = ? AND channel = ?'
+                ' ORDER BY id', (account, unicode(board), channel)).fetchall()
+        return [(payload, attempts, error,
+                 datetime.datetime.strptime(failed_at, DATE_FORMAT))
+                for payload, attempts, error, failed_at in rows]
+
+    def _save_batch_checkpoint(self, batch, account, board, channel,
+                               last_action, seen_json, evict_before):
+        if self.connection.execute('SELECT 1 FROM outbox WHERE batch = ?',
+                                   (batch,)).fetchone():
+            return
+        seen = dict((hash, datetime.datetime.strptime(date, DATE_FORMAT))
+                    for hash, date in json.loads(seen_json).iteritems())
+        if evict_before is not None:
+            evict_before = datetime.datetime.strptime(evict_before,
+                                                      DATE_FORMAT)
+        self._save_seen(account, board, channel, seen, evict_before)
+        self._save(account, board, channel,
+                   datetime.datetime.strptime(last_action, DATE_FORMAT))
+        self.connection.execute('DELETE FROM outbox_batches WHERE id = ?',
+                                (batch,))
+
+    def retry(self, message_id, next_attempt):
+        """
+            Count a failed post of the message and set its next attempt
+            (naive UTC datetime)
+        """
+        with self.lock:
+            self.connection.execute(
+                'UPDATE outbox SET attempts = attempts + 1, next_attempt = ?'
+                ' WHERE id = ?',
+                (next_attempt.strftime(DATE_FORMAT), message_id))
+
+    def migrate_file(self, file_path, account, board, channel):
+        """
+            Import the last action time from the file used by old versions
+            (~/.slack-kanbanize-last-msg), when there is none in the store yet
+            The old file is left untouched
+            Return True if something was imported
+        """
+        if not os.path.exists(file_path) or\
+                self.get(account, board, channel) is not None:
+            return False
+        with open(file_path) as file:
+            date_str = file.readline().strip()
+        if not date_str:
+            return False
+        try:
+            date = datetime.datetime.strptime(date_str, DATE_FORMAT)
+        except ValueError:
+            return False
+        self.save(account, board, channel, date)
+        return True
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
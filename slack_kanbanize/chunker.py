@@ -0,0 +1,139 @@
+# coding=utf-8
+
+import json
+
+# slack rejects messages with too many attachments or too big
+MAX_ATTACHMENTS = 20
+MAX_MESSAGE_BYTES = 16000
+MAX_FIELD_LENGTH = 3000
+CONTINUATION = u'…'
+
+
+def split_field_value(value, max_length=MAX_FIELD_LENGTH):
+    """
+        Split a field value in parts of up to max_length chars, breaking it in
+        the line breaks, lines longer than max_length are truncated
+        Return list of values
+    """
+    parts = []
+    lines = []
+    length = 0
+    for line in value.split(u'\n'):
+        if len(line) > max_length:
+            line = line[:max_length - len(CONTINUATION)] + CONTINUATION
+        if lines and length + 1 + len(line) > max_length:
+            parts.append(u'\n'.join(lines))
+            lines = []
+            length = 0
+        length += len(line) + (1 if lines else 0)
+        lines.append(line)
+    parts.append(u'\n'.join(lines))
+    return parts
+
+
+def split_attachment(attachment, max_field_length=MAX_FIELD_LENGTH):
+    """
+        Split an attachment with a field value longer than max_field_length
+        The last field (the messages) is continued in new attachments, with
+        the other fields repeated, the other fields are truncated
+        Return list of attachments
+    """
+    fields = attachment.get(u'fields') or []
+    if all(len(field.get(u'value', u'')) <= max_field_length
+           for field in fields):
+        return [attachment]
+
+    head_fields = []
+    for field in fields[:-1]:
+        value = field.get(u'value', u'')
+        if len(value) > max_field_length:
+            field = dict(field, value=value[:max_field_length - len(
+                                            CONTINUATION)] + CONTINUATION)
+        head_fields.append(field)
+
+    ret = []
+    for value in split_field_value(fields[-1].get(u'value', u''),
+                                   max_field_length):
+        ret.append(dict(attachment, fields=head_fields + [
+                                            dict(fields[-1], value=value)]))
+    return ret
+
+
+def get_json_dumps(name=u'json'):
+    """
+        Return the dumps function of the json library name: json (default),
+        simplejson or ujson (faster, if installed)
+        Raise ImportError if the library is not installed
+    """
+    if name == u'ujson':
+        import ujson
+
+        def dumps(obj):
+            return ujson.dumps(obj, escape_forward_slashes=False)
+        return dumps
+    if name == u'simplejson':
+        import simplejson
+        return simplejson.dumps
+    if name == u'json':
+        return json.dumps
+    raise ImportError(u'Unknown json library: %s' % name)
+
+
+def _iter_chunks(attachments, max_attachments, max_bytes, max_field_length,
+                 dumps):
+    """
+        Return generator of (chunk, json of each attachment of the chunk)
+    """
+    chunk = []
+    parts_json = []
+    chunk_bytes = 2
+    for attachment in attachments:
+        for part in split_attachment(attachment, max_field_length):
+            part_json = dumps(part)
+            part_bytes = len(part_json) + 2
+            if chunk and chunk_bytes + part_bytes > max_bytes:
+                yield chunk, parts_json
+                chunk = []
+                parts_json = []
+                chunk_bytes = 2
+            chunk.append(part)
+            parts_json.append(part_json)
+            chunk_bytes += part_bytes
+            # full chunks are yielded right away, before the next attachment
+            # is built
+            if len(chunk) >= max_attachments:
+                yield chunk, parts_json
+                chunk = []
+                parts_json = []
+                chunk_bytes = 2
+    if chunk:
+        yield chunk, parts_json
+
+
+def chunk_attachments(attachments, max_attachments=MAX_ATTACHMENTS,
+                      max_bytes=MAX_MESSAGE_BYTES,
+                      max_field_length=MAX_FIELD_LENGTH, dumps=json.dumps):
+    """
+        Group the attachments, in order, in chunks that fit in one slack
+        message: up to max_attachments and max_bytes of json each
+        An attachment bigger than max_bytes is sent alone
+        Return generator of lists of attachments
+    """
+    for chunk, parts_json in _iter_chunks(attachments, max_attachments,
+                                          max_bytes, max_field_length, dumps):
+        yield chunk
+
+
+def chunk_attachments_json(attachments, max_attachments=MAX_ATTACHMENTS,
+                           max_bytes=MAX_MESSAGE_BYTES,
+                           max_field_length=MAX_FIELD_LENGTH,
+                           dumps=json.dumps):
+    """
+        Same as chunk_attachments, but returning the json of each chunk,
+        joined from the json of the attachments already measured instead of
+        serializing the attachments again
+        Return generator of json strings
+    """
+    for chunk, parts_json in _iter_chunks(attachments, max_attachments,
+                                          max_bytes, max_field_length, dumps):
+        yield '[' + ', '.join(parts_json) + ']'
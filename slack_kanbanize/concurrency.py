@@ -0,0 +1,67 @@
+# coding=utf-8
+
+import threading
+from multiprocessing.pool import ThreadPool
+
+KANBANIZE = 'kanbanize'
+SLACK = 'slack'
+
+
+class IOCore(object):
+    """
+    Runs the network calls of many feeders with a limit of calls in flight
+    per service, so many boards can be collected at the same time without
+    flooding kanbanize or slack.
+    Calls run in the calling thread (call) or in a pool of threads shared by
+    all the feeders (submit / map), instead of a new pool for each collect.
+    """
+
+    def __init__(self, max_kanbanize_calls=8, max_slack_calls=4):
+        """
+            Arguments:
+            @max_kanbanize_calls - max kanbanize calls in flight
+            @max_slack_calls - max slack calls in flight
+        """
+        self.limits = {
+            KANBANIZE: threading.BoundedSemaphore(max_kanbanize_calls),
+            SLACK: threading.BoundedSemaphore(max_slack_calls),
+        }
+        self.workers = max_kanbanize_calls + max_slack_calls
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPool(self.workers)
+            return self.pool
+
+    def call(self, service, function, *args, **kwargs):
+        """
+            Call function, waiting for a free slot of service
+            Return the function result
+        """
+        with self.limits[service]:
+            return function(*args, **kwargs)
+
+    def submit(self, service, function, *args, **kwargs):
+        """
+            Call function in the pool, see call
+            Return multiprocessing.pool.AsyncResult of the call
+        """
+        return self._get_pool().apply_async(
+                        self.call, (service, function) + args, kwargs)
+
+    def map(self, service, function, iterable):
+        """
+            Call function with each item of iterable in the pool, see call
+            Return list with the results, in order
+        """
+        results = [self.submit(service, function, item) for item in iterable]
+        return [result.get() for result in results]
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
@@ -0,0 +1,120 @@
+# coding=utf-8
+
+import datetime
+
+from dateutil import tz
+
+KANBANIZE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+UTC_ZONE = tz.tzutc()
+ONE_HOUR = datetime.timedelta(hours=1)
+ONE_SECOND = datetime.timedelta(seconds=1)
+
+
+def parse_kanbanize_date(date_str):
+    """
+        Parse a date in KANBANIZE_DATE_FORMAT (ex: u'2014-10-02 20:21:06')
+        slicing the fixed positions of the string, which is much faster than
+        datetime.strptime
+        Return a naive datetime object
+    """
+    if len(date_str) != 19 or date_str[4] != u'-' or date_str[10] != u' ':
+        return datetime.datetime.strptime(date_str, KANBANIZE_DATE_FORMAT)
+    return datetime.datetime(int(date_str[0:4]), int(date_str[5:7]),
+                             int(date_str[8:10]), int(date_str[11:13]),
+                             int(date_str[14:16]), int(date_str[17:19]))
+
+
+def format_kanbanize_date(date):
+    """
+        Return date formatted in KANBANIZE_DATE_FORMAT, faster than strftime
+    """
+    return u'%04d-%02d-%02d %02d:%02d:%02d' % (date.year, date.month,
+                                                date.day, date.hour,
+                                                date.minute, date.second)
+
+
+def hour_floor(date):
+    """
+        Return date truncated to the hour
+    """
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+class DateConverter(object):
+    """
+    Converts kanbanize dates between UTC and the local zone.
+    The local zone is resolved once and the UTC offsets are memoized per
+    UTC hour, hours where the offset changes (DST transitions not aligned to
+    the hour) are never memoized and always converted by dateutil.
+    """
+    max_cached_hours = 24 * 366
+
+    def __init__(self, local_zone=None):
+        """
+            Arguments:
+            @local_zone - optional tzinfo to be used as local zone, if not
+                          passed dateutil.tz.tzlocal() is used
+        """
+        self.local_zone = local_zone or tz.tzlocal()
+        self.offsets = {}
+
+    def _utc_offset(self, naive_utc):
+        """
+            Return the local offset (timedelta) for the naive_utc datetime
+        """
+        hour = hour_floor(naive_utc)
+        offset = self.offsets.get(hour)
+        if offset is not None:
+            return offset
+
+        offset = hour.replace(tzinfo=UTC_ZONE).astimezone(
+                                                self.local_zone).utcoffset()
+        end_offset = (hour + ONE_HOUR - ONE_SECOND).replace(
+                        tzinfo=UTC_ZONE).astimezone(
+                                                self.local_zone).utcoffset()
+        if offset != end_offset:
+            # offset changes in the middle of this hour
+            return naive_utc.replace(tzinfo=UTC_ZONE).astimezone(
+                                                self.local_zone).utcoffset()
+
+        if len(self.offsets) >= self.max_cached_hours:
+            self.offsets.clear()
+        self.offsets[hour] = offset
+        return offset
+
+    def utc_to_local(self, naive_utc):
+        """
+            Return the naive local datetime of the naive_utc datetime
+        """
+        return naive_utc + self._utc_offset(naive_utc)
+
+    def local_to_utc(self, naive_local):
+        """
+            Return the naive UTC datetime of the naive_local datetime
+        """
+        date_aware = naive_local.replace(tzinfo=self.local_zone)
+        return date_aware.astimezone(UTC_ZONE).replace(tzinfo=None)
+
+    def local_to_utc_string(self, naive_local):
+        """
+            Return the naive_local datetime converted to UTC, formatted as
+            expected by the kanbanize api
+        """
+        return format_kanbanize_date(self.local_to_utc(naive_local))
+
+    def convert_utc_strings(self, date_strings):
+        """
+            Convert many kanbanize UTC date strings at once, each distinct
+            string is converted only once
+            Arguments:
+            @date_strings - iterable of dates in KANBANIZE_DATE_FORMAT
+            Return dict {date_string: (naive_utc_datetime, local_string)}
+        """
+        converted = {}
+        for date_str in date_strings:
+            if date_str in converted:
+                continue
+            naive_utc = parse_kanbanize_date(date_str)
+            converted[date_str] = (naive_utc, format_kanbanize_date(
+                                                self.utc_to_local(naive_utc)))
+        return converted
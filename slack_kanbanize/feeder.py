@@ -1,33 +1,144 @@
 # coding=utf-8
 
 import datetime
-import copy
+import inspect
 import json
+import logging
 import os
+import time
+from collections import OrderedDict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 
-from dateutil import tz
 from python_kanbanize.wrapper import Kanbanize
 from pyslack import SlackClient
 
+import cassette
+import checkpoint
+import chunker
+import concurrency
+import dates
+import formatters
+import stats
+import templates
+
+logger = logging.getLogger(__name__)
+
+# slack errors that posting the same message again can not fix, the
+# message is moved to the dead letters
+PERMANENT_SLACK_ERRORS = frozenset([
+    u'channel_not_found', u'is_archived', u'not_in_channel',
+    u'msg_too_long', u'invalid_attachments', u'too_many_attachments',
+])
+
+# answer of kanbanize when the window has no activities
+NO_ACTIVITIES = u'No activities found for the specified board and time range'
+
+
+def _get_error_message(error):
+    """
+        Return unicode with the message of an exception, ex: the slack api
+        error of a pyslack SlackError (u'channel_not_found')
+    """
+    message = error.args[0] if len(error.args) == 1 else error
+    try:
+        return unicode(message)
+    except UnicodeError:
+        return repr(message).decode('ascii')
+
 
 class Feeder(object):
     file_name = '.slack-kanbanize-last-msg'
+    activity_cache_grace = datetime.timedelta(minutes=5)
 
     def __init__(self, kanbanize_api_key, kanbanize_board_id, slack_token,
                  slack_channel, slack_user='slackbot',
                  kanbanize_timedelta_collect=datetime.timedelta(minutes=60),
-                 kanbanize_message_fomatter=None):
+                 kanbanize_message_fomatter=None, slack_client=None,
+                 kanbanize_client=None, checkpoint_store=None,
+                 kanbanize_seen_window=datetime.timedelta(0),
+                 slack_max_attachments=chunker.MAX_ATTACHMENTS,
+                 slack_max_message_bytes=chunker.MAX_MESSAGE_BYTES,
+                 kanbanize_rate_budget=None, kanbanize_max_wait=0,
+                 kanbanize_fetch_overlap=datetime.timedelta(minutes=5),
+                 kanbanize_max_timedelta_collect=datetime.timedelta(
+                                                                hours=24),
+                 kanbanize_activity_cache=None, kanbanize_page_workers=4,
+                 kanbanize_max_page_wait=600,
+                 kanbanize_formatter_cache_size=1024,
+                 slack_json_dumps=json.dumps, slack_retry_backoff=30,
+                 slack_max_retry_backoff=3600, slack_max_attempts=10,
+                 io_core=None, metrics=None):
         """
             Arguments:
             @kanbanize_api_key - kanbanize appi key to be used
             @kanbanize_board_id - kanbanize board_id to be monitored
             @kanbanize_timedelta_collect - timedelta to collect data from
-                                                  N time before now
+                                                  N time before now, when
+                                                  there is no last action
+                                                  time yet
+            @kanbanize_fetch_overlap - timedelta before the last action time
+                                       where the collect starts
+            @kanbanize_max_timedelta_collect - max timedelta collected, after
+                                               long outages
             @kanbanize_message_fomatter - function to override the format of
                                           '_default_message_formatter_function'
             @slack_token - slack token autorization to be used
             @slack_channel - slack channel to be used
             @slack_user - slack user to be used
+            @slack_client - optional SlackClient instance to be shared
+                            between feeders, if not passed a new one is built
+            @kanbanize_client - optional Kanbanize instance to be shared
+                                between feeders, if not passed a new one is
+                                built
+            @checkpoint_store - optional checkpoint.CheckpointStore keeping
+                                the last action time, to be shared between
+                                feeders, if not passed the default one is
+                                opened and the last action time of old
+                                versions (~/.slack-kanbanize-last-msg) is
+                                migrated to it
+            @kanbanize_seen_window - timedelta before the last action time
+                                     where activities are still accepted when
+                                     not posted yet (compared by content),
+                                     to support late activities / clock skew
+            @slack_max_attachments - max attachments posted in one message
+            @slack_max_message_bytes - max size of the attachments (json)
+                                       posted in one message
+            @slack_json_dumps - function serializing the attachments to json
+                                (see chunker.get_json_dumps)
+            @slack_retry_backoff - seconds to wait before posting again a
+                                   message not posted, doubled at each
+                                   failure
+            @slack_max_retry_backoff - max seconds between two attempts
+            @slack_max_attempts - attempts of posting a message before it is
+                                  moved to the dead letters (see
+                                  checkpoint.CheckpointStore.dead_letter),
+                                  messages failing with a permanent error
+                                  (see PERMANENT_SLACK_ERRORS) are moved at
+                                  the first attempt
+            @io_core - optional concurrency.IOCore, shared between
+                       feeders, limiting the kanbanize / slack calls in flight
+            @metrics - optional stats.Metrics, shared between feeders,
+                       receiving the timings and counters of each stage,
+                       labeled with the board
+            @kanbanize_rate_budget - optional rate_limit.RateBudget of the
+                                     api key, consulted before each call to
+                                     kanbanize
+            @kanbanize_max_wait - max seconds to wait for the rate budget,
+                                  if it takes longer the collect is skipped
+            @kanbanize_activity_cache - optional activity_cache.ActivityCache
+                                        serving the activities of the closed
+                                        hours
+            @kanbanize_page_workers - max activities pages fetched at the
+                                      same time
+            @kanbanize_max_page_wait - max seconds to wait for the rate
+                                       budget of the other pages, once the
+                                       first one was fetched
+            @kanbanize_formatter_cache_size - max messages memoized for the
+                                              default formatter or a pure
+                                              formatter (see
+                                              formatters.is_pure_formatter),
+                                              0 to disable
 
             obs: in slack free version there is a limit of "Limit per hour (per
                 API KEY)" of 30 calls
@@ -37,16 +148,129 @@ class Feeder(object):
             'api_key': kanbanize_api_key,
             'board_id': kanbanize_board_id,
             'collect_timedelta': kanbanize_timedelta_collect,
-            'kanbanize_message_fomatter': kanbanize_message_fomatter
+            'kanbanize_message_fomatter': kanbanize_message_fomatter,
+            'seen_window': kanbanize_seen_window,
+            'max_wait': kanbanize_max_wait,
+            'fetch_overlap': kanbanize_fetch_overlap,
+            'max_collect_timedelta': kanbanize_max_timedelta_collect,
+            'page_workers': kanbanize_page_workers,
+            'max_page_wait': kanbanize_max_page_wait,
+            'formatter_cache_size': kanbanize_formatter_cache_size
         }
         self.slack_opts = {
             'token': slack_token,
             'channel': slack_channel,
-            'user': slack_user
+            'user': slack_user,
+            'max_attachments': slack_max_attachments,
+            'max_message_bytes': slack_max_message_bytes,
+            'retry_backoff': slack_retry_backoff,
+            'max_retry_backoff': slack_max_retry_backoff,
+            'max_attempts': slack_max_attempts
         }
-        self.slack_client = SlackClient(slack_token)
-        self.kanbanize_client = Kanbanize(kanbanize_api_key)
-        self.last_action_file = self._get_last_action_file()
+        self.slack_client = slack_client or SlackClient(slack_token)
+        self.kanbanize_client = kanbanize_client or\
+            Kanbanize(kanbanize_api_key)
+        self.rate_budget = kanbanize_rate_budget
+        self.activity_cache = kanbanize_activity_cache
+        self.json_dumps = slack_json_dumps
+        self.io_core = io_core
+        self.metrics = metrics or stats.NULL_METRICS
+        self.metrics_labels = {'board': kanbanize_board_id}
+        self.date_converter = None
+        self.memoized_formatter = None
+        self.pages_supported = None
+        # error of the last message not posted, as answered by slack
+        self.slack_error = None
+        self.pending_checkpoint = None
+        self.checkpoint_key = (checkpoint.account_key(kanbanize_api_key),
+                               kanbanize_board_id, slack_channel)
+        if checkpoint_store is None:
+            checkpoint_store = checkpoint.CheckpointStore()
+            checkpoint_store.migrate_file(self._get_last_action_file_path(),
+                                          *self.checkpoint_key)
+        self.checkpoint_store = checkpoint_store
+
+    def _get_date_converter(self):
+        """
+            Return the dates.DateConverter of this feeder, built in the first
+            use so the local zone is resolved only once
+        """
+        if self.date_converter is None:
+            self.date_converter = dates.DateConverter()
+        return self.date_converter
+
+    def _get_memoized_formatter(self, formatter):
+        """
+            Return formatter memoized (see formatters.MemoizedFormatter), the
+            memo is kept while the formatter is the same, by this feeder and
+            by the MultiFeeder / RoutedFeeder that built it, whose next
+            feeders get it (see memoized_formatter)
+            Arguments:
+            @formatter - pure formatter
+        """
+        if self.memoized_formatter is None or\
+                self.memoized_formatter.formatter is not formatter:
+            self.memoized_formatter = formatters.MemoizedFormatter(
+                            formatter,
+                            self.kanbanize_opts['formatter_cache_size'])
+        return self.memoized_formatter
+
+    def _acquire_kanbanize_call(self, calls=1, max_wait=None):
+        """
+            Consult the rate budget before calling kanbanize, waiting up to
+            max_wait seconds for it
+            Arguments:
+            @calls - number of calls to be made
+            @max_wait - max seconds to wait, default is
+                        kanbanize_opts['max_wait']
+            Return False if the calls must be skipped
+        """
+        if self.rate_budget is None:
+            return True
+        if max_wait is None:
+            max_wait = self.kanbanize_opts['max_wait']
+        if calls > self.rate_budget.capacity:
+            logger.error(u'Kanbanize board %s needs %s calls at once, more'
+                         u' than the %d calls of the api budget, it can not'
+                         u' be collected: raise --kanbanize_calls_per_hour or'
+                         u' lower --kanbanize_max_timedelta_collect',
+                         self.kanbanize_opts['board_id'], calls,
+                         self.rate_budget.capacity)
+            return False
+        wait = self.rate_budget.wait_time(calls)
+        if wait > max_wait:
+            logger.warning(u'Kanbanize api budget exhausted, skipping board'
+                           u' %s, %s calls available in %ds',
+                           self.kanbanize_opts['board_id'], calls, wait)
+            return False
+        if wait:
+            time.sleep(wait)
+        if not self.rate_budget.try_acquire(calls):
+            # taken by other feeder in the meantime
+            logger.warning(u'Kanbanize api budget exhausted, skipping board'
+                           u' %s', self.kanbanize_opts['board_id'])
+            return False
+        logger.debug(u'Kanbanize api budget: %.1f calls left',
+                     self.rate_budget.remaining())
+        return True
+
+    def _get_collect_start_date(self, to_date):
+        """
+            Return the local datetime where the collect ending in to_date
+            starts: the last action time minus a safety overlap (already
+            posted activities are skipped when parsed), limited to
+            max_collect_timedelta before to_date
+            Without last action time, collect_timedelta before to_date
+        """
+        last_date = self._get_last_action_time()
+        if last_date is None:
+            return to_date - self.kanbanize_opts['collect_timedelta']
+        overlap = max(self.kanbanize_opts['fetch_overlap'],
+                      self.kanbanize_opts['seen_window'])
+        from_date = self._get_date_converter().utc_to_local(last_date) -\
+            overlap
+        return max(from_date,
+                   to_date - self.kanbanize_opts['max_collect_timedelta'])
 
     def _get_kanbanize_board_activities(self, from_date=None,
                                         to_date=None):
@@ -54,32 +278,211 @@ class Feeder(object):
             Used to get python-kanbanize.get_board_activities
             Arguments:
             @from_date - datetime object to be used in get_board_activities
+                         if not passed, it is derived from the last action
+                         time (see _get_collect_start_date)
             @to_date - datetime object to be used in get_board_activities
                        if not passed, to_date will be now + 60 minutes,
                        because kanbanize api dont works wiell if end date
                        is not full hour, so we use this work arround
-            Return a list with board activities
+            Return a list with board activities or None if the kanbanize api
+            budget is exhausted
         """
         if not to_date:
             to_date = datetime.datetime.now() + datetime.timedelta(minutes=60)
         if not from_date:
-            from_date = to_date - self.kanbanize_opts['collect_timedelta']
-        UTC_ZONE = tz.tzutc()
-        LOCAL_ZONE = tz.tzlocal()
-
-        from_date_aware = from_date.replace(tzinfo=LOCAL_ZONE)
-        from_dt_utc_string = from_date_aware.astimezone(
-                                                    UTC_ZONE).strftime(
-                                                           "%Y-%m-%d %H:%M:%S")
-        to_date_aware = to_date.replace(tzinfo=LOCAL_ZONE)
-        to_dt_utc_string = to_date_aware.astimezone(
-                                                    UTC_ZONE).strftime(
-                                                           "%Y-%m-%d %H:%M:%S")
-
-        return self.kanbanize_client.get_board_activities(
+            from_date = self._get_collect_start_date(to_date)
+        converter = self._get_date_converter()
+        with self.metrics.timer('fetch_seconds', **self.metrics_labels):
+            if self.activity_cache is not None:
+                return self._get_cached_board_activities(
+                                        converter.local_to_utc(from_date),
+                                        converter.local_to_utc(to_date))
+            return self._fetch_board_activities(
+                                    converter.local_to_utc_string(from_date),
+                                    converter.local_to_utc_string(to_date))
+
+    def _fetch_board_activities(self, from_dt_utc_string, to_dt_utc_string):
+        """
+            Call kanbanize get_board_activities, if the rate budget allows
+            When the activities don't fit in one page, the other pages are
+            fetched concurrently (up to kanbanize_opts['page_workers'] at a
+            time) and all the activities are merged, newest first, without
+            the ones repeated in two pages
+            Arguments:
+            @from_dt_utc_string / to_dt_utc_string - UTC dates in the
+                                                     kanbanize format
+            Return the raw data or None if the budget is exhausted or a page
+            is not fetched
+        """
+        if not self._acquire_kanbanize_call():
+            return None
+        raw_data = self._call_kanbanize(
+                                    self.kanbanize_client.get_board_activities,
+                                    self.kanbanize_opts['board_id'],
+                                    from_dt_utc_string,
+                                    to_dt_utc_string)
+        if not isinstance(raw_data, dict):
+            return raw_data
+        activities = raw_data.get(u'activities') or []
+        total = int(raw_data.get(u'allactivities') or 0)
+        if not activities or total <= len(activities):
+            return raw_data
+
+        pages = (total + len(activities) - 1) / len(activities)
+        if not self._supports_pages():
+            logger.error(u'Kanbanize board %s has %s activities in %s pages,'
+                         u' but the get_board_activities of the installed'
+                         u' python-kanbanize does not accept the page'
+                         u' argument, upgrade it to collect the board',
+                         self.kanbanize_opts['board_id'], total, pages)
+            return None
+        # all pages or none, a partial result would lose activities. The
+        # first page is already paid for, so the budget of the others is
+        # waited for longer than the one of a new collect
+        if not self._acquire_kanbanize_call(
+                        pages - 1, max(self.kanbanize_opts['max_wait'],
+                                       self.kanbanize_opts['max_page_wait'])):
+            return None
+
+        def fetch_page(page):
+            page_data = self.kanbanize_client.get_board_activities(
                                                self.kanbanize_opts['board_id'],
                                                from_dt_utc_string,
-                                               to_dt_utc_string)
+                                               to_dt_utc_string,
+                                               page=page)
+            if not isinstance(page_data, dict) or\
+                    u'activities' not in page_data:
+                logger.error(u'Unexpected answer of kanbanize for page %s'
+                             u' of board %s: %r', page,
+                             self.kanbanize_opts['board_id'], page_data)
+                return None
+            return page_data[u'activities'] or []
+
+        if self.io_core is not None:
+            other_pages = self.io_core.map(concurrency.KANBANIZE,
+                                           fetch_page, range(2, pages + 1))
+        else:
+            pool = ThreadPool(max(1, min(self.kanbanize_opts['page_workers'],
+                                         pages - 1)))
+            try:
+                other_pages = pool.map(fetch_page, range(2, pages + 1))
+            finally:
+                pool.close()
+
+        if None in other_pages:
+            return None
+        # activities added while the pages are fetched move the older ones
+        # to the next page, they are kept once
+        hashes = set(checkpoint.activity_hash(raw_activity)
+                     for raw_activity in activities)
+        for page_activities in other_pages:
+            for raw_activity in page_activities:
+                activity_hash = checkpoint.activity_hash(raw_activity)
+                if activity_hash not in hashes:
+                    hashes.add(activity_hash)
+                    activities.append(raw_activity)
+        activities.sort(key=lambda raw_activity: raw_activity[u'date'],
+                        reverse=True)
+        return dict(raw_data, activities=activities)
+
+    def _supports_pages(self):
+        """
+            Return False if the get_board_activities of the kanbanize client
+            does not accept the page argument (older python-kanbanize), it
+            is checked once, on the client wrapped by a recording one
+        """
+        if self.pages_supported is None:
+            client = self.kanbanize_client
+            while isinstance(client, cassette.RecordingKanbanize):
+                client = client.client
+            try:
+                args, varargs, keywords, defaults = inspect.getargspec(
+                                                client.get_board_activities)
+                self.pages_supported = 'page' in args or keywords is not None
+            except TypeError:
+                # not a python function, ex: a mock
+                self.pages_supported = True
+        return self.pages_supported
+
+    def _call_kanbanize(self, function, *args, **kwargs):
+        """
+            Call a kanbanize client function, through the io core if there
+            is one
+        """
+        if self.io_core is not None:
+            return self.io_core.call(concurrency.KANBANIZE, function,
+                                     *args, **kwargs)
+        return function(*args, **kwargs)
+
+    def _get_cached_board_activities(self, from_date_utc, to_date_utc):
+        """
+            Get the board activities between the naive UTC datetimes, taking
+            the closed hours from the activity cache, kanbanize is called
+            only from the first hour not cached on: from its start if it is
+            closed (so it is cached), else from from_date_utc
+            Return the raw data (dict with the activities) or None if the
+            budget is exhausted or kanbanize answered with an error, nothing
+            is cached then
+        """
+        account, board_id = self.checkpoint_key[:2]
+        # an hour is closed (never changes again) some minutes after its end
+        closed_before = dates.hour_floor(datetime.datetime.utcnow() -
+                                         self.activity_cache_grace)
+        hours = []
+        hour = dates.hour_floor(from_date_utc)
+        while hour < to_date_utc:
+            hours.append(hour)
+            hour += dates.ONE_HOUR
+        closed_hours = [hour for hour in hours
+                        if hour + dates.ONE_HOUR <= closed_before]
+
+        cached = self.activity_cache.get_hours(account, board_id,
+                                               closed_hours)
+        missing = [hour for hour in hours if hour not in cached]
+        if not missing:
+            fetch_from = to_date_utc
+            fetched = []
+        else:
+            if missing[0] in closed_hours:
+                fetch_from = missing[0]
+            else:
+                fetch_from = max(from_date_utc, missing[0])
+            raw_data = self._fetch_board_activities(
+                                        dates.format_kanbanize_date(
+                                                                fetch_from),
+                                        dates.format_kanbanize_date(
+                                                                to_date_utc))
+            if raw_data is None:
+                return None
+            if isinstance(raw_data, dict) and u'activities' in raw_data:
+                fetched = raw_data[u'activities'] or []
+            elif isinstance(raw_data, basestring) and\
+                    NO_ACTIVITIES in raw_data:
+                fetched = []
+            else:
+                # caching an error as empty hours would lose their activities
+                logger.error(u'Unexpected answer of kanbanize for board %s,'
+                             u' not cached: %r',
+                             self.kanbanize_opts['board_id'], raw_data)
+                return None
+
+            # only the closed hours fetched in full
+            fetched_hours = dict((hour, []) for hour in closed_hours
+                                 if hour >= fetch_from and
+                                 hour + dates.ONE_HOUR <= to_date_utc)
+            for raw_activity in fetched:
+                hour = dates.hour_floor(dates.parse_kanbanize_date(
+                                                        raw_activity[u'date']))
+                if hour in fetched_hours:
+                    fetched_hours[hour].append(raw_activity)
+            self.activity_cache.put_hours(account, board_id, fetched_hours)
+
+        # newest activities first, as returned by kanbanize
+        activities = list(fetched)
+        for hour in sorted(cached, reverse=True):
+            if hour < fetch_from:
+                activities.extend(cached[hour])
+        return {u'activities': activities}
 
     def _post_slack_message(self, text, **params):
         """
@@ -91,11 +494,144 @@ class Feeder(object):
             Return True if all ok with api communication
         """
         params.update({'username': self.slack_opts['user']})
-        ret = self.slack_client.chat_post_message(self.slack_opts['channel'],
-                                                  text,
-                                                  **params)
+        with self.metrics.timer('slack_post_seconds', **self.metrics_labels):
+            if self.io_core is not None:
+                ret = self.io_core.call(concurrency.SLACK,
+                                        self.slack_client.chat_post_message,
+                                        self.slack_opts['channel'], text,
+                                        **params)
+            else:
+                ret = self.slack_client.chat_post_message(
+                                                self.slack_opts['channel'],
+                                                text,
+                                                **params)
+        self.metrics.incr('messages_posted_total',
+                          status='ok' if ret[u'ok'] else 'error',
+                          **self.metrics_labels)
+        if not ret[u'ok']:
+            self.slack_error = ret.get(u'error')
         return ret[u'ok']
 
+    def _post_slack_attachments(self, attachments):
+        """
+            Post the attachments in as many messages as needed to fit in the
+            slack limits (see chunker.chunk_attachments), in order
+            Each message is posted as soon as its attachments are available,
+            after a message fails the next ones are not posted, to keep the
+            order
+            Arguments:
+            @attachments - iterable of attachments, from _iter_slack_messages
+            Return list with the attachments (json) of the messages not
+            posted, empty if all were posted
+        """
+        chunks = chunker.chunk_attachments_json(
+                                        attachments,
+                                        self.slack_opts['max_attachments'],
+                                        self.slack_opts['max_message_bytes'],
+                                        dumps=self.json_dumps)
+        for index, chunk in enumerate(chunks):
+            if not self._post_slack_attachments_json(chunk):
+                logger.error(u'Message %s of kanbanize board %s not posted',
+                             index + 1, self.kanbanize_opts['board_id'])
+                return [chunk] + list(chunks)
+        return []
+
+    def _post_slack_attachments_json(self, attachments_json):
+        """
+            Post one message with the attachments (json)
+            Return True if it was posted
+        """
+        self.metrics.observe('payload_bytes', len(attachments_json),
+                             **self.metrics_labels)
+        self.slack_error = None
+        try:
+            return self._post_slack_message(text=None,
+                                            icon_emoji=u':alien:',
+                                            attachments=attachments_json)
+        except Exception as e:
+            logger.exception(u'Error posting message of kanbanize board %s',
+                             self.kanbanize_opts['board_id'])
+            # pyslack raises SlackError with the error of the slack api
+            self.slack_error = _get_error_message(e)
+            return False
+
+    def _get_retry_delay(self, attempts):
+        """
+            Return the timedelta to wait before posting again a message that
+            failed attempts times (exponential backoff)
+        """
+        return datetime.timedelta(seconds=min(
+                    self.slack_opts['retry_backoff'] * 2 ** (attempts - 1),
+                    self.slack_opts['max_retry_backoff']))
+
+    def _flush_outbox(self):
+        """
+            Post, in order, the messages waiting in the outbox whose next
+            attempt is due, stopping at the first one that is not posted
+            Messages failing with a permanent slack error or for the
+            slack_opts['max_attempts'] time are moved to the dead letters
+            The posted messages are acked in one transaction
+            Return True if the outbox is empty
+        """
+        now = datetime.datetime.utcnow()
+        posted = []
+        try:
+            for message_id, payload, attempts, next_attempt in\
+                    self.checkpoint_store.get_outbox(*self.checkpoint_key):
+                if next_attempt > now:
+                    logger.info(u'Messages of kanbanize board %s waiting to'
+                                u' be posted again at %s',
+                                self.kanbanize_opts['board_id'],
+                                next_attempt)
+                    return False
+                if self._post_slack_attachments_json(payload):
+                    posted.append(message_id)
+                    continue
+                if self.slack_error in PERMANENT_SLACK_ERRORS or\
+                        attempts + 1 >= self.slack_opts['max_attempts']:
+                    logger.error(u'Message of kanbanize board %s to %s moved'
+                                 u' to the dead letters after %s attempts,'
+                                 u' error was: %s',
+                                 self.kanbanize_opts['board_id'],
+                                 self.slack_opts['channel'], attempts + 1,
+                                 self.slack_error)
+                    self.checkpoint_store.dead_letter(message_id,
+                                                      self.slack_error, now)
+                    continue
+                self.checkpoint_store.retry(
+                    message_id, now + self._get_retry_delay(attempts + 1))
+                return False
+        finally:
+            if posted:
+                self.checkpoint_store.ack(*posted)
+        return True
+
+    def _save_checkpoint(self):
+        """
+            Save the checkpoint (last action time and seen activities) of
+            the activities parsed by _parse_kanbanize_activities, after they
+            are posted
+        """
+        if self.pending_checkpoint is None:
+            return
+        last_date, seen, evict_before = self.pending_checkpoint
+        self._save_seen_activities(seen, evict_before)
+        self._save_last_action_time(last_date)
+        self.pending_checkpoint = None
+
+    def _enqueue_checkpoint(self, payloads):
+        """
+            Keep the messages not posted in the outbox, with the checkpoint of
+            the activities parsed by _parse_kanbanize_activities, saved when
+            all of them are posted
+        """
+        last_date, seen, evict_before = self.pending_checkpoint
+        self.checkpoint_store.enqueue(*(self.checkpoint_key + (
+                            payloads, last_date, seen, evict_before,
+                            datetime.datetime.utcnow() +
+                            self._get_retry_delay(1))))
+        self.pending_checkpoint = None
+
     @staticmethod
     def _default_message_formatter_function(activity_data):
         """
@@ -106,41 +642,24 @@ class Feeder(object):
                             {u'event': u'Task updated',
                              u'text': u'New tag:', u'author': u'mportela'}
             Return the formatted_string for the activity, based in the 'event'
+            (see templates.DEFAULT_CONFIG)
         """
-        events_emoji_traslator = {
-            u'Task archived': u':+1:',
-            u'Assignee changed': u':octocat:',
-            u'Comment added': u':speech_balloon:',
-            u'Task moved': u':rocket:',
-            u'Attachments updated': u':paperclip:',
-            u'Task updated': u':pencil:',
-            u'Task created': u':ticket:',
-            u'External link changed': u':link:',
-            u'Tags changed': u':triangular_flag_on_post:'
-            }
-        emoji = u''
-        event = activity_data.get(u'event', u'')
-        user = u'*%s*' % activity_data.get(u'author', u'')
-        text = activity_data.get(u'text', u'')
-        try:
-            emoji = u'%s ' % events_emoji_traslator[event]
-        except KeyError, e:
-            # case of event not know, just return the name with italic format
-            event = u'_%s_' % event
-
-        msg = u"%sUser: %s Event: %s"\
-              u": %s" % (emoji, user, event, text)
-
-        return msg
+        return templates.DEFAULT_FORMATTER(activity_data)
 
     def _parse_kanbanize_activities(self, raw_data,
-                msg_formatter_function=None):
+                msg_formatter_function=None, routed=None):
         """
             Used to process activities, grouping by same taskid / date
+            tasks are returned in the order they are first seen and the dates
+            of each task (an OrderedDict) in chronological order
             Arguments:
             @raw_data - raw_data returned from
                         kanbanize._get_kanbanize_board_activities
             @msg_formatter_function - function to be used to format each msg
+                                      or batch formatter (see formatters)
+            @routed - optional set with the indexes of the raw activities
+                      routed to this feeder (see routing.Router.route), the
+                      others only move the last action time
             Return list with objects grouped by taskid / date
             example of return:
             [{u'taskid': u'125',
@@ -150,66 +669,124 @@ class Feeder(object):
                              u'formatted_message': 'foo fmted'}]}
              },...]
         """
-        if u"No activities found for the specified board and time range" in\
-            raw_data:
+        if NO_ACTIVITIES in raw_data:
             return []
+        start = time.time()
+        # the default formatter is pure
+        pure = not msg_formatter_function or\
+            formatters.is_pure_formatter(msg_formatter_function)
         if not msg_formatter_function:
             msg_formatter_function =\
                 Feeder._default_message_formatter_function
+        if pure and self.kanbanize_opts['formatter_cache_size']:
+            msg_formatter_function = self._get_memoized_formatter(
+                                                    msg_formatter_function)
         raw_activities = raw_data.get(u'activities', [])
         ret_list = []
-        UTC_ZONE = tz.tzutc()
-        LOCAL_ZONE = tz.tzlocal()
+        # tasks of ret_list indexed by taskid
+        tasks_index = {}
+        # converting dates comming from utc to local time, all at once
+        converted_dates = self._get_date_converter().convert_utc_strings(
+                    raw_activity[u'date'] for raw_activity in raw_activities)
 
         last_date = self._get_last_action_time()
         new_last_date = last_date
+        seen_since = None
+        seen = set()
+        if last_date:
+            seen_since = last_date - self.kanbanize_opts['seen_window']
+            seen = self._get_seen_activities(seen_since)
+        new_seen = {}
+        # (taskid, local date, activity) of the activities to be posted
+        new_activities = []
+
+        for index, raw_activity in enumerate(raw_activities):
+            date_in_naive_utc, date_converted_local = converted_dates[
+                                                        raw_activity[u'date']]
 
-        for raw_activity in raw_activities:
-            # converting date comming from utc to local time
-            date_in_naive_utc = datetime.datetime.strptime(
-                                                  raw_activity[u'date'],
-                                                  "%Y-%m-%d %H:%M:%S")
-            date_in_aware_utc = date_in_naive_utc.replace(
-                                                        tzinfo=UTC_ZONE)
-            date_converted_local = date_in_aware_utc.astimezone(
-                                                   LOCAL_ZONE).strftime(
-                                                           "%Y-%m-%d %H:%M:%S")
-            
             if new_last_date:
                 if date_in_naive_utc > new_last_date:
                     new_last_date = date_in_naive_utc
             else:
                 new_last_date = date_in_naive_utc
 
-            if last_date:
-                if date_in_naive_utc <= last_date:
+            if routed is not None and index not in routed:
+                continue
+
+            if seen_since:
+                if date_in_naive_utc < seen_since:
                     continue
-            
+                # without seen activities (saved by older versions) the last
+                # action time itself is the limit
+                if not seen and date_in_naive_utc <= last_date:
+                    continue
+            activity_hash = checkpoint.activity_hash(raw_activity)
+            if activity_hash in seen:
+                continue
+            new_seen[activity_hash] = date_in_naive_utc
+
             activity = {
                 u'author': raw_activity[u'author'],
                 u'event': raw_activity[u'event'],
                 u'text': raw_activity[u'text'],
                 u'formatted_message': u''}
-            activity[u'formatted_message'] = msg_formatter_function(activity)
+            new_activities.append((raw_activity[u'taskid'],
+                                   date_converted_local, activity))
+
+        # formatting all the activities at once (see formatters module)
+        with self.metrics.timer('format_seconds', **self.metrics_labels):
+            messages = formatters.format_activities(
+                    msg_formatter_function,
+                    [activity for taskid, date, activity in new_activities])
+
+        if isinstance(msg_formatter_function, formatters.MemoizedFormatter):
+            logger.debug(u'Formatter memo of kanbanize board %s: %s hits,'
+                         u' %s misses', self.kanbanize_opts['board_id'],
+                         msg_formatter_function.hits,
+                         msg_formatter_function.misses)
 
+        for (taskid, date, activity), message in zip(new_activities,
+                                                     messages):
+            activity[u'formatted_message'] = message
             if not activity[u'formatted_message']:
                 continue
 
-            for item in ret_list:
-                # if in result yet, update the date / activities
-                if item[u'taskid'] == raw_activity[u'taskid']:
-                    item[u'activities'].setdefault(date_converted_local, [])
-                    item[u'activities'][date_converted_local].append(activity)
-                    break
-            else:
+            task = tasks_index.get(taskid)
+            if task is None:
                 # if not in result yet, add new task
                 task = {
-                    u'taskid': raw_activity[u'taskid'],
-                    u'activities': {date_converted_local: [activity]},
+                    u'taskid': taskid,
+                    u'activities': OrderedDict(),
                     }
+                tasks_index[taskid] = task
                 ret_list.append(task)
+            task[u'activities'].setdefault(date, [])
+            task[u'activities'][date].append(activity)
+
+        # tasks are kept in the order they were first seen and the dates of
+        # each task in chronological order
+        for task in ret_list:
+            task[u'activities'] = OrderedDict(sorted(
+                            task[u'activities'].iteritems(),
+                            key=lambda date_activities: date_activities[0]))
 
-        self._save_last_action_time(new_last_date)
+        self.metrics.incr('activities_fetched_total', len(raw_activities),
+                          **self.metrics_labels)
+        self.metrics.incr('activities_filtered_total',
+                          len(raw_activities) - len(new_activities),
+                          **self.metrics_labels)
+        self.metrics.incr('activities_formatted_total',
+                          sum(1 for message in messages if message),
+                          **self.metrics_labels)
+        self.metrics.observe('parse_seconds', time.time() - start,
+                             **self.metrics_labels)
+
+        # the checkpoint is only saved after the messages are posted (see
+        # _save_checkpoint)
+        self.pending_checkpoint = None
+        if new_last_date:
+            self.pending_checkpoint = (new_last_date, new_seen, new_last_date -
+                                       self.kanbanize_opts['seen_window'])
 
         return ret_list
 
@@ -223,81 +800,317 @@ class Feeder(object):
             Return list with dicts of attachments in slack format
             see tests for example
         """
-        ret_list = []
-        attachment_template = {
-                u'color': u'good',
-                u'mrkdwn_in': [u'fields'],
-                u'fields': [
+        return list(self._iter_slack_messages(activities))
+
+    def _iter_slack_messages(self, activities):
+        """
+            Same as _format_slack_messages, but yielding the attachments one
+            by one, so they can be posted as they are built
+        """
+        task_url = u'<https://kanbanize.com/ctrl_board/%s/%%s|%%s>' %\
+            self.kanbanize_opts['board_id']
+
+        for activity in activities:
+            task_dates = activity['activities']
+            # parsed activities keep the dates in chronological order, other
+            # dicts are sorted so the messages have always the same order
+            if isinstance(task_dates, OrderedDict):
+                dates_order = task_dates
+            else:
+                dates_order = sorted(task_dates)
+            task_value = task_url % (activity['taskid'], activity['taskid'])
+
+            # the attachments are built directly, they are small enough that
+            # copying a template costs more than the literals
+            for date in dates_order:
+                self.metrics.incr('attachments_total', **self.metrics_labels)
+                yield {
+                    u'color': u'good',
+                    u'mrkdwn_in': [u'fields'],
+                    u'fields': [
                         {
                             u'title': u'Task',
-                            u'value': u'',
+                            u'value': task_value,
                             u'short': True
                         },
                         {
-                            u'value': u''
+                            u'value': u'\n'.join([
+                                        item['formatted_message']
+                                        for item in task_dates[date]])
                         }
-                ]
-        }
-
-        for activity in activities:
-            for date in activity['activities']:
-                attach = copy.deepcopy(attachment_template)
-
-                attach[u'fields'][0][u'value'] =\
-                    '<https://kanbanize.com/ctrl_board/%s/%s|%s>' %\
-                            (self.kanbanize_opts['board_id'],
-                             activity['taskid'], activity['taskid'])
+                    ]
+                }
 
-                msgs = [item['formatted_message'] for item in activity[
-                                                        'activities'][date]]
-                attach[u'fields'][1][u'value'] = u'\n'.join(msgs)
-                ret_list.append(attach)
-
-        return ret_list
-
-    def _get_last_action_file(self):
-        home = os.path.expanduser('~')
-        file_path = os.path.join(home, self.file_name)
-        file = open(file_path, 'a+')
-        file.seek(0)
-        return file
+    def _get_last_action_file_path(self):
+        """
+            Return the path of the file used by old versions to keep the last
+            action time
+        """
+        return os.path.join(os.path.expanduser('~'), self.file_name)
 
     def _save_last_action_time(self, date):
-        file = self.last_action_file
-
-        file.truncate(0)
-        file.write(date.strftime('%Y-%m-%dT%H:%M:%S.%f'))
-        file.flush()
+        self.checkpoint_store.save(*(self.checkpoint_key + (date,)))
 
     def _get_last_action_time(self):
-        file = self.last_action_file
-        date_str = file.readline().strip()
+        return self.checkpoint_store.get(*self.checkpoint_key)
 
-        if not date_str:
-            return None
+    def _save_seen_activities(self, seen, evict_before):
+        self.checkpoint_store.save_seen(*(self.checkpoint_key +
+                                          (seen, evict_before)))
 
-        date = datetime.datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S.%f')
-        return date
+    def _get_seen_activities(self, since):
+        return self.checkpoint_store.get_seen(*(self.checkpoint_key +
+                                                (since,)))
 
     def run(self):
         """
         Main method to start this Feeder to collect kanbanize activities
         and post the slack message with all collected data
+        Return False if some message could not be posted
         """
+        # messages not posted in previous runs go first, the activities
+        # after them are only collected when they are all posted
+        if not self._flush_outbox():
+            return False
+
         raw_data = self._get_kanbanize_board_activities()
+        if raw_data is None:
+            return False
         activities = self._parse_kanbanize_activities(raw_data,
                             self.kanbanize_opts['kanbanize_message_fomatter'])
-        attachments = self._format_slack_messages(activities)
-
-        if attachments:
-            kwargs = {
-                'text': None,
-                'icon_emoji': u':alien:',
-                'attachments': json.dumps(attachments)
-            }
-            self._post_slack_message(**kwargs)
+        # the raw data is not needed anymore, let it be collected before the
+        # messages are built
+        del raw_data
+        return self._post_activities(activities)
 
-        self.last_action_file.flush()
-        self.last_action_file.close()
+    def _post_activities(self, activities):
+        """
+            Post the activities parsed by _parse_kanbanize_activities and
+            save their checkpoint, or keep the messages not posted in the
+            outbox
+            Return False if some message could not be posted
+        """
+        # attachments are built and posted chunk by chunk
+        not_posted = self._post_slack_attachments(
+                                    self._iter_slack_messages(activities))
+        if not_posted:
+            self._enqueue_checkpoint(not_posted)
+            return False
 
+        self._save_checkpoint()
         return True
+
+
+class RoutedFeeder(object):
+    """
+    Feeds one kanbanize board into many slack channels, routing each activity
+    with a routing.Router: the board is fetched once per run for all the
+    channels and the activities fan out to one Feeder per channel, each
+    keeping its own checkpoint (last action time, seen activities and
+    outbox).
+    """
+
+    def __init__(self, kanbanize_api_key, kanbanize_board_id, slack_token,
+                 router, slack_client=None, kanbanize_client=None,
+                 checkpoint_store=None, **feeder_kwargs):
+        """
+            Arguments:
+            @router - routing.Router with the routes of the board
+            @feeder_kwargs - other keyword arguments passed to each Feeder,
+                             ex: slack_user, kanbanize_timedelta_collect
+            the other arguments are the same used by Feeder, the clients
+            and the checkpoint store are shared by the feeders of the
+            channels
+        """
+        self.router = router
+        # memo of the formatter, shared by the feeders of the channels
+        self.memoized_formatter = None
+        slack_client = slack_client or SlackClient(slack_token)
+        kanbanize_client = kanbanize_client or Kanbanize(kanbanize_api_key)
+        checkpoint_store = checkpoint_store or checkpoint.CheckpointStore()
+        self.channel_feeders = []
+        for channel in router.channels:
+            channel_feeder = Feeder(kanbanize_api_key, kanbanize_board_id,
+                                    slack_token, channel,
+                                    slack_client=slack_client,
+                                    kanbanize_client=kanbanize_client,
+                                    checkpoint_store=checkpoint_store,
+                                    **feeder_kwargs)
+            channel_feeder.metrics_labels['channel'] = channel
+            self.channel_feeders.append(channel_feeder)
+        # fetches the board for all the channels, it never posts
+        self.board_feeder = Feeder(kanbanize_api_key, kanbanize_board_id,
+                                   slack_token, None,
+                                   slack_client=slack_client,
+                                   kanbanize_client=kanbanize_client,
+                                   checkpoint_store=checkpoint_store,
+                                   **feeder_kwargs)
+
+    @property
+    def kanbanize_client(self):
+        return self.board_feeder.kanbanize_client
+
+    @kanbanize_client.setter
+    def kanbanize_client(self, kanbanize_client):
+        self.board_feeder.kanbanize_client = kanbanize_client
+
+    def run(self):
+        """
+        Collect the kanbanize activities once and post them to the channels
+        they are routed to, the channels with messages waiting in the outbox
+        are skipped until they are posted
+        Return False if some message could not be posted
+        """
+        ready = [channel_feeder for channel_feeder in self.channel_feeders
+                 if channel_feeder._flush_outbox()]
+        if not ready:
+            return False
+
+        # from the oldest checkpoint on, each channel skips the activities
+        # it already posted
+        to_date = datetime.datetime.now() + datetime.timedelta(minutes=60)
+        from_date = min(channel_feeder._get_collect_start_date(to_date)
+                        for channel_feeder in ready)
+        raw_data = self.board_feeder._get_kanbanize_board_activities(
+                                                            from_date, to_date)
+        if raw_data is None:
+            return False
+        routed = {}
+        if isinstance(raw_data, dict):
+            routed = self.router.route(raw_data.get(u'activities') or [])
+
+        ret = len(ready) == len(self.channel_feeders)
+        for channel_feeder in ready:
+            channel_feeder.memoized_formatter = self.memoized_formatter
+            activities = channel_feeder._parse_kanbanize_activities(
+                        raw_data,
+                        channel_feeder.kanbanize_opts[
+                                            'kanbanize_message_fomatter'],
+                        routed.get(channel_feeder.slack_opts['channel'],
+                                   set()))
+            self.memoized_formatter = channel_feeder.memoized_formatter
+            ret = channel_feeder._post_activities(activities) and ret
+        return ret
+
+
+class MultiFeeder(object):
+    """
+    Feeds many kanbanize boards into the same slack channel (or the channels
+    of a routing.Router), polling the boards concurrently over a bounded
+    pool of worker threads.
+    One Kanbanize, one SlackClient, one CheckpointStore and one
+    concurrency.IOCore (limiting the kanbanize / slack calls in flight) are
+    shared by all the boards, each board keeps its own last action time and
+    a failure in one board does not affect the others.
+    """
+
+    def __init__(self, kanbanize_api_key, kanbanize_board_ids, slack_token,
+                 slack_channel, max_workers=4, board_timeout=None,
+                 transport=None, io_core=None, checkpoint_store=None,
+                 router=None, profiler=None, **feeder_kwargs):
+        """
+            Arguments:
+            @kanbanize_board_ids - list of kanbanize board ids to be monitored
+            @max_workers - max number of boards processed at the same time
+            @board_timeout - optional seconds to wait for each board, boards
+                             taking longer are reported as failed
+            @transport - optional transport.Transport whose connection pool
+                         is used by the shared clients
+            @io_core - optional concurrency.IOCore, if not passed one with
+                       the default limits is built
+            @checkpoint_store - optional checkpoint.CheckpointStore, if not
+                                passed the default one is opened
+            @router - optional routing.Router, routing the activities of
+                      each board to many channels (see RoutedFeeder)
+                      instead of slack_channel
+            @profiler - optional profiling.Profiler, the run of each board is
+                        profiled in its worker thread, labeled with the board
+                        id (see profiling.Profiler.for_label)
+            @feeder_kwargs - other keyword arguments passed to each Feeder,
+                             ex: slack_user, kanbanize_timedelta_collect
+            the other arguments are the same used by Feeder
+        """
+        self.kanbanize_board_ids = list(kanbanize_board_ids)
+        self.feeder_args = (kanbanize_api_key, slack_token, slack_channel)
+        self.feeder_kwargs = feeder_kwargs
+        self.max_workers = max_workers
+        self.board_timeout = board_timeout
+        if transport is None:
+            self.slack_client = SlackClient(slack_token)
+            self.kanbanize_client = Kanbanize(kanbanize_api_key)
+        else:
+            self.slack_client = transport.slack_client(slack_token)
+            self.kanbanize_client = transport.kanbanize_client(
+                                                        kanbanize_api_key)
+        self.checkpoint_store = checkpoint_store or\
+            checkpoint.CheckpointStore()
+        self.io_core = io_core or concurrency.IOCore()
+        self.router = router
+        self.profiler = profiler
+        # memo of the formatter, kept between the runs of the boards (their
+        # feeders are built again on each run)
+        self.memoized_formatter = None
+
+    def _get_board_feeder(self, board_id):
+        """
+            Return a Feeder for board_id (or a RoutedFeeder, with a router)
+            using the shared clients and checkpoint store
+        """
+        api_key, slack_token, slack_channel = self.feeder_args
+        if self.router is not None:
+            return RoutedFeeder(api_key, board_id, slack_token, self.router,
+                                slack_client=self.slack_client,
+                                kanbanize_client=self.kanbanize_client,
+                                checkpoint_store=self.checkpoint_store,
+                                io_core=self.io_core,
+                                **self.feeder_kwargs)
+        return Feeder(api_key, board_id, slack_token, slack_channel,
+                      slack_client=self.slack_client,
+                      kanbanize_client=self.kanbanize_client,
+                      checkpoint_store=self.checkpoint_store,
+                      io_core=self.io_core,
+                      **self.feeder_kwargs)
+
+    def _run_board(self, board_id):
+        """
+            Run the feeder of one board, return False if anything went wrong
+        """
+        try:
+            board_feeder = self._get_board_feeder(board_id)
+            board_feeder.memoized_formatter = self.memoized_formatter
+            try:
+                if self.profiler is not None:
+                    return self.profiler.for_label(board_id).run(
+                                                            board_feeder.run)
+                return board_feeder.run()
+            finally:
+                if board_feeder.memoized_formatter is not None:
+                    self.memoized_formatter = board_feeder.memoized_formatter
+        except Exception:
+            logger.exception(u'Error feeding kanbanize board %s', board_id)
+            return False
+
+    def run(self):
+        """
+        Run the feeders of all boards
+        Return dict with the result of each board,
+        ex: {u'4': True, u'5': False}
+        """
+        pool = ThreadPool(max(1, min(self.max_workers,
+                                     len(self.kanbanize_board_ids))))
+        try:
+            pending = [(board_id, pool.apply_async(self._run_board,
+                                                   (board_id,)))
+                       for board_id in self.kanbanize_board_ids]
+            results = {}
+            for board_id, result in pending:
+                try:
+                    results[board_id] = result.get(self.board_timeout)
+                except TimeoutError:
+                    logger.error(u'Timeout feeding kanbanize board %s',
+                                 board_id)
+                    results[board_id] = False
+        finally:
+            pool.close()
+
+        return results
@@ -0,0 +1,265 @@
+# coding=utf-8
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger(__name__)
+
+# result of the activities abandoned by ThreadedFormatter
+_ABANDONED = object()
+
+
+def is_batch_formatter(formatter):
+    """
+        Return True if formatter follows the batch protocol: it has
+        `batch_formatter = True` and a `format_batch(activities)` method
+        returning the list of formatted messages, in the same order
+    """
+    return getattr(formatter, 'batch_formatter', False) is True
+
+
+def is_pure_formatter(formatter):
+    """
+        Return True if formatter declares itself pure (`pure = True`): the
+        message depends only on the event, author and text of the activity,
+        so it can be memoized (see MemoizedFormatter)
+    """
+    return getattr(formatter, 'pure', False) is True
+
+
+def pure_formatter(function):
+    """
+        Decorator declaring a formatter plugin pure
+    """
+    function.pure = True
+    return function
+
+
+def format_activities(formatter, activities):
+    """
+        Return list with the formatted message of each activity, calling a
+        batch formatter once or other formatters once per activity
+    """
+    if is_batch_formatter(formatter):
+        return list(formatter.format_batch(activities))
+    return [formatter(activity_data) for activity_data in activities]
+
+
+class BatchFormatter(object):
+    """
+    Wraps a function receiving all the activities of a run and returning
+    the list of formatted messages, ex, in a formatter plugin:
+
+        @formatters.batch_formatter
+        def formatter(activities):
+            return [u'%(author)s: %(text)s' % a for a in activities]
+    """
+    batch_formatter = True
+
+    def __init__(self, function):
+        self.function = function
+        self.pure = is_pure_formatter(function)
+
+    def format_batch(self, activities):
+        return self.function(activities)
+
+    def __call__(self, activity_data):
+        return self.function([activity_data])[0]
+
+
+batch_formatter = BatchFormatter
+
+
+class ThreadedFormatter(object):
+    """
+    Runs a per activity formatter (ex: a plugin doing lookups) on a bounded
+    pool of threads, keeping the order of the messages.
+    Activities whose formatter fails or is not done timeout seconds after
+    the batch started are formatted by the fallback formatter. Activities
+    still queued after the deadline are abandoned (the formatter is not
+    called), and while every worker is still busy with activities of
+    batches past their deadline (ex: a hung formatter) the whole batch goes
+    to the fallback. Batches within their deadline (ex: of other boards)
+    share the workers.
+    """
+    batch_formatter = True
+
+    def __init__(self, formatter, fallback, workers=4, timeout=10):
+        """
+            Arguments:
+            @formatter - per activity formatter function
+            @fallback - formatter used when formatter fails or times out
+            @workers - max activities formatted at the same time
+            @timeout - seconds to wait for each batch of activities
+        """
+        self.formatter = formatter
+        self.fallback = fallback
+        self.workers = workers
+        self.timeout = timeout
+        self.pure = is_pure_formatter(formatter)
+        self.pool = None
+        # activities submitted to the pool and not done yet
+        self.in_flight = 0
+        # worker thread -> deadline of the activity it is formatting
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        return self.pool
+
+    def _format(self, activity_data, deadline):
+        worker = threading.current_thread()
+        try:
+            if time.time() > deadline:
+                # the batch already used the fallback
+                return _ABANDONED
+            with self.lock:
+                self.running[worker] = deadline
+            return self.formatter(activity_data)
+        finally:
+            with self.lock:
+                self.running.pop(worker, None)
+                self.in_flight -= 1
+
+    def _get_hung_workers(self):
+        """
+            Return the number of workers formatting activities of batches
+            past their deadline, the lock must be held
+        """
+        now = time.time()
+        return sum(1 for deadline in self.running.itervalues()
+                   if deadline < now)
+
+    def format_batch(self, activities):
+        return self.format_batch_checked(activities)[0]
+
+    def format_batch_checked(self, activities):
+        """
+            Return (list with the formatted message of each activity, list
+            with True for the messages of the fallback formatter)
+        """
+        with self.lock:
+            saturated = self._get_hung_workers() >= self.workers
+            if not saturated:
+                self.in_flight += len(activities)
+        if saturated:
+            logger.warning(u'Formatter workers hung with activities of'
+                           u' previous batches, using fallback formatter for'
+                           u' %s activities', len(activities))
+            return ([self.fallback(activity_data)
+                     for activity_data in activities],
+                    [True] * len(activities))
+
+        pool = self._get_pool()
+        deadline = time.time() + self.timeout
+        results = [pool.apply_async(self._format, (activity_data, deadline))
+                   for activity_data in activities]
+        messages = []
+        fallbacks = []
+        timeouts = 0
+        for activity_data, result in zip(activities, results):
+            try:
+                message = result.get(max(0, deadline - time.time()))
+                if message is _ABANDONED:
+                    raise TimeoutError()
+                messages.append(message)
+                fallbacks.append(False)
+                continue
+            except TimeoutError:
+                timeouts += 1
+            except Exception:
+                logger.exception(u'Error formatting activity, using'
+                                 u' fallback formatter')
+            messages.append(self.fallback(activity_data))
+            fallbacks.append(True)
+        if timeouts:
+            logger.warning(u'Timeout formatting %s activities, using fallback'
+                           u' formatter', timeouts)
+        return messages, fallbacks
+
+    def __call__(self, activity_data):
+        return self.format_batch([activity_data])[0]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+
+class MemoizedFormatter(object):
+    """
+    Memoizes the messages of a pure formatter, keyed on the event, author and
+    text of the activities, keeping the max_size most recently used ones.
+    The messages of the fallback of a ThreadedFormatter are not memoized,
+    the activity is formatted again the next time.
+    hits / misses count the messages served from / missing in the memo.
+    """
+    batch_formatter = True
+    pure = True
+
+    def __init__(self, formatter, max_size=1024):
+        """
+            Arguments:
+            @formatter - pure formatter, per activity or batch
+            @max_size - max messages kept
+        """
+        self.formatter = formatter
+        self.max_size = max_size
+        self.messages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(activity_data):
+        return (activity_data[u'event'], activity_data[u'author'],
+                activity_data[u'text'])
+
+    def format_batch(self, activities):
+        keys = [self._key(activity_data) for activity_data in activities]
+        missing = OrderedDict()
+        with self.lock:
+            for key, activity_data in zip(keys, activities):
+                if key in self.messages:
+                    # most recently used go to the end
+                    self.messages[key] = self.messages.pop(key)
+                    self.hits += 1
+                elif key in missing:
+                    self.hits += 1
+                else:
+                    missing[key] = activity_data
+                    self.misses += 1
+
+        found = {}
+        fallbacks = set()
+        if missing:
+            # the formatter is called without the lock, it may be slow
+            if isinstance(self.formatter, ThreadedFormatter):
+                found_messages, found_fallbacks =\
+                    self.formatter.format_batch_checked(missing.values())
+            else:
+                found_messages = format_activities(self.formatter,
+                                                   missing.values())
+                found_fallbacks = [False] * len(found_messages)
+            found = dict(zip(missing.keys(), found_messages))
+            fallbacks = set(key for key, fallback in
+                            zip(missing.keys(), found_fallbacks) if fallback)
+
+        with self.lock:
+            messages = [self.messages[key] if key in self.messages
+                        else found[key] for key in keys]
+            for key, message in found.iteritems():
+                if key not in fallbacks:
+                    self.messages[key] = message
+            while len(self.messages) > self.max_size:
+                self.messages.popitem(last=False)
+        return messages
+
+    def __call__(self, activity_data):
+        return self.format_batch([activity_data])[0]
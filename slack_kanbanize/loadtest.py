@@ -0,0 +1,378 @@
+# coding=utf-8
+"""
+Load test of the feeder against local fake kanbanize and slack http servers
+(no network), reporting the end-to-end latency (from the date of each
+activity to its message reaching slack) and the throughput, as JSON:
+    python loadtest.py --boards 50 --rate 120 --runs 5 --interval 2 \\
+        --slack_latency 0.05 --slack_error_rate 0.01 --output load.json
+"""
+
+import argparse
+import BaseHTTPServer
+import calendar
+import datetime
+import json
+import random
+import re
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+import checkpoint
+import concurrency
+import feeder
+import transport
+
+KANBANIZE_PATH = '/index.php/api/kanbanize/get_board_activities'
+SLACK_PATH = '/api/chat.postMessage'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# the activities carry their epoch in the text, so the fake slack can
+# measure the end-to-end latency
+ACTIVITY_TIME = re.compile(r'@(\d+)')
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeServer(object):
+    """
+    Base of the fake servers: serves handler_class on localhost, in a
+    thread, on port (0 is any free port)
+    """
+    handler_class = None
+
+    def __init__(self, port=0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', port),
+                                          self.handler_class)
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s' % self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        return self.rfile.read(length) if length else ''
+
+
+class KanbanizeHandler(Handler):
+    """
+    get_board_activities of the kanbanize api v1:
+    POST /index.php/api/kanbanize/get_board_activities/boardid/4/
+         fromdate/<utc date>/todate/<utc date>[/page/2]/format/json
+    """
+
+    def do_POST(self):
+        self.read_body()
+        if not self.path.startswith(KANBANIZE_PATH + '/'):
+            return self.send_json({u'error': u'not found'}, 404)
+        parts = [urllib.unquote(part) for part in
+                 self.path[len(KANBANIZE_PATH) + 1:].strip('/').split('/')]
+        params = dict(zip(parts[::2], parts[1::2]))
+        self.send_json(self.server.fake.get_board_activities(
+                                params[u'boardid'], params[u'fromdate'],
+                                params[u'todate'],
+                                int(params.get(u'page') or 1)))
+
+    do_GET = do_POST
+
+
+class FakeKanbanizeServer(FakeServer):
+    """
+    Fake kanbanize, where every board gets rate activities per minute, at
+    regular times (the same window always returns the same activities)
+    """
+    handler_class = KanbanizeHandler
+
+    def __init__(self, rate=60, tasks=50, page_size=100, port=0,
+                 clock=time.time):
+        """
+            Arguments:
+            @rate - activities per minute of each board
+            @tasks - number of tasks of each board
+            @page_size - activities per page, like the real api
+        """
+        super(FakeKanbanizeServer, self).__init__(port)
+        self.interval = 60.0 / rate
+        self.tasks = tasks
+        self.page_size = page_size
+        self.clock = clock
+        self.calls = 0
+        self.activities = 0
+        self.lock = threading.Lock()
+
+    def get_board_activities(self, boardid, fromdate, todate, page=1):
+        """
+            Return the activities of the board between the dates (UTC),
+            until now, newest first, in the kanbanize format
+        """
+        start = calendar.timegm(time.strptime(fromdate, DATE_FORMAT))
+        end = min(calendar.timegm(time.strptime(todate, DATE_FORMAT)),
+                  self.clock())
+        first = int(start / self.interval)
+        if first * self.interval < start:
+            first += 1
+        last = int(end / self.interval)
+        total = max(0, last - first + 1)
+        numbers = range(last, first - 1, -1)[(page - 1) * self.page_size:
+                                             page * self.page_size]
+        activities = []
+        for number in numbers:
+            date = int(number * self.interval)
+            activities.append({
+                u'author': u'user%s' % (number % 7),
+                u'date': time.strftime(DATE_FORMAT, time.gmtime(date)),
+                u'event': u'Task moved',
+                u'taskid': unicode(number % self.tasks),
+                u'text': u'Activity %s @%s' % (number, date)})
+        with self.lock:
+            self.calls += 1
+            self.activities += len(activities)
+        if not total:
+            return u'No activities found for the specified board and time'\
+                   u' range. Make sure all parameters are set correctly.'
+        return {u'allactivities': total, u'page': page,
+                u'activities': activities}
+
+
+class SlackHandler(Handler):
+
+    def do_POST(self):
+        params = urlparse.parse_qs(self.read_body())
+        if self.path != SLACK_PATH:
+            return self.send_json({u'ok': False, u'error': u'not found'}, 404)
+        status, data, headers = self.server.fake.post_message(
+                            dict((name, values[0])
+                                 for name, values in params.iteritems()))
+        self.send_json(data, status, headers)
+
+
+class FakeSlackServer(FakeServer):
+    """
+    Fake slack chat.postMessage, with latency, errors and rate limits
+    """
+    handler_class = SlackHandler
+
+    def __init__(self, latency=0, error_rate=0, rate_limit=0, port=0,
+                 seed=0, clock=time.time):
+        """
+            Arguments:
+            @latency - seconds to answer each message
+            @error_rate - fraction of the messages answered with an error
+            @rate_limit - max messages per second, the others get http 429
+                          (0 is unlimited)
+        """
+        super(FakeSlackServer, self).__init__(port)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.bytes = 0
+        self.latencies = []
+        self.second = None
+        self.second_messages = 0
+
+    def post_message(self, params):
+        """
+            Return (http status, json data, headers) of the answer
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        now = self.clock()
+        with self.lock:
+            if self.rate_limit:
+                if self.second != int(now):
+                    self.second = int(now)
+                    self.second_messages = 0
+                self.second_messages += 1
+                if self.second_messages > self.rate_limit:
+                    self.rate_limited += 1
+                    return 429, {u'ok': False, u'error': u'ratelimited'},\
+                        {'Retry-After': '1'}
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors += 1
+                return 200, {u'ok': False, u'error': u'fatal_error'}, None
+            attachments = params.get('attachments') or ''
+            self.messages += 1
+            self.bytes += len(attachments)
+            self.latencies.extend(now - int(activity_time) for activity_time
+                                  in ACTIVITY_TIME.findall(attachments))
+        return 200, {u'ok': True}, None
+
+
+class HttpKanbanize(object):
+    """
+    Kanbanize client of the fake server, over the connections of a
+    transport.Transport
+    """
+
+    def __init__(self, url, apikey, transport):
+        self.url = url
+        self.apikey = apikey
+        self.transport = transport
+
+    def get_board_activities(self, boardid, fromdate, todate, page=None,
+                             format='dict'):
+        path = ['boardid', boardid, 'fromdate', fromdate, 'todate', todate]
+        if page:
+            path += ['page', page]
+        response = self.transport.session.post(
+                    '%s%s/%s/format/json' % (
+                        self.url, KANBANIZE_PATH,
+                        '/'.join(urllib.quote(unicode(part), safe='')
+                                 for part in path)),
+                    headers={'apikey': self.apikey},
+                    timeout=self.transport.timeout)
+        return response.json()
+
+
+def percentiles(values, points=(50, 90, 99)):
+    values = sorted(values)
+    if not values:
+        return dict(('p%s' % point, None) for point in points)
+    return dict(('p%s' % point,
+                 values[min(len(values) - 1, len(values) * point / 100)])
+                for point in points)
+
+
+def run_load(boards=10, rate=60, runs=3, interval=1, max_workers=10,
+             slack_latency=0, slack_error_rate=0, slack_rate_limit=0,
+             collect_minutes=1):
+    """
+        Run a MultiFeeder over boards of the fake kanbanize, posting to the
+        fake slack, runs times every interval seconds
+        Return dict with the run timings, the end-to-end latency of the
+        activities and the throughput
+    """
+    kanbanize_server = FakeKanbanizeServer(rate).start()
+    slack_server = FakeSlackServer(slack_latency, slack_error_rate,
+                                   slack_rate_limit).start()
+    obj_transport = transport.Transport(max_workers * 2)
+    try:
+        obj = feeder.MultiFeeder(
+                    'load_kanbanize_api_key', [unicode(board_id) for board_id
+                                               in range(1, boards + 1)],
+                    'load_slack_token', '#load', max_workers=max_workers,
+                    io_core=concurrency.IOCore(max_workers, max_workers),
+                    checkpoint_store=checkpoint.CheckpointStore(':memory:'),
+                    # the feeder collects until one hour from now
+                    kanbanize_timedelta_collect=datetime.timedelta(
+                                                minutes=60 + collect_minutes),
+                    slack_retry_backoff=1)
+        obj.kanbanize_client = HttpKanbanize(kanbanize_server.url,
+                                             'load_kanbanize_api_key',
+                                             obj_transport)
+        obj.slack_client = obj_transport.slack_client(
+                                    'load_slack_token',
+                                    '%s/api' % slack_server.url)
+
+        timings = []
+        failed_boards = 0
+        start = time.time()
+        for run in xrange(runs):
+            if run:
+                time.sleep(interval)
+            run_start = time.time()
+            results = obj.run()
+            timings.append(time.time() - run_start)
+            failed_boards += sum(1 for ok in results.values() if not ok)
+        seconds = time.time() - start
+
+        latencies = slack_server.latencies
+        return {
+            'boards': boards,
+            'runs': runs,
+            'seconds': seconds,
+            'run_seconds': dict(percentiles(timings),
+                                max=max(timings)),
+            'failed_board_runs': failed_boards,
+            'kanbanize_calls': kanbanize_server.calls,
+            'activities_fetched': kanbanize_server.activities,
+            'activities_posted': len(latencies),
+            'activities_per_second': len(latencies) / seconds,
+            'latency_seconds': percentiles(latencies),
+            'slack_messages': slack_server.messages,
+            'slack_errors': slack_server.errors,
+            'slack_rate_limited': slack_server.rate_limited,
+            'slack_bytes': slack_server.bytes,
+        }
+    finally:
+        kanbanize_server.stop()
+        slack_server.stop()
+        obj_transport.close()
+
+
+def process():
+    parser = argparse.ArgumentParser(description='Slack - Kanbanize feeder'
+                                                 ' load test')
+    parser.add_argument('--boards', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=60,
+                        help='activities per minute of each board')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--interval', type=float, default=1,
+                        help='seconds between two runs')
+    parser.add_argument('--max_workers', type=int, default=10)
+    parser.add_argument('--collect_minutes', type=int, default=1,
+                        help='minutes before now collected in the first run')
+    parser.add_argument('--slack_latency', type=float, default=0,
+                        help='seconds to answer each slack message')
+    parser.add_argument('--slack_error_rate', type=float, default=0,
+                        help='fraction of the slack messages answered with'
+                             ' an error')
+    parser.add_argument('--slack_rate_limit', type=int, default=0,
+                        help='max slack messages per second, 0 is unlimited')
+    parser.add_argument('--output', help='file to write the json results,'
+                                         ' default is stdout')
+    args = parser.parse_args()
+
+    results = run_load(args.boards, args.rate, args.runs, args.interval,
+                       args.max_workers, args.slack_latency,
+                       args.slack_error_rate, args.slack_rate_limit,
+                       args.collect_minutes)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    process()
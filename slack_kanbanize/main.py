@@ -3,7 +3,19 @@ import argparse
 import datetime
 import importlib
 
+import activity_cache
+import cassette
+import chunker
+import concurrency
 import feeder
+import formatters
+import profiling
+import rate_limit
+import routing
+import scheduler
+import stats
+import templates
+import transport
 
 
 def process():
@@ -13,18 +25,155 @@ def process():
                         required=True)
     parser.add_argument('--slack_channel', nargs='?',
                         help='slack channel to post', required=True)
+    parser.add_argument('--slack_routes', nargs='?',
+                        help='optional json file with the rules routing the'
+                             ' activities to other channels (by event,'
+                             ' author, taskid or text pattern), the board is'
+                             ' fetched once for all of them and'
+                             ' --slack_channel gets the activities matching'
+                             ' no rule, see routing.py')
     parser.add_argument('--slack_user', nargs='?',
                         help='slack username to post', default='slackbot')
     parser.add_argument('--kanbanize_api_key', nargs='?',
                         help='kanbanize api key to be used', required=True)
     parser.add_argument('--kanbanize_board_id', nargs='?',
-                        help='kanbanize board id to colled activities from',
+                        help='kanbanize board id to colled activities from,'
+                             ' many boards can be passed separated by comma,'
+                             ' ex: "4,5,6"',
                         required=True)
+    parser.add_argument('--max_workers', nargs='?',
+                        help='max number of boards collected at the same'
+                             ' time when many boards are passed',
+                        default='4')
+    parser.add_argument('--max_kanbanize_calls', nargs='?',
+                        help='max kanbanize calls in flight, shared by all'
+                             ' the boards',
+                        default='8')
+    parser.add_argument('--max_slack_calls', nargs='?',
+                        help='max slack calls in flight, shared by all the'
+                             ' boards',
+                        default='4')
     parser.add_argument('--kanbanize_timedelta_collect', nargs='?',
-                        help='kanbanize collect past N minutes from now',
+                        help='kanbanize collect past N minutes from now, when'
+                             ' nothing was posted yet',
                         default='60')
+    parser.add_argument('--kanbanize_fetch_overlap', nargs='?',
+                        help='collect activities from N minutes before the'
+                             ' last posted one',
+                        default='5')
+    parser.add_argument('--kanbanize_max_timedelta_collect', nargs='?',
+                        help='collect at most the past N minutes from now,'
+                             ' when the last posted activity is older',
+                        default='1440')
+    parser.add_argument('--kanbanize_seen_window', nargs='?',
+                        help='activities up to N minutes older than the last'
+                             ' posted one are still posted if not posted yet,'
+                             ' to support late activities',
+                        default='0')
+    parser.add_argument('--kanbanize_calls_per_hour', nargs='?',
+                        help='max kanbanize api calls per hour, shared by'
+                             ' all the feeders of the same api key in this'
+                             ' host, 0 to disable',
+                        default='30')
+    parser.add_argument('--kanbanize_max_wait', nargs='?',
+                        help='max seconds to wait for a kanbanize api call'
+                             ' when the calls per hour are exhausted, the'
+                             ' collect is skipped when longer',
+                        default='0')
+    parser.add_argument('--kanbanize_cache_days', nargs='?',
+                        help='days the activities of past hours are kept in'
+                             ' the local cache, 0 to disable the cache',
+                        default='7')
+    parser.add_argument('--kanbanize_page_workers', nargs='?',
+                        help='max pages of activities fetched at the same'
+                             ' time, on busy boards',
+                        default='4')
+    parser.add_argument('--kanbanize_max_page_wait', nargs='?',
+                        help='max seconds to wait for the kanbanize api'
+                             ' calls of the other pages of a busy board, once'
+                             ' its first page was fetched',
+                        default='600')
+    parser.add_argument('--http_pool_size', nargs='?',
+                        help='max keep-alive connections per host shared by'
+                             ' the kanbanize and slack clients',
+                        default='10')
+    parser.add_argument('--http_timeout', nargs='?',
+                        help='seconds to wait for each kanbanize / slack'
+                             ' request',
+                        default='30')
+    parser.add_argument('--kanbanize_message_template', nargs='?',
+                        help='optional json file with the message templates'
+                             ' to be used, see templates.DEFAULT_CONFIG')
     parser.add_argument('--kanbanize_message_formater', nargs='?',
                         help='optional kanbanize message formatter to be user')
+    parser.add_argument('--kanbanize_formatter_workers', nargs='?',
+                        help='activities formatted at the same time by a'
+                             ' --kanbanize_message_formater function, 0 to'
+                             ' format them one by one',
+                        default='0')
+    parser.add_argument('--kanbanize_formatter_timeout', nargs='?',
+                        help='seconds to wait for the formatter on the'
+                             ' activities of each run before using the'
+                             ' default message for the ones not done, with'
+                             ' --kanbanize_formatter_workers',
+                        default='10')
+    parser.add_argument('--kanbanize_formatter_cache_size', nargs='?',
+                        help='max messages memoized for the default / template'
+                             ' formatter or a pure formatter, 0 to disable',
+                        default='1024')
+    parser.add_argument('--slack_json', nargs='?',
+                        help='json library used to serialize the slack'
+                             ' messages: json, simplejson or ujson (faster,'
+                             ' if installed)',
+                        default='json')
+    parser.add_argument('--slack_retry_backoff', nargs='?',
+                        help='seconds to wait before posting again a message'
+                             ' not posted, doubled at each failure',
+                        default='30')
+    parser.add_argument('--slack_max_retry_backoff', nargs='?',
+                        help='max seconds between two attempts of posting a'
+                             ' message',
+                        default='3600')
+    parser.add_argument('--slack_max_attempts', nargs='?',
+                        help='attempts of posting a message before it is'
+                             ' moved aside (logged as an error), messages'
+                             ' failing with a permanent slack error, ex:'
+                             ' channel_not_found, are moved at once',
+                        default='10')
+    parser.add_argument('--metrics_textfile', nargs='?',
+                        help='optional file where the metrics of the runs are'
+                             ' written in the prometheus text format, ex: in'
+                             ' the node_exporter textfile directory')
+    parser.add_argument('--statsd_address', nargs='?',
+                        help='optional statsd host:port where the metrics are'
+                             ' sent, ex: localhost:8125')
+    parser.add_argument('--profile', action='store_true',
+                        help='write a cpu profile (pstats) and the top memory'
+                             ' allocations (tracemalloc, when available) of'
+                             ' the runs to --profile_dir, with many boards'
+                             ' each board is profiled on its own, cpu only')
+    parser.add_argument('--profile_dir', nargs='?',
+                        help='directory where the profiles are written',
+                        default='.')
+    parser.add_argument('--profile_every', nargs='?',
+                        help='profile only one of each N runs, to keep'
+                             ' profiling on in production',
+                        default='1')
+    parser.add_argument('--kanbanize_record', nargs='?',
+                        help='optional cassette file (gzip) where the'
+                             ' kanbanize responses are recorded, to be'
+                             ' replayed by benchmarks.py --replay')
+    parser.add_argument('--daemon', action='store_true',
+                        help='keep running and collect activities every'
+                             ' --daemon_interval seconds, instead of running'
+                             ' once from crontab')
+    parser.add_argument('--daemon_interval', nargs='?',
+                        help='seconds between two collects in daemon mode',
+                        default='60')
+    parser.add_argument('--daemon_jitter', nargs='?',
+                        help='max random seconds added to each daemon'
+                             ' interval',
+                        default='0')
     args = parser.parse_args()
 
     kanbanize_timedelta_collect =\
@@ -48,9 +197,146 @@ def process():
             print u'Error with message format override, using default, error'\
                   u'was: %s' % e
             kanbanize_message_formater = None
+        if kanbanize_message_formater and\
+                int(args.kanbanize_formatter_workers) and\
+                not formatters.is_batch_formatter(kanbanize_message_formater):
+            kanbanize_message_formater = formatters.ThreadedFormatter(
+                            kanbanize_message_formater,
+                            templates.DEFAULT_FORMATTER,
+                            int(args.kanbanize_formatter_workers),
+                            float(args.kanbanize_formatter_timeout))
+    elif args.kanbanize_message_template:
+        try:
+            kanbanize_message_formater = templates.TemplateFormatter.from_file(
+                                            args.kanbanize_message_template)
+        except Exception, e:
+            print u'Error with message template, using default, error'\
+                  u' was: %s' % e
+
+    try:
+        slack_json_dumps = chunker.get_json_dumps(args.slack_json)
+    except ImportError, e:
+        print u'Error with json library, using default, error'\
+              u' was: %s' % e
+        slack_json_dumps = chunker.get_json_dumps()
+
+    kanbanize_rate_budget = None
+    if int(args.kanbanize_calls_per_hour):
+        kanbanize_rate_budget = rate_limit.RateBudget(
+                                        args.kanbanize_api_key,
+                                        int(args.kanbanize_calls_per_hour))
+
+    kanbanize_activity_cache = None
+    if int(args.kanbanize_cache_days):
+        kanbanize_activity_cache = activity_cache.ActivityCache(
+                    retention=datetime.timedelta(
+                                        days=int(args.kanbanize_cache_days)))
+
+    feeder_kwargs = {
+        'slack_user': args.slack_user,
+        'slack_json_dumps': slack_json_dumps,
+        'slack_retry_backoff': int(args.slack_retry_backoff),
+        'slack_max_retry_backoff': int(args.slack_max_retry_backoff),
+        'slack_max_attempts': int(args.slack_max_attempts),
+        'kanbanize_timedelta_collect': kanbanize_timedelta_collect,
+        'kanbanize_message_fomatter': kanbanize_message_formater,
+        'kanbanize_seen_window': datetime.timedelta(
+                                    minutes=int(args.kanbanize_seen_window)),
+        'kanbanize_fetch_overlap': datetime.timedelta(
+                                minutes=int(args.kanbanize_fetch_overlap)),
+        'kanbanize_max_timedelta_collect': datetime.timedelta(
+                        minutes=int(args.kanbanize_max_timedelta_collect)),
+        'kanbanize_rate_budget': kanbanize_rate_budget,
+        'kanbanize_max_wait': int(args.kanbanize_max_wait),
+        'kanbanize_activity_cache': kanbanize_activity_cache,
+        'kanbanize_page_workers': int(args.kanbanize_page_workers),
+        'kanbanize_max_page_wait': int(args.kanbanize_max_page_wait),
+        'kanbanize_formatter_cache_size': int(
+                                    args.kanbanize_formatter_cache_size),
+        'io_core': concurrency.IOCore(int(args.max_kanbanize_calls),
+                                      int(args.max_slack_calls)),
+    }
+    metrics = None
+    if args.metrics_textfile or args.statsd_address:
+        statsd = None
+        if args.statsd_address:
+            host, port = args.statsd_address.rsplit(':', 1)
+            statsd = stats.StatsdClient(host, int(port))
+        metrics = stats.Metrics(statsd)
+        feeder_kwargs['metrics'] = metrics
+
+    router = None
+    if args.slack_routes:
+        try:
+            router = routing.Router.from_file(args.slack_routes,
+                                              args.slack_channel)
+        except Exception, e:
+            print u'Error with slack routes, posting all the activities to'\
+                  u' --slack_channel, error was: %s' % e
+
+    board_ids = [board_id.strip() for board_id in
+                 args.kanbanize_board_id.split(',') if board_id.strip()]
+    obj_transport = transport.Transport(int(args.http_pool_size),
+                                        float(args.http_timeout))
+    if len(board_ids) > 1:
+        obj_feeder = feeder.MultiFeeder(args.kanbanize_api_key, board_ids,
+                                        args.slack_token, args.slack_channel,
+                                        max_workers=int(args.max_workers),
+                                        transport=obj_transport,
+                                        router=router, **feeder_kwargs)
+    elif router is not None:
+        obj_feeder = feeder.RoutedFeeder(
+                        args.kanbanize_api_key, board_ids[0],
+                        args.slack_token, router,
+                        slack_client=obj_transport.slack_client(
+                                                        args.slack_token),
+                        kanbanize_client=obj_transport.kanbanize_client(
+                                                    args.kanbanize_api_key),
+                        **feeder_kwargs)
+    else:
+        obj_feeder = feeder.Feeder(
+                        args.kanbanize_api_key, board_ids[0],
+                        args.slack_token, args.slack_channel,
+                        slack_client=obj_transport.slack_client(
+                                                        args.slack_token),
+                        kanbanize_client=obj_transport.kanbanize_client(
+                                                    args.kanbanize_api_key),
+                        **feeder_kwargs)
+    if args.kanbanize_record:
+        obj_feeder.kanbanize_client = cassette.RecordingKanbanize(
+                                            obj_feeder.kanbanize_client,
+                                            args.kanbanize_record)
+
+    profiler = None
+    if args.profile:
+        if len(board_ids) > 1:
+            # the boards run on worker threads, each one is profiled in its
+            # thread, the memory is not traced (tracemalloc is process wide)
+            obj_feeder.profiler = profiling.Profiler(
+                                    args.profile_dir, 'boards',
+                                    int(args.profile_every),
+                                    trace_memory=False)
+        else:
+            profiler = profiling.Profiler(args.profile_dir, board_ids[0],
+                                          int(args.profile_every))
+
+    def run():
+        if profiler is not None:
+            result = profiler.run(obj_feeder.run)
+        else:
+            result = obj_feeder.run()
+        if args.metrics_textfile:
+            try:
+                metrics.write_textfile(args.metrics_textfile)
+            except (IOError, OSError), e:
+                print u'Error writing the metrics, error was: %s' % e
+        return result
 
-    obj_feeder = feeder.Feeder(args.kanbanize_api_key, args.kanbanize_board_id,
-                               args.slack_token, args.slack_channel,
-                               args.slack_user, kanbanize_timedelta_collect,
-                               kanbanize_message_formater)
-    obj_feeder.run()
+    if args.daemon:
+        obj_scheduler = scheduler.Scheduler(run,
+                                            int(args.daemon_interval),
+                                            float(args.daemon_jitter))
+        obj_scheduler.install_signal_handlers()
+        obj_scheduler.run_forever()
+    else:
+        run()
@@ -0,0 +1,142 @@
+# coding=utf-8
+
+import cProfile
+import datetime
+import hashlib
+import logging
+import os
+import re
+
+try:
+    import tracemalloc
+except ImportError:
+    # python < 3.4, only the cpu profile is taken
+    tracemalloc = None
+
+logger = logging.getLogger(__name__)
+
+TOP_ALLOCATIONS = 25
+# longer labels are hashed, the file names must fit the os limits
+MAX_LABEL_LENGTH = 40
+
+
+def _safe_label(label):
+    label = re.sub(r'[^\w.-]', '_', unicode(label))
+    if len(label) <= MAX_LABEL_LENGTH:
+        return label
+    return u'%s-%s' % (label[:MAX_LABEL_LENGTH - 13],
+                       hashlib.sha1(label.encode('utf-8')).hexdigest()[:12])
+
+
+class Profiler(object):
+    """
+    Profiles every Nth run of a job (cpu with cProfile and, when available,
+    memory with tracemalloc), writing to directory:
+    slack-kanbanize-<label>-<timestamp>.pstats (see pstats.Stats) and
+    slack-kanbanize-<label>-<timestamp>.tracemalloc.txt (top allocations)
+    and, when the label had to be shortened, the whole label in
+    slack-kanbanize-<label>-<timestamp>.label.txt
+    The runs are counted in a file of directory, so sampling works both in
+    daemon mode and when each run is a new process (crontab).
+    cProfile only follows the calling thread, so jobs running on other
+    threads (ex: the boards of a MultiFeeder) must be profiled in their
+    thread, see for_label.
+    """
+
+    def __init__(self, directory, label, every=1, trace_memory=True):
+        """
+            Arguments:
+            @directory - directory where the profiles are written
+            @label - identifies the profiled job in the file names, ex: the
+                     board id, long labels are shortened with a hash
+            @every - profile only one of each N runs
+            @trace_memory - take the memory allocations too, tracemalloc is
+                            process wide so it must be False when many jobs
+                            are profiled at the same time
+        """
+        self.directory = directory
+        self.full_label = unicode(label)
+        self.label = _safe_label(label)
+        self.every = max(1, every)
+        self.trace_memory = trace_memory and tracemalloc is not None
+
+    def for_label(self, label):
+        """
+            Return a Profiler with the same settings for other job, counting
+            its own runs
+        """
+        profiler = Profiler(self.directory, label, self.every)
+        profiler.trace_memory = self.trace_memory
+        return profiler
+
+    def _count_run(self):
+        """
+            Return the number of this run, starting at 1
+        """
+        path = os.path.join(self.directory,
+                            '.slack-kanbanize-%s.runs' % self.label)
+        runs = 0
+        if os.path.exists(path):
+            with open(path) as file:
+                try:
+                    runs = int(file.read().strip() or 0)
+                except ValueError:
+                    runs = 0
+        runs += 1
+        with open(path, 'w') as file:
+            file.write(str(runs))
+        return runs
+
+    def _get_path(self, suffix):
+        return os.path.join(self.directory, 'slack-kanbanize-%s-%s%s' % (
+                        self.label,
+                        datetime.datetime.now().strftime('%Y%m%dT%H%M%S'),
+                        suffix))
+
+    def run(self, job, *args, **kwargs):
+        """
+            Run job, profiling it if it is its turn
+            Return the job result
+        """
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            run = self._count_run()
+        except (IOError, OSError):
+            # the job runs anyway
+            logger.exception(u'Error counting the runs of %s, not profiled',
+                             self.label)
+            return job(*args, **kwargs)
+        if (run - 1) % self.every:
+            return job(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        if self.trace_memory:
+            tracemalloc.start()
+        try:
+            result = profile.runcall(job, *args, **kwargs)
+        finally:
+            snapshot = None
+            if self.trace_memory:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+            try:
+                profile.dump_stats(self._get_path('.pstats'))
+                if self.full_label != self.label:
+                    # the label was shortened, the whole one goes aside
+                    with open(self._get_path('.label.txt'), 'w') as file:
+                        file.write(self.full_label.encode('utf-8') + '\n')
+                if snapshot is not None:
+                    self._write_snapshot(snapshot)
+                else:
+                    logger.info(u'Memory not traced, only the cpu profile of'
+                                u' %s was written', self.label)
+            except (IOError, OSError):
+                logger.exception(u'Error writing the profile of %s',
+                                 self.label)
+        return result
+
+    def _write_snapshot(self, snapshot):
+        with open(self._get_path('.tracemalloc.txt'), 'w') as file:
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                file.write('%s\n' % stat)
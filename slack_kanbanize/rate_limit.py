@@ -0,0 +1,108 @@
+# coding=utf-8
+
+import os
+import sqlite3
+import threading
+import time
+
+import checkpoint
+
+EPSILON = 1e-6
+
+
+class RateBudget(object):
+    """
+    Token bucket limiting the kanbanize api calls of one api key, kept in an
+    sqlite database so all the feeders of the host, in any process, share
+    the same budget.
+    The bucket holds up to `capacity` calls and is refilled continuously at
+    `capacity` calls per `period` seconds.
+    """
+
+    def __init__(self, kanbanize_api_key, capacity=30, period=3600,
+                 path=None, timeout=30, clock=time.time):
+        """
+            Arguments:
+            @kanbanize_api_key - api key the budget is for
+            @capacity - calls allowed per period (30 per hour in the free
+                        kanbanize plan)
+            @period - seconds
+            @path - database path, default is the checkpoint store one
+            @timeout - seconds to wait for a lock held by other process
+            @clock - function returning the current time in seconds
+        """
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'),
+                                checkpoint.CheckpointStore.file_name)
+        self.account = checkpoint.account_key(kanbanize_api_key)
+        self.capacity = float(capacity)
+        self.period = float(period)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS rate_budgets ('
+            ' account TEXT NOT NULL PRIMARY KEY,'
+            ' tokens REAL NOT NULL,'
+            ' updated REAL NOT NULL)')
+
+    def _refill(self, now):
+        """
+            Return the tokens available now, must be called in a transaction
+        """
+        row = self.connection.execute(
+            'SELECT tokens, updated FROM rate_budgets WHERE account = ?',
+            (self.account,)).fetchone()
+        if not row:
+            return self.capacity
+        tokens, updated = row
+        elapsed = max(0, now - updated)
+        return min(self.capacity,
+                   tokens + elapsed * self.capacity / self.period)
+
+    def _transaction(self, function):
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                ret = function(self.clock())
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+        return ret
+
+    def try_acquire(self, tokens=1):
+        """
+            Take tokens from the budget if available
+            Return True if taken
+        """
+        def acquire(now):
+            available = self._refill(now)
+            # after waiting wait_time, the refill may miss the tokens by a
+            # rounding error
+            acquired = available >= tokens - EPSILON
+            if acquired:
+                available = max(0.0, available - tokens)
+            self.connection.execute(
+                'INSERT OR REPLACE INTO rate_budgets (account, tokens,'
+                ' updated) VALUES (?, ?, ?)', (self.account, available, now))
+            return acquired
+        return self._transaction(acquire)
+
+    def remaining(self):
+        """
+            Return the calls available now
+        """
+        return self._transaction(self._refill)
+
+    def wait_time(self, tokens=1):
+        """
+            Return the seconds until tokens are available
+        """
+        missing = tokens - self.remaining()
+        if missing <= 0:
+            return 0
+        return missing * self.period / self.capacity
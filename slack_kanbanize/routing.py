@@ -0,0 +1,166 @@
+# coding=utf-8
+"""
+Routing of the kanbanize activities to slack channels, so one fetch of a
+board fans out to many channels (see feeder.RoutedFeeder).
+The routes are configured as a json list, ex:
+[{"channel": "#dev", "events": ["Comment added"]},
+ {"channel": "#mgmt", "events": ["Task archived"], "authors": ["mportela"]},
+ {"channel": "#alerts", "text": "(?i)urgent"}]
+"""
+
+import json
+import re
+
+# fields matched by value, through the index
+FIELDS = (u'event', u'author', u'taskid')
+
+
+def _values(values):
+    """
+        Return set with the unicode values accepted, None accepts any
+    """
+    if values is None:
+        return None
+    if isinstance(values, (basestring, int, long)):
+        values = [values]
+    return set(unicode(value) for value in values)
+
+
+class Route(object):
+    """
+    Sends to channel the activities matching all its criteria, each one
+    accepting any of its values. A route without criteria matches all the
+    activities.
+    """
+
+    def __init__(self, channel, events=None, authors=None, taskids=None,
+                 text=None):
+        """
+            Arguments:
+            @channel - slack channel receiving the activities
+            @events - optional list of events accepted, ex: [u'Task moved']
+            @authors - optional list of authors accepted
+            @taskids - optional list of task ids accepted
+            @text - optional regular expression searched in the text
+        """
+        self.channel = channel
+        self.values = {
+            u'event': _values(events),
+            u'author': _values(authors),
+            u'taskid': _values(taskids),
+        }
+        self.text = re.compile(text, re.UNICODE) if text else None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+            Return a Route of a dict with the keys channel, events, authors,
+            taskids and text
+        """
+        return cls(config[u'channel'], config.get(u'events'),
+                   config.get(u'authors'), config.get(u'taskids'),
+                   config.get(u'text'))
+
+
+class Router(object):
+    """
+    Routes each activity to the channels of the routes it matches.
+    The routes are compiled once into an index: for each field, the bitmask
+    of the routes accepting each value (routes without the field accept
+    any), so matching an activity is a dict lookup and an and per field,
+    and the text patterns are only searched for the routes still matching.
+    Activities matching no route go to default_channel, if any.
+    """
+
+    def __init__(self, routes, default_channel=None):
+        """
+            Arguments:
+            @routes - list of Route
+            @default_channel - optional channel of the activities matching
+                               no route
+        """
+        self.routes = list(routes)
+        self.default_channel = default_channel
+        self.channels = []
+        for channel in [route.channel for route in self.routes] +\
+                [default_channel]:
+            if channel is not None and channel not in self.channels:
+                self.channels.append(channel)
+
+        self.all_routes = (1 << len(self.routes)) - 1
+        # field -> bitmask of the routes accepting any value
+        self.any_value = {}
+        # field -> {value: bitmask of the routes accepting the value}
+        self.index = {}
+        for field in FIELDS:
+            any_value = 0
+            masks = {}
+            for bit, route in enumerate(self.routes):
+                if route.values[field] is None:
+                    any_value |= 1 << bit
+                    continue
+                for value in route.values[field]:
+                    masks[value] = masks.get(value, 0) | 1 << bit
+            self.any_value[field] = any_value
+            self.index[field] = dict((value, mask | any_value)
+                                     for value, mask in masks.iteritems())
+        self.patterns = [(1 << bit, route.text)
+                         for bit, route in enumerate(self.routes)
+                         if route.text is not None]
+        self.text_routes = sum(bit for bit, pattern in self.patterns)
+        # bitmask of the matched routes -> tuple with their channels
+        self.mask_channels = {}
+
+    @classmethod
+    def from_file(cls, path, default_channel=None):
+        """
+            Return a Router with the routes of a json file (see the module
+            docstring)
+        """
+        with open(path) as file:
+            return cls([Route.from_config(config)
+                        for config in json.load(file)], default_channel)
+
+    def match(self, raw_activity):
+        """
+            Return tuple with the channels of the activity, in the order of
+            the routes
+            Arguments:
+            @raw_activity - activity as returned by kanbanize
+        """
+        mask = self.all_routes
+        for field in FIELDS:
+            mask &= self.index[field].get(
+                            unicode(raw_activity.get(field, u'')),
+                            self.any_value[field])
+            if not mask:
+                break
+        if mask & self.text_routes:
+            text = raw_activity.get(u'text') or u''
+            for bit, pattern in self.patterns:
+                if mask & bit and not pattern.search(text):
+                    mask &= ~bit
+        channels = self.mask_channels.get(mask)
+        if channels is None:
+            channels = self.mask_channels[mask] = self._get_channels(mask)
+        return channels
+
+    def _get_channels(self, mask):
+        channels = []
+        for bit, route in enumerate(self.routes):
+            if mask & 1 << bit and route.channel not in channels:
+                channels.append(route.channel)
+        if not channels and self.default_channel is not None:
+            channels.append(self.default_channel)
+        return tuple(channels)
+
+    def route(self, raw_activities):
+        """
+            Return dict with the set of indexes of the raw activities routed
+            to each channel, ex: {u'#dev': set([0, 2]), u'#mgmt': set()}
+        """
+        routed = dict((channel, set()) for channel in self.channels)
+        for index, raw_activity in enumerate(raw_activities):
+            for channel in self.match(raw_activity):
+                routed[channel].add(index)
+        return routed
@@ -0,0 +1,73 @@
+# coding=utf-8
+
+import logging
+import random
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler(object):
+    """
+    Keeps the process alive running a job every N seconds, used to run the
+    feeders as a daemon instead of calling them from crontab.
+    Cycles never overlap: the next cycle is scheduled only after the current
+    one has finished.
+    """
+
+    def __init__(self, job, interval=60, jitter=0):
+        """
+            Arguments:
+            @job - callable to be run in each cycle
+            @interval - seconds between the start of two cycles
+            @jitter - max random seconds added to each wait, used to avoid
+                      many daemons hitting the apis at the same time
+        """
+        self.job = job
+        self.interval = interval
+        self.jitter = jitter
+        self.stop_event = threading.Event()
+
+    def install_signal_handlers(self):
+        """
+            Stop gracefully on SIGTERM / SIGINT, the running cycle is
+            finished (and its last action time saved) before leaving
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+    def _next_delay(self, elapsed):
+        """
+            Return the seconds to wait before the next cycle, given the
+            seconds spent in the last one
+        """
+        delay = max(0, self.interval - elapsed)
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        return delay
+
+    def run_once(self):
+        """
+        Run one cycle of the job, errors are logged and never stop the daemon
+        Return the seconds spent in the cycle
+        """
+        start = time.time()
+        try:
+            self.job()
+        except Exception:
+            logger.exception(u'Error running scheduled job')
+        return time.time() - start
+
+    def run_forever(self):
+        """
+        Run the job until stop is called
+        """
+        while not self.stop_event.is_set():
+            elapsed = self.run_once()
+            # Event.wait returns as soon as stop is called
+            self.stop_event.wait(self._next_delay(elapsed))
@@ -0,0 +1,211 @@
+# coding=utf-8
+
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'slack_kanbanize'
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+BYTES_BUCKETS = (500, 1000, 2000, 4000, 8000, 16000, 32000)
+# histograms not measured in seconds
+BUCKETS = {
+    'payload_bytes': BYTES_BUCKETS,
+}
+
+
+class Timer(object):
+    """
+    Context manager observing the seconds spent in its block
+    """
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.time() - self.start,
+                             **self.labels)
+
+
+class NullMetrics(object):
+    """
+    Metrics doing nothing, used when metrics are disabled
+    """
+
+    def incr(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    def timer(self, name, **labels):
+        return NULL_TIMER
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+NULL_METRICS = NullMetrics()
+
+
+class Metrics(object):
+    """
+    Counters and histograms of the feeders, with labels (ex: board), kept in
+    memory to be written as a prometheus textfile (see render) and/or sent
+    to statsd as they happen.
+    """
+
+    def __init__(self, statsd=None):
+        """
+            Arguments:
+            @statsd - optional StatsdClient receiving each measure
+        """
+        self.statsd = statsd
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name, value=1, **labels):
+        """
+            Add value to the counter name
+        """
+        key = (name, tuple(sorted(labels.iteritems())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        if self.statsd is not None:
+            self.statsd.send(name, labels, value, 'c')
+
+    def observe(self, name, value, **labels):
+        """
+            Add value to the histogram name, ex: seconds or bytes
+        """
+        key = (name, tuple(sorted(labels.iteritems())))
+        buckets = BUCKETS.get(name, SECONDS_BUCKETS)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # [count per bucket, sum, count]
+                histogram = self.histograms[key] = [[0] * len(buckets), 0, 0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+        if self.statsd is not None:
+            if name.endswith('_seconds'):
+                self.statsd.send(name, labels, int(value * 1000), 'ms')
+            else:
+                self.statsd.send(name, labels, value, 'h')
+
+    def timer(self, name, **labels):
+        """
+            Return context manager observing the seconds spent in its block
+            in the histogram name
+        """
+        return Timer(self, name, labels)
+
+    def render(self):
+        """
+            Return the metrics in the prometheus text format
+        """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(histogram[0]),) +
+                                 tuple(histogram[1:]))
+                                for key, histogram in
+                                self.histograms.iteritems())
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append('# TYPE %s_%s counter' % (PREFIX, name))
+                last_name = name
+            lines.append('%s_%s%s %s' % (PREFIX, name, _labels(labels),
+                                         value))
+        for (name, labels), (counts, total, count) in histograms:
+            if name != last_name:
+                lines.append('# TYPE %s_%s histogram' % (PREFIX, name))
+                last_name = name
+            cumulative = 0
+            for bound, bucket_count in zip(
+                            BUCKETS.get(name, SECONDS_BUCKETS), counts):
+                cumulative += bucket_count
+                lines.append('%s_%s_bucket%s %s' % (
+                            PREFIX, name,
+                            _labels(labels + (('le', repr(bound)),)),
+                            cumulative))
+            lines.append('%s_%s_bucket%s %s' % (
+                            PREFIX, name, _labels(labels + (('le', '+Inf'),)),
+                            count))
+            lines.append('%s_%s_sum%s %r' % (PREFIX, name, _labels(labels),
+                                             total))
+            lines.append('%s_%s_count%s %s' % (PREFIX, name, _labels(labels),
+                                               count))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+            Atomically write the metrics in the prometheus text format to
+            path, ex: for the node_exporter textfile collector
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(self.render())
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, unicode(value).replace(
+                                    '\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+class StatsdClient(object):
+    """
+    Sends measures to statsd over UDP, errors are logged and ignored.
+    Labels are appended to the metric name, ex:
+    slack_kanbanize.fetch_seconds.board_4:120|ms
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix=PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, name, labels, value, metric_type):
+        parts = [self.prefix, name] + [
+                    '%s_%s' % (label, re.sub(r'[^\w-]', '_',
+                                             unicode(label_value)))
+                    for label, label_value in sorted(labels.iteritems())]
+        line = '%s:%s|%s' % ('.'.join(parts), value, metric_type)
+        try:
+            self.socket.sendto(line, self.address)
+        except socket.error:
+            logger.warning(u'Error sending metric %s to statsd', name)
@@ -0,0 +1,117 @@
+# coding=utf-8
+
+import json
+
+DEFAULT_CONFIG = {
+    # template of the events with emoji or with a template of their own
+    u'template': u'{emoji} User: *{author}* Event: {event}: {text}',
+    # template of the other events
+    u'fallback': u'User: *{author}* Event: _{event}_: {text}',
+    u'emoji': {
+        u'Task archived': u':+1:',
+        u'Assignee changed': u':octocat:',
+        u'Comment added': u':speech_balloon:',
+        u'Task moved': u':rocket:',
+        u'Attachments updated': u':paperclip:',
+        u'Task updated': u':pencil:',
+        u'Task created': u':ticket:',
+        u'External link changed': u':link:',
+        u'Tags changed': u':triangular_flag_on_post:'
+    },
+    # templates of specific events, ex: {u'Comment added': u'{text}'}
+    u'events': {}
+}
+
+
+def _escape(value):
+    """
+        Escape value to be baked in a str.format template
+    """
+    return value.replace(u'{', u'{{').replace(u'}', u'}}')
+
+
+class TemplateFormatter(object):
+    """
+    Message formatter built from a declarative config (see DEFAULT_CONFIG):
+    the templates may use {emoji}, {event}, {author} and {text}.
+    The template of each known event is compiled once, with its emoji and
+    event name already in it, so formatting an activity is a dict lookup and
+    one str.format call.
+    Instances are callable like any kanbanize_message_fomatter function and
+    are pure batch formatters too (see formatters.is_batch_formatter and
+    formatters.is_pure_formatter).
+    """
+    batch_formatter = True
+    pure = True
+
+    def __init__(self, config=None):
+        """
+            Arguments:
+            @config - dict with the keys of DEFAULT_CONFIG, missing keys are
+                      taken from DEFAULT_CONFIG
+            Raise ValueError if a template is invalid
+        """
+        merged = dict(DEFAULT_CONFIG)
+        merged.update(config or {})
+        self.fallback = merged[u'fallback']
+        emojis = merged[u'emoji']
+        events = merged[u'events']
+
+        self.compiled = {}
+        for event in set(emojis) | set(events):
+            template = events.get(event, merged[u'template'])
+            emoji = _escape(emojis.get(event, u''))
+            template = template.replace(u'{emoji}', emoji)
+            self.compiled[event] = template.replace(u'{event}',
+                                                    _escape(event))
+        self._validate()
+
+    def _validate(self):
+        """
+            Format each template once, so a bad config (ex: {autor}) fails
+            when it is loaded instead of on every activity
+            Raise ValueError with the invalid template
+        """
+        checks = [(event, template, {u'author': u'', u'text': u''})
+                  for event, template in self.compiled.iteritems()]
+        checks.append((None, self.fallback, {u'author': u'', u'text': u'',
+                                             u'emoji': u'', u'event': u''}))
+        for event, template, values in checks:
+            try:
+                template.format(**values)
+            except (KeyError, IndexError, ValueError), e:
+                raise ValueError(u'Invalid template %s%r: %r' % (
+                                    u'of event %r ' % event if event else u'',
+                                    template, e))
+
+    @classmethod
+    def from_file(cls, path):
+        """
+            Return a TemplateFormatter with the config of a json file
+        """
+        with open(path) as file:
+            return cls(json.load(file))
+
+    def __call__(self, activity_data):
+        """
+            Return the formatted message of the activity, same arguments of
+            Feeder._default_message_formatter_function
+        """
+        event = activity_data.get(u'event', u'')
+        template = self.compiled.get(event)
+        if template is None:
+            return self.fallback.format(emoji=u'', event=event,
+                                        author=activity_data.get(u'author',
+                                                                 u''),
+                                        text=activity_data.get(u'text', u''))
+        return template.format(author=activity_data.get(u'author', u''),
+                               text=activity_data.get(u'text', u''))
+
+    def format_batch(self, activities):
+        """
+            Return list with the formatted message of each activity
+        """
+        return [self(activity_data) for activity_data in activities]
+
+
+DEFAULT_FORMATTER = TemplateFormatter()
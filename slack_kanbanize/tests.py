@@ -3,58 +3,228 @@
 import unittest
 import datetime
 import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
 
 import mock
 from freezegun import freeze_time
 from dateutil import tz
+import activity_cache
+import benchmarks
+import cassette
+import checkpoint
+import concurrency
+import chunker
+import dates
 import feeder
+import formatters
+import loadtest
+import profiling
+import rate_limit
+import routing
+import scheduler
+import stats
+import templates
+import transport
 from python_kanbanize.wrapper import Kanbanize
-from pyslack import SlackClient
+from pyslack import SlackClient, SlackError
 
 
 class LastShownMessageTests(unittest.TestCase):
-    @freeze_time("2012-01-14 10:11:12.001002")
-    @mock.patch.object(feeder.Feeder, '_get_last_action_file')
-    def test_save(self, get_file):
-        file = get_file.return_value
 
+    def setUp(self):
+        # $HOME of the tests, where the checkpoint store and old file live
+        self.home = tempfile.mkdtemp()
+        patcher = mock.patch('os.path.expanduser', return_value=self.home)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.home)
+
+    @freeze_time("2012-01-14 10:11:12.001002")
+    def test_save(self):
         fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
                                  "foo_slack_channel")
         fee._save_last_action_time(datetime.datetime.now())
 
-        date = '2012-01-14T10:11:12.001002'
+        store = checkpoint.CheckpointStore()
+        row = store.connection.execute(
+            'SELECT board, channel, last_action FROM checkpoints').fetchall()
+
+        self.assertEqual([(u'4', u'foo_slack_channel',
+                           u'2012-01-14T10:11:12.001002')], row)
 
-        file.truncate.assert_called_with(0)
-        file.write.assert_called_with(date)
+    def test_get_time(self):
+        fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
+                                 "foo_slack_channel")
+        fee._save_last_action_time(
+            datetime.datetime(2010, 10, 11, 12, 13, 14, 123456))
 
-    @mock.patch.object(feeder.Feeder, '_get_last_action_file')
-    def test_get_time(self, get_file):
-        file = get_file.return_value
+        time = fee._get_last_action_time()
 
-        file.readline.return_value = '2010-10-11T12:13:14.123456'
+        self.assertEquals(time, datetime.datetime(2010, 10, 11, 12, 13, 14, 123456))
 
+    def test_get_time_file_empty(self):
         fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
                                  "foo_slack_channel")
         time = fee._get_last_action_time()
 
-        self.assertEquals(time, datetime.datetime(2010, 10, 11, 12, 13, 14, 123456))
+        self.assertEquals(time, None)
+
+    def test_boards_and_channels_dont_clobber(self):
+        fee4 = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
+                             "foo_slack_channel")
+        fee5 = feeder.Feeder("foo_kanbanize_api_key", 5, "foo_slack_token",
+                             "foo_slack_channel")
+        fee4_other = feeder.Feeder("foo_kanbanize_api_key", 4,
+                                   "foo_slack_token", "other_slack_channel")
 
-    @mock.patch.object(feeder.Feeder, '_get_last_action_file')
-    def test_get_time_file_empty(self, get_file):
-        file = get_file.return_value
+        fee4._save_last_action_time(datetime.datetime(2010, 10, 11))
+        fee5._save_last_action_time(datetime.datetime(2010, 10, 12))
 
-        file.readline.return_value = ''
+        self.assertEqual(datetime.datetime(2010, 10, 11),
+                         fee4._get_last_action_time())
+        self.assertEqual(datetime.datetime(2010, 10, 12),
+                         fee5._get_last_action_time())
+        self.assertEqual(None, fee4_other._get_last_action_time())
+
+    def test_migrate_old_file_only_when_store_empty(self):
+        with open(os.path.join(self.home, feeder.Feeder.file_name), 'w') as f:
+            f.write('2010-10-11T12:13:14.123456')
 
         fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
                                  "foo_slack_channel")
-        time = fee._get_last_action_time()
+        fee._save_last_action_time(datetime.datetime(2010, 10, 12))
+        fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
+                                 "foo_slack_channel")
 
-        self.assertEquals(time, None)
+        self.assertEqual(datetime.datetime(2010, 10, 12),
+                         fee._get_last_action_time())
+
+    def test_migrate_old_file(self):
+        with open(os.path.join(self.home, feeder.Feeder.file_name), 'w') as f:
+            f.write('2010-10-11T12:13:14.123456')
+
+        fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
+                                 "foo_slack_channel")
+
+        self.assertEqual(datetime.datetime(2010, 10, 11, 12, 13, 14, 123456),
+                         fee._get_last_action_time())
+
+    def _parse(self, fee, *raw_activities):
+        ret = fee._parse_kanbanize_activities(
+                    {u'activities': list(raw_activities)}, lambda data: u'fmt')
+        # as if the messages were posted
+        fee._save_checkpoint()
+        return [activity[u'text'] for task in ret
+                for date_activities in task[u'activities'].values()
+                for activity in date_activities]
+
+    def _activity(self, date, text):
+        return {u'author': u'pappacena', u'date': date, u'event': u'Task moved',
+                u'taskid': u'119', u'text': text}
+
+    def test_same_second_activities_in_later_fetch(self):
+        fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
+                                 "foo_slack_channel")
+        first = self._activity(u'2010-10-10 13:30:00', u'first')
+        second = self._activity(u'2010-10-10 13:30:00', u'second')
+
+        self.assertEqual([u'first'], self._parse(fee, first))
+        self.assertEqual([u'second'], self._parse(fee, first, second))
+        self.assertEqual([], self._parse(fee, first, second))
+
+    def test_seen_window_accepts_late_activities(self):
+        fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
+                            "foo_slack_channel",
+                            kanbanize_seen_window=datetime.timedelta(
+                                                                minutes=10))
+        first = self._activity(u'2010-10-10 13:30:00', u'first')
+        late = self._activity(u'2010-10-10 13:25:00', u'late')
+        too_late = self._activity(u'2010-10-10 13:15:00', u'too late')
+
+        self.assertEqual([u'first'], self._parse(fee, first))
+        self.assertEqual([u'late'], self._parse(fee, first, late, too_late))
+        self.assertEqual([], self._parse(fee, first, late, too_late))
+
+    def test_seen_activities_eviction(self):
+        store = checkpoint.CheckpointStore()
+        store.max_seen_activities = 2
+        key = ('account', 4, 'channel')
+        store.save_seen(*(key + ({
+            'a': datetime.datetime(2010, 10, 10, 13, 0),
+            'b': datetime.datetime(2010, 10, 10, 13, 10),
+            'c': datetime.datetime(2010, 10, 10, 13, 20),
+            'd': datetime.datetime(2010, 10, 10, 13, 30),
+        }, datetime.datetime(2010, 10, 10, 13, 5))))
+
+        self.assertEqual(set(['c', 'd']), store.get_seen(*(key + (
+                                        datetime.datetime(2010, 10, 10),))))
+        self.assertEqual(set(), store.get_seen('account', 5, 'channel',
+                                               datetime.datetime(2010, 10, 10)))
+
+    def test_outbox_batch_checkpoint(self):
+        store = checkpoint.CheckpointStore()
+        key = ('account', 4, 'channel')
+        date = datetime.datetime(2010, 10, 10, 13, 30)
+        store.enqueue(*(key + (['first', 'second'], date, {'a': date},
+                               None, date)))
+
+        outbox = store.get_outbox(*key)
+        self.assertEqual([('first', 1, date), ('second', 1, date)],
+                         [message[1:] for message in outbox])
+        self.assertEqual([], store.get_outbox('account', 5, 'channel'))
+
+        store.retry(outbox[0][0], date + datetime.timedelta(minutes=1))
+        store.ack(outbox[0][0])
+        self.assertEqual(None, store.get(*key))
+        store.ack(outbox[1][0])
+        self.assertEqual(date, store.get(*key))
+        self.assertEqual(set(['a']), store.get_seen(*(key + (date,))))
+        self.assertEqual([], store.get_outbox(*key))
+
+    def test_outbox_ack_many_and_dead_letter(self):
+        store = checkpoint.CheckpointStore()
+        key = ('account', 4, 'channel')
+        date = datetime.datetime(2010, 10, 10, 13, 30)
+        later = datetime.datetime(2010, 10, 10, 13, 40)
+        store.enqueue(*(key + (['first', 'second'], date, {'a': date},
+                               None, date)))
+        store.enqueue(*(key + (['third', 'fourth'], later, {'b': later},
+                               None, date)))
+        outbox = store.get_outbox(*key)
+
+        store.dead_letter(outbox[0][0], u'channel_not_found', later)
+        self.assertEqual(None, store.get(*key))
+        # both batches emptied in one transaction, in order
+        store.ack(*[message[0] for message in outbox[1:]])
+        self.assertEqual(later, store.get(*key))
+        self.assertEqual(set(['a', 'b']), store.get_seen(*(key + (date,))))
+        self.assertEqual([], store.get_outbox(*key))
+        self.assertEqual([('first', 1, u'channel_not_found', later)],
+                         store.get_dead_letters(*key))
+
+    def test_api_key_not_saved(self):
+        fee = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
+                                 "foo_slack_channel")
+        fee._save_last_action_time(datetime.datetime(2010, 10, 11))
+
+        with open(fee.checkpoint_store.path, 'rb') as f:
+            self.assertNotIn('foo_kanbanize_api_key', f.read())
 
 
 class TestFeederClass(unittest.TestCase):
 
     def setUp(self):
+        # keep the checkpoint store of the tests out of the real $HOME
+        self.home = tempfile.mkdtemp()
+        patcher = mock.patch('os.path.expanduser', return_value=self.home)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.home)
         self.obj = feeder.Feeder("foo_kanbanize_api_key", 4, "foo_slack_token",
                                  "foo_slack_channel")
         self.utc_zone = tz.tzutc()
@@ -66,12 +236,24 @@ class TestFeederClass(unittest.TestCase):
             'api_key': "foo_kanbanize_api_key",
             'board_id': 4,
             'collect_timedelta': datetime.timedelta(minutes=60),
-            'kanbanize_message_fomatter': None
+            'kanbanize_message_fomatter': None,
+            'seen_window': datetime.timedelta(0),
+            'max_wait': 0,
+            'fetch_overlap': datetime.timedelta(minutes=5),
+            'max_collect_timedelta': datetime.timedelta(hours=24),
+            'page_workers': 4,
+            'max_page_wait': 600,
+            'formatter_cache_size': 1024
         }
         exp_slack_opts = {
             'token': "foo_slack_token",
             'channel': "foo_slack_channel",
-            'user': "slackbot"
+            'user': "slackbot",
+            'max_attachments': 20,
+            'max_attempts': 10,
+            'max_message_bytes': 16000,
+            'retry_backoff': 30,
+            'max_retry_backoff': 3600
         }
         self.assertEqual(exp_kanbanize_opts, self.obj.kanbanize_opts)
         self.assertEqual(exp_slack_opts, self.obj.slack_opts)
@@ -125,6 +307,402 @@ class TestFeederClass(unittest.TestCase):
                                         exp_to_date)
         self.assertEqual(mk_ret, ret)
 
+    @mock.patch.object(feeder.Feeder, '_get_last_action_time')
+    def test_collect_start_date_from_last_action_time(self, get_last_time):
+        self.obj.date_converter = dates.DateConverter(
+                                            tz.tzoffset(None, -10800))
+        get_last_time.return_value = datetime.datetime(2012, 1, 14, 12, 30)
+        to_date = datetime.datetime(2012, 1, 14, 11, 0)
+
+        self.assertEqual(datetime.datetime(2012, 1, 14, 9, 25),
+                         self.obj._get_collect_start_date(to_date))
+
+        self.obj.kanbanize_opts['seen_window'] = datetime.timedelta(
+                                                                minutes=20)
+        self.assertEqual(datetime.datetime(2012, 1, 14, 9, 10),
+                         self.obj._get_collect_start_date(to_date))
+
+    @mock.patch.object(feeder.Feeder, '_get_last_action_time')
+    def test_collect_start_date_after_long_outage(self, get_last_time):
+        get_last_time.return_value = datetime.datetime(2011, 1, 14, 12, 30)
+        to_date = datetime.datetime(2012, 1, 14, 11, 0)
+
+        self.assertEqual(datetime.datetime(2012, 1, 13, 11, 0),
+                         self.obj._get_collect_start_date(to_date))
+
+    @mock.patch.object(feeder.Feeder, '_get_last_action_time')
+    def test_collect_start_date_without_last_action_time(self,
+                                                         get_last_time):
+        get_last_time.return_value = None
+        to_date = datetime.datetime(2012, 1, 14, 11, 0)
+
+        self.assertEqual(datetime.datetime(2012, 1, 14, 10, 0),
+                         self.obj._get_collect_start_date(to_date))
+
+    def _cached_activity(self, date):
+        return {u'author': u'pappacena', u'date': date, u'event': u'Task moved',
+                u'taskid': u'119', u'text': u'foo'}
+
+    @freeze_time("2012-01-14 13:20:00")
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_get_kanbanize_board_activities_with_cache(self,
+                                                       mk_get_activities):
+        self.obj.activity_cache = activity_cache.ActivityCache()
+        self.obj.date_converter = dates.DateConverter(tz.tzutc())
+        from_date = datetime.datetime(2012, 1, 14, 10, 30)
+        to_date = datetime.datetime(2012, 1, 14, 14, 20)
+        mk_get_activities.return_value = {u'activities': [
+            self._cached_activity(u'2012-01-14 13:10:00'),
+            self._cached_activity(u'2012-01-14 12:40:00'),
+            self._cached_activity(u'2012-01-14 10:10:00'),
+        ]}
+
+        # first call, nothing in cache
+        ret = self.obj._get_kanbanize_board_activities(from_date, to_date)
+
+        mk_get_activities.assert_called_once_with(4, u'2012-01-14 10:00:00',
+                                                  u'2012-01-14 14:20:00')
+        self.assertEqual(mk_get_activities.return_value, ret)
+
+        # closed hours (10h, 11h and 12h) from cache
+        mk_get_activities.reset_mock()
+        mk_get_activities.return_value = {u'activities': [
+            self._cached_activity(u'2012-01-14 13:15:00'),
+            self._cached_activity(u'2012-01-14 13:10:00'),
+        ]}
+
+        ret = self.obj._get_kanbanize_board_activities(from_date, to_date)
+
+        mk_get_activities.assert_called_once_with(4, u'2012-01-14 13:00:00',
+                                                  u'2012-01-14 14:20:00')
+        self.assertEqual([u'2012-01-14 13:15:00', u'2012-01-14 13:10:00',
+                          u'2012-01-14 12:40:00', u'2012-01-14 10:10:00'],
+                         [a[u'date'] for a in ret[u'activities']])
+
+    @freeze_time("2012-01-14 10:50:00")
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_get_kanbanize_board_activities_with_cache_open_hour(self,
+                                                        mk_get_activities):
+        """
+            an open hour is not cached, so it is fetched from the collect
+            start, not from its beginning
+        """
+        self.obj.activity_cache = activity_cache.ActivityCache()
+        self.obj.date_converter = dates.DateConverter(tz.tzutc())
+        mk_get_activities.return_value = {u'activities': [
+            self._cached_activity(u'2012-01-14 10:49:00')]}
+
+        ret = self.obj._get_kanbanize_board_activities(
+                                        datetime.datetime(2012, 1, 14, 10, 44),
+                                        datetime.datetime(2012, 1, 14, 11, 50))
+
+        mk_get_activities.assert_called_once_with(4, u'2012-01-14 10:44:00',
+                                                  u'2012-01-14 11:50:00')
+        self.assertEqual(mk_get_activities.return_value, ret)
+        self.assertEqual({}, self.obj.activity_cache.get_hours(
+            self.obj.checkpoint_key[0], 4,
+            [datetime.datetime(2012, 1, 14, 10, 0)]))
+
+    @freeze_time("2012-01-14 13:20:00")
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_get_kanbanize_board_activities_with_cache_nodata(self,
+                                                        mk_get_activities):
+        self.obj.activity_cache = activity_cache.ActivityCache()
+        self.obj.date_converter = dates.DateConverter(tz.tzutc())
+        mk_get_activities.return_value = u'No activities found for the'\
+            u' specified board and time range.'
+
+        ret = self.obj._get_kanbanize_board_activities(
+                                        datetime.datetime(2012, 1, 14, 11, 0),
+                                        datetime.datetime(2012, 1, 14, 14, 0))
+
+        self.assertEqual({u'activities': []}, ret)
+        self.assertEqual(2, len(self.obj.activity_cache.get_hours(
+            self.obj.checkpoint_key[0], 4,
+            [datetime.datetime(2012, 1, 14, 11, 0),
+             datetime.datetime(2012, 1, 14, 12, 0),
+             datetime.datetime(2012, 1, 14, 13, 0)])))
+
+    @freeze_time("2012-01-14 13:20:00")
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_get_kanbanize_board_activities_with_cache_error(self,
+                                                        mk_get_activities):
+        """
+            an error answer is not cached as empty hours, the next run
+            fetches them again
+        """
+        self.obj.activity_cache = activity_cache.ActivityCache()
+        self.obj.date_converter = dates.DateConverter(tz.tzutc())
+        from_date = datetime.datetime(2012, 1, 14, 11, 0)
+        to_date = datetime.datetime(2012, 1, 14, 14, 0)
+        mk_get_activities.return_value = u'Temporary error, try again later'
+
+        self.assertEqual(None, self.obj._get_kanbanize_board_activities(
+                                                        from_date, to_date))
+        self.assertEqual({}, self.obj.activity_cache.get_hours(
+            self.obj.checkpoint_key[0], 4,
+            [datetime.datetime(2012, 1, 14, 11, 0),
+             datetime.datetime(2012, 1, 14, 12, 0)]))
+
+        mk_get_activities.reset_mock()
+        mk_get_activities.return_value = {u'activities': [
+            self._cached_activity(u'2012-01-14 11:30:00')]}
+
+        ret = self.obj._get_kanbanize_board_activities(from_date, to_date)
+
+        mk_get_activities.assert_called_once_with(4, u'2012-01-14 11:00:00',
+                                                  u'2012-01-14 14:00:00')
+        self.assertEqual([u'2012-01-14 11:30:00'],
+                         [a[u'date'] for a in ret[u'activities']])
+
+    @mock.patch.object(SlackClient, 'chat_post_message')
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_run_with_cache_error(self, mk_get_activities, mk_post_message):
+        self.obj.activity_cache = activity_cache.ActivityCache()
+        mk_get_activities.return_value = u'Temporary error'
+
+        with freeze_time('2012-01-14 20:00:00'):
+            self.assertFalse(self.obj.run())
+        self.assertEqual(None, self.obj._get_last_action_time())
+        self.assertFalse(mk_post_message.called)
+
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_fetch_board_activities_pages(self, mk_get_activities):
+        pages = {
+            None: [self._cached_activity(u'2012-01-14 13:10:00'),
+                   self._cached_activity(u'2012-01-14 12:10:00')],
+            2: [self._cached_activity(u'2012-01-14 13:05:00'),
+                self._cached_activity(u'2012-01-14 11:10:00')],
+            3: [self._cached_activity(u'2012-01-14 12:50:00')],
+        }
+
+        def get_activities(board_id, from_date, to_date, page=None):
+            return {u'allactivities': u'5', u'page': page or 1,
+                    u'activities': list(pages[page])}
+        mk_get_activities.side_effect = get_activities
+        self.obj.rate_budget = mock.Mock()
+        self.obj.rate_budget.wait_time.return_value = 0
+        self.obj.rate_budget.try_acquire.return_value = True
+
+        ret = self.obj._fetch_board_activities(u'2012-01-14 10:00:00',
+                                               u'2012-01-14 14:00:00')
+
+        self.assertEqual([u'2012-01-14 13:10:00', u'2012-01-14 13:05:00',
+                          u'2012-01-14 12:50:00', u'2012-01-14 12:10:00',
+                          u'2012-01-14 11:10:00'],
+                         [a[u'date'] for a in ret[u'activities']])
+        self.assertEqual(3, mk_get_activities.call_count)
+        self.assertEqual([mock.call(1), mock.call(2)],
+                         self.obj.rate_budget.try_acquire.call_args_list)
+
+        # through the io core
+        self.obj.io_core = concurrency.IOCore(2, 1)
+        self.addCleanup(self.obj.io_core.close)
+        self.obj.io_core.call = mock.Mock(wraps=self.obj.io_core.call)
+
+        self.assertEqual(ret, self.obj._fetch_board_activities(
+                        u'2012-01-14 10:00:00', u'2012-01-14 14:00:00'))
+        self.assertEqual([concurrency.KANBANIZE] * 3,
+                         [call[0][0] for call in
+                          self.obj.io_core.call.call_args_list])
+
+    @mock.patch.object(SlackClient, 'chat_post_message')
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_run_pages_error(self, mk_get_activities, mk_post_message):
+        """
+            a page answered with an error is not replaced by an empty one,
+            nothing is posted and the checkpoint does not move
+        """
+        def get_activities(board_id, from_date, to_date, page=None):
+            if page == 2:
+                return u'Error: try again later'
+            return {u'allactivities': 2, u'activities': [
+                        self._cached_activity(u'2012-01-14 20:03:00')]}
+        mk_get_activities.side_effect = get_activities
+        self.obj.rate_budget = mock.Mock(capacity=30)
+        self.obj.rate_budget.wait_time.return_value = 0
+        self.obj.rate_budget.try_acquire.return_value = True
+
+        with mock.patch.object(feeder.logger, 'error') as mk_error:
+            self.assertEqual(None, self.obj._fetch_board_activities(
+                        u'2012-01-14 19:00:00', u'2012-01-14 21:05:00'))
+            self.assertTrue(mk_error.called)
+            with freeze_time('2012-01-14 20:05:00'):
+                self.assertFalse(self.obj.run())
+
+        self.assertEqual(None, self.obj._get_last_action_time())
+        self.assertFalse(mk_post_message.called)
+
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_fetch_board_activities_pages_shifted(self, mk_get_activities):
+        """
+            an activity added between the pages moves the last one of page
+            1 to page 2, it is returned once
+        """
+        pages = {
+            None: [self._cached_activity(u'2012-01-14 13:10:00'),
+                   self._cached_activity(u'2012-01-14 13:05:00')],
+            2: [self._cached_activity(u'2012-01-14 13:05:00'),
+                self._cached_activity(u'2012-01-14 12:50:00')],
+        }
+
+        def get_activities(board_id, from_date, to_date, page=None):
+            return {u'allactivities': u'4', u'activities': list(pages[page])}
+        mk_get_activities.side_effect = get_activities
+        self.obj.rate_budget = mock.Mock(capacity=30)
+        self.obj.rate_budget.wait_time.return_value = 0
+        self.obj.rate_budget.try_acquire.return_value = True
+
+        ret = self.obj._fetch_board_activities(u'2012-01-14 10:00:00',
+                                               u'2012-01-14 14:00:00')
+
+        self.assertEqual([u'2012-01-14 13:10:00', u'2012-01-14 13:05:00',
+                          u'2012-01-14 12:50:00'],
+                         [a[u'date'] for a in ret[u'activities']])
+
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_fetch_board_activities_pages_budget_exhausted(self,
+                                                        mk_get_activities):
+        mk_get_activities.return_value = {
+            u'allactivities': 3,
+            u'activities': [self._cached_activity(u'2012-01-14 13:10:00')]}
+        self.obj.rate_budget = mock.Mock(capacity=30)
+        self.obj.rate_budget.wait_time.side_effect = [0, 601]
+        self.obj.rate_budget.try_acquire.return_value = True
+
+        ret = self.obj._fetch_board_activities(u'2012-01-14 10:00:00',
+                                               u'2012-01-14 14:00:00')
+
+        self.assertEqual(None, ret)
+        self.assertEqual(1, mk_get_activities.call_count)
+
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_fetch_board_activities_pages_budget(self, mk_get_activities):
+        """
+            with the default budget (30 calls per hour, no wait) and a run
+            every minute, busy boards wait for the budget of their other
+            pages instead of never being collected
+        """
+        now = [0.0]
+        self.obj.rate_budget = rate_limit.RateBudget(
+                                    "foo_kanbanize_api_key", 30,
+                                    path=os.path.join(self.home, 'budget'),
+                                    clock=lambda: now[0])
+
+        calls = []
+
+        def get_activities(board_id, from_date, to_date, page=None):
+            calls.append(page)
+            return {u'allactivities': 3, u'activities': [
+                        self._cached_activity(u'2012-01-14 13:%02d:00' %
+                                              (page or 1))]}
+        mk_get_activities.side_effect = get_activities
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        results = []
+        # only the sleeps of the feeder, the pool threads sleep too
+        with mock.patch('feeder.time') as mk_time:
+            mk_time.time = time.time
+            mk_time.sleep.side_effect = sleep
+            for run in range(60):
+                results.append(self.obj._fetch_board_activities(
+                            u'2012-01-14 10:00:00', u'2012-01-14 14:00:00'))
+                now[0] = max(now[0], (run + 1) * 60.0)
+
+        collected = [ret for ret in results if ret is not None]
+        self.assertTrue(collected)
+        self.assertEqual(3, len(collected[0][u'activities']))
+        self.assertTrue(mk_time.sleep.called)
+        # every call was used by a collect, with a full bucket to start
+        self.assertEqual(len(collected) * 3, len(calls))
+        self.assertGreaterEqual(len(collected), 20)
+
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_fetch_board_activities_pages_over_capacity(self,
+                                                        mk_get_activities):
+        mk_get_activities.return_value = {
+            u'allactivities': 40,
+            u'activities': [self._cached_activity(u'2012-01-14 13:10:00')]}
+        self.obj.rate_budget = mock.Mock(capacity=30)
+        self.obj.rate_budget.wait_time.return_value = 0
+        self.obj.rate_budget.try_acquire.return_value = True
+
+        with mock.patch.object(feeder.logger, 'error') as mk_error:
+            self.assertEqual(None, self.obj._fetch_board_activities(
+                        u'2012-01-14 10:00:00', u'2012-01-14 14:00:00'))
+
+        self.assertEqual(1, mk_get_activities.call_count)
+        self.assertEqual([mock.call(1)],
+                         self.obj.rate_budget.try_acquire.call_args_list)
+        self.assertTrue(mk_error.called)
+
+    def test_fetch_board_activities_pages_not_supported(self):
+        calls = []
+
+        class OldKanbanize(object):
+            def get_board_activities(self, boardid, fromdate, todate,
+                                     format='dict'):
+                calls.append(boardid)
+                return {u'allactivities': 3, u'activities': [{}]}
+        self.obj.kanbanize_client = OldKanbanize()
+
+        with mock.patch.object(feeder.logger, 'error') as mk_error:
+            self.assertEqual(None, self.obj._fetch_board_activities(
+                        u'2012-01-14 10:00:00', u'2012-01-14 14:00:00'))
+
+        self.assertEqual([4], calls)
+        self.assertTrue(mk_error.called)
+        self.assertFalse(self.obj.pages_supported)
+
+        # recording the responses (--kanbanize_record)
+        self.obj.pages_supported = None
+        self.obj.kanbanize_client = cassette.RecordingKanbanize(
+                                        OldKanbanize(),
+                                        os.path.join(self.home, 'cassette'))
+
+        with mock.patch.object(feeder.logger, 'error'):
+            self.assertEqual(None, self.obj._fetch_board_activities(
+                        u'2012-01-14 10:00:00', u'2012-01-14 14:00:00'))
+
+        self.assertEqual([4, 4], calls)
+        self.assertFalse(self.obj.pages_supported)
+
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_get_kanbanize_board_activities_budget_exhausted(self,
+                                                        mk_get_activities):
+        self.obj.rate_budget = mock.Mock()
+        self.obj.rate_budget.wait_time.return_value = 120
+
+        ret = self.obj._get_kanbanize_board_activities()
+
+        self.assertEqual(None, ret)
+        self.assertFalse(mk_get_activities.called)
+        self.assertFalse(self.obj.rate_budget.try_acquire.called)
+
+    @mock.patch('time.sleep')
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_get_kanbanize_board_activities_budget_wait(self,
+                                                mk_get_activities, mk_sleep):
+        self.obj.rate_budget = mock.Mock()
+        self.obj.rate_budget.wait_time.return_value = 20
+        self.obj.rate_budget.try_acquire.return_value = True
+        self.obj.kanbanize_opts['max_wait'] = 30
+
+        self.obj._get_kanbanize_board_activities()
+
+        mk_sleep.assert_called_once_with(20)
+        self.assertTrue(mk_get_activities.called)
+
+    @mock.patch.object(feeder.Feeder, '_parse_kanbanize_activities')
+    @mock.patch.object(feeder.Feeder, '_get_kanbanize_board_activities')
+    def test_run_budget_exhausted(self, mk_get_kanbanize, mk_parse_kanbanize):
+        mk_get_kanbanize.return_value = None
+
+        self.assertFalse(self.obj.run())
+        self.assertFalse(mk_parse_kanbanize.called)
+
     @mock.patch.object(SlackClient, 'chat_post_message')
     def test_simple_post_slack_message(self, mk_post_message):
         mk_post_message.return_value = {u'ok': True}
@@ -379,6 +957,125 @@ class TestFeederClass(unittest.TestCase):
         ]
         self.assertEqual(exp_ret, ret)
 
+    @mock.patch.object(feeder.Feeder, '_get_last_action_time')
+    @mock.patch('dateutil.tz.tzlocal')
+    def test_parse_kanbanize_activities_with_batch_formatter(self, fake_local,
+        get_time):
+        """
+            batch formatters are called once with all the new activities
+        """
+        fake_local.return_value = tz.tzoffset(None, -10800)
+        get_time.return_value = None
+
+        batch_function = mock.Mock(return_value=[u'first', u''])
+
+        raw_data = {u'activities': [
+            {u'author': u'marcel.portela',
+             u'date': u'2014-10-02 20:21:06',
+             u'event': u'Assignee changed',
+             u'taskid': u'133',
+             u'text': u'New assignee: marcel.portela'},
+            {u'author': u'marcel.portela',
+             u'date': u'2014-10-02 20:21:06',
+             u'event': u'Task moved',
+             u'taskid': u'133',
+             u'text': u"From 'J\xe1 detalhados' to 'In Progress.Fazendo'"}
+        ]}
+
+        ret = self.obj._parse_kanbanize_activities(
+                        raw_data, formatters.batch_formatter(batch_function))
+
+        self.assertEqual(1, batch_function.call_count)
+        self.assertEqual(2, len(batch_function.call_args[0][0]))
+        exp_ret = [
+            {u'taskid': u'133',
+             u'activities': {
+                    u'2014-10-02 17:21:06': [
+                        {u'author': u'marcel.portela',
+                         u'event': u'Assignee changed',
+                         u'text': u"New assignee: marcel.portela",
+                         u'formatted_message': u'first'},
+                    ]
+                }
+            }
+        ]
+        self.assertEqual(exp_ret, ret)
+
+    @mock.patch.object(feeder.Feeder, '_get_last_action_time')
+    def test_parse_kanbanize_activities_memoized_formatter(self, get_time):
+        """
+            pure formatters are memoized between runs, others are not
+        """
+        get_time.return_value = None
+        raw_data = {u'activities': [
+            {u'author': u'bot', u'date': u'2014-10-02 20:21:06',
+             u'event': u'Task moved', u'taskid': u'133', u'text': u'foo'},
+            {u'author': u'bot', u'date': u'2014-10-02 20:22:06',
+             u'event': u'Task moved', u'taskid': u'134', u'text': u'foo'}
+        ]}
+
+        @formatters.pure_formatter
+        def pure(activity):
+            calls.append(activity)
+            return activity[u'text']
+
+        def impure(activity):
+            calls.append(activity)
+            return activity[u'text']
+
+        calls = []
+        self.obj._parse_kanbanize_activities(raw_data, pure)
+        self.obj._parse_kanbanize_activities(raw_data, pure)
+        self.assertEqual(1, len(calls))
+        self.assertEqual((3, 1), (self.obj.memoized_formatter.hits,
+                                  self.obj.memoized_formatter.misses))
+
+        calls = []
+        self.obj._parse_kanbanize_activities(raw_data, impure)
+        self.assertEqual(2, len(calls))
+
+        calls = []
+        self.obj.kanbanize_opts['formatter_cache_size'] = 0
+        self.obj._parse_kanbanize_activities(raw_data, pure)
+        self.assertEqual(2, len(calls))
+
+    @mock.patch.object(feeder.Feeder, '_get_last_action_time')
+    @mock.patch('dateutil.tz.tzlocal')
+    def test_parse_kanbanize_activities_grouping_order(self, fake_local,
+        get_time):
+        """
+            tasks must keep the order they are first seen and the dates of
+            each task must be in chronological order, even when the
+            activities of the tasks are interleaved
+        """
+        fake_local.return_value = tz.tzutc()
+        get_time.return_value = None
+
+        def activity(taskid, date):
+            return {u'author': u'pappacena', u'date': date,
+                    u'event': u'Task moved', u'taskid': taskid,
+                    u'text': u'foo'}
+
+        raw_data = {u'activities': [
+            activity(u'119', u'2014-10-02 19:30:00'),
+            activity(u'121', u'2014-10-02 19:29:00'),
+            activity(u'119', u'2014-10-02 19:28:00'),
+            activity(u'133', u'2014-10-02 19:27:00'),
+            activity(u'121', u'2014-10-02 19:26:00'),
+            activity(u'119', u'2014-10-02 19:30:00'),
+        ]}
+
+        ret = self.obj._parse_kanbanize_activities(raw_data,
+                                                   lambda data: u'fmted')
+
+        self.assertEqual([u'119', u'121', u'133'],
+                         [task[u'taskid'] for task in ret])
+        self.assertEqual([u'2014-10-02 19:28:00', u'2014-10-02 19:30:00'],
+                         list(ret[0][u'activities']))
+        self.assertEqual(2, len(ret[0][u'activities'][u'2014-10-02 19:30:00']))
+        self.assertEqual([u'2014-10-02 19:26:00', u'2014-10-02 19:29:00'],
+                         list(ret[1][u'activities']))
+
     def test_default_message_formatter_function_with_know_event(self):
         activity = {u'author': u'marcel.portela',
                     u'event': u'Assignee changed',
@@ -405,6 +1102,22 @@ class TestFeederClass(unittest.TestCase):
 
         self.assertEqual(exp_str, formatted_str)
 
+    def test_iter_slack_messages_dates_order(self):
+        activities = [
+            {u'taskid': u'133',
+             u'activities': dict(
+                    (u'2014-10-02 20:%02d:06' % minute, [
+                        {u'formatted_message': unicode(minute)}])
+                    for minute in range(30, 0, -3))
+            }
+        ]
+
+        messages = [attachment[u'fields'][1][u'value'] for attachment in
+                    self.obj._iter_slack_messages(activities)]
+
+        self.assertEqual([unicode(minute) for minute in range(3, 31, 3)],
+                         messages)
+
     def test_format_slack_messages(self):
         activities = [
             {u'taskid': u'133',
@@ -488,7 +1201,7 @@ class TestFeederClass(unittest.TestCase):
         self.assertEqual(exp_result, formatted)
 
     @mock.patch.object(feeder.Feeder, '_post_slack_message')
-    @mock.patch.object(feeder.Feeder, '_format_slack_messages')
+    @mock.patch.object(feeder.Feeder, '_iter_slack_messages')
     @mock.patch.object(feeder.Feeder, '_parse_kanbanize_activities')
     @mock.patch.object(feeder.Feeder, '_get_kanbanize_board_activities')
     def test_run(self, mk_get_kanbanize, mk_parse_kanbanize,
@@ -499,7 +1212,7 @@ class TestFeederClass(unittest.TestCase):
         mk_ret_parse_kanbanize = mock.Mock()
         mk_parse_kanbanize.return_value = mk_ret_parse_kanbanize
         mk_ret_format = [{'foor': 'blah'}]
-        mk_format_messages.return_value = mk_ret_format
+        mk_format_messages.return_value = iter(mk_ret_format)
 
         ret = self.obj.run()
 
@@ -515,6 +1228,226 @@ class TestFeederClass(unittest.TestCase):
              
         mk_post_message.assert_called_with(**exp_final_call_args)
 
+    @mock.patch.object(feeder.Feeder, '_post_slack_message')
+    def test_post_slack_attachments_in_chunks(self, mk_post_message):
+        self.obj.slack_opts['max_attachments'] = 2
+        mk_post_message.side_effect = [True, Exception('boom'), True]
+        attachments = [{u'fields': [{u'value': unicode(i)}]}
+                       for i in range(5)]
+
+        ret = self.obj._post_slack_attachments(attachments)
+
+        # the messages after the one not posted are not posted either
+        self.assertEqual([json.dumps(attachments[2:4]),
+                          json.dumps(attachments[4:5])], ret)
+        self.assertEqual([json.dumps(attachments[0:2]),
+                          json.dumps(attachments[2:4])],
+                         [call[1]['attachments'] for call in
+                          mk_post_message.call_args_list])
+
+    @mock.patch.object(feeder.Feeder, '_enqueue_checkpoint')
+    @mock.patch.object(feeder.Feeder, '_post_slack_attachments')
+    @mock.patch.object(feeder.Feeder, '_parse_kanbanize_activities')
+    @mock.patch.object(feeder.Feeder, '_get_kanbanize_board_activities')
+    def test_run_with_post_error(self, mk_get_kanbanize, mk_parse_kanbanize,
+                                 mk_post_attachments, mk_enqueue):
+        mk_parse_kanbanize.return_value = []
+        mk_post_attachments.return_value = ['[{}]']
+
+        self.assertFalse(self.obj.run())
+        mk_enqueue.assert_called_once_with(['[{}]'])
+
+    @mock.patch.object(SlackClient, 'chat_post_message')
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_run_metrics(self, mk_get_activities, mk_post_message):
+        mk_get_activities.return_value = {u'activities': [
+            {u'author': u'pappacena', u'date': u'2010-10-10 13:%s:00' % i,
+             u'event': u'Task moved', u'taskid': unicode(i), u'text': u'foo'}
+            for i in range(10, 13)]}
+        mk_post_message.return_value = {u'ok': True}
+        self.obj.metrics = stats.Metrics()
+
+        self.assertTrue(self.obj.run())
+
+        counters = dict((name, value) for (name, labels), value in
+                        self.obj.metrics.counters.iteritems())
+        self.assertEqual({'activities_fetched_total': 3,
+                          'activities_filtered_total': 0,
+                          'activities_formatted_total': 3,
+                          'attachments_total': 3,
+                          'messages_posted_total': 1}, counters)
+        self.assertEqual(set(['fetch_seconds', 'parse_seconds',
+                              'format_seconds', 'payload_bytes',
+                              'slack_post_seconds']),
+                         set(name for name, labels in
+                             self.obj.metrics.histograms))
+        self.assertIn(
+            'slack_kanbanize_messages_posted_total{board="4",status="ok"} 1',
+            self.obj.metrics.render())
+
+    @mock.patch.object(feeder.Feeder, '_post_slack_message')
+    @mock.patch.object(feeder.Feeder, '_get_kanbanize_board_activities')
+    def test_run_outbox(self, mk_get_kanbanize, mk_post_message):
+        """
+            messages not posted wait in the outbox, with exponential backoff,
+            and the last action time only advances when they are posted
+        """
+        mk_get_kanbanize.return_value = {u'activities': [
+            {u'author': u'pappacena', u'date': u'2010-10-10 13:%s:00' % i,
+             u'event': u'Task moved', u'taskid': unicode(i), u'text': u'foo'}
+            for i in range(10, 13)]}
+        self.obj.slack_opts['max_attachments'] = 1
+        mk_post_message.side_effect = [True, False]
+
+        with freeze_time('2010-10-10 14:00:00'):
+            self.assertFalse(self.obj.run())
+        self.assertEqual(None, self.obj._get_last_action_time())
+        outbox = self.obj.checkpoint_store.get_outbox(
+                                                *self.obj.checkpoint_key)
+        self.assertEqual(2, len(outbox))
+        self.assertEqual(datetime.datetime(2010, 10, 10, 14, 0, 30),
+                         outbox[0][3])
+
+        # not due yet
+        with freeze_time('2010-10-10 14:00:10'):
+            self.assertFalse(self.obj.run())
+        self.assertEqual(1, mk_get_kanbanize.call_count)
+        self.assertEqual(2, mk_post_message.call_count)
+
+        # posted again and failed, the next attempt waits twice as long
+        mk_post_message.side_effect = [False]
+        with freeze_time('2010-10-10 14:00:30'):
+            self.assertFalse(self.obj.run())
+        self.assertEqual(datetime.datetime(2010, 10, 10, 14, 1, 30),
+                         self.obj.checkpoint_store.get_outbox(
+                                        *self.obj.checkpoint_key)[0][3])
+
+        mk_post_message.side_effect = None
+        mk_post_message.return_value = True
+        mk_get_kanbanize.return_value = {u'activities': []}
+        with freeze_time('2010-10-10 14:01:30'):
+            self.assertTrue(self.obj.run())
+        self.assertEqual([], self.obj.checkpoint_store.get_outbox(
+                                                *self.obj.checkpoint_key))
+        self.assertEqual(datetime.datetime(2010, 10, 10, 13, 12),
+                         self.obj._get_last_action_time())
+        self.assertEqual(2, mk_get_kanbanize.call_count)
+        posted = [call[1]['attachments'] for call in
+                  mk_post_message.call_args_list]
+        self.assertEqual(5, len(posted))
+        self.assertIn(u'10|10', posted[0])
+        for attachments in posted[1:4]:
+            self.assertIn(u'11|11', attachments)
+        self.assertIn(u'12|12', posted[4])
+
+    @mock.patch.object(SlackClient, 'chat_post_message')
+    @mock.patch.object(feeder.Feeder, '_get_kanbanize_board_activities')
+    def test_run_outbox_dead_letters(self, mk_get_kanbanize,
+                                     mk_post_message):
+        """
+            messages that can never be posted are moved aside, so they don't
+            block the board forever
+        """
+        mk_get_kanbanize.return_value = {u'activities': [
+            {u'author': u'pappacena', u'date': u'2010-10-10 13:%s:00' % i,
+             u'event': u'Task moved', u'taskid': unicode(i), u'text': u'foo'}
+            for i in range(10, 12)]}
+        self.obj.slack_opts['max_attachments'] = 1
+        self.obj.slack_opts['max_attempts'] = 3
+        mk_post_message.return_value = {u'ok': False,
+                                        u'error': u'msg_too_long'}
+
+        with freeze_time('2010-10-10 14:00:00'):
+            self.assertFalse(self.obj.run())
+        # the first message fails for good, the second one keeps failing
+        mk_post_message.side_effect = [
+            {u'ok': False, u'error': u'msg_too_long'},
+            {u'ok': False, u'error': u'internal_error'}]
+        with freeze_time('2010-10-10 14:00:30'):
+            self.assertFalse(self.obj.run())
+        self.assertEqual([u'msg_too_long'], [
+            dead_letter[2] for dead_letter in
+            self.obj.checkpoint_store.get_dead_letters(
+                                                *self.obj.checkpoint_key)])
+        self.assertEqual(None, self.obj._get_last_action_time())
+
+        mk_post_message.side_effect = None
+        mk_post_message.return_value = {u'ok': False,
+                                        u'error': u'internal_error'}
+        mk_get_kanbanize.return_value = {u'activities': []}
+        with freeze_time('2010-10-10 14:01:30'):
+            self.assertTrue(self.obj.run())
+        self.assertEqual([u'msg_too_long', u'internal_error'], [
+            dead_letter[2] for dead_letter in
+            self.obj.checkpoint_store.get_dead_letters(
+                                                *self.obj.checkpoint_key)])
+        self.assertEqual([], self.obj.checkpoint_store.get_outbox(
+                                                *self.obj.checkpoint_key))
+        self.assertEqual(datetime.datetime(2010, 10, 10, 13, 11),
+                         self.obj._get_last_action_time())
+
+    @mock.patch.object(SlackClient, 'chat_post_message')
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_run_outbox_dead_letters_slack_error(self, mk_get_kanbanize,
+                                                 mk_post_message):
+        """
+            the slack api errors raised by pyslack are permanent too
+        """
+        mk_get_kanbanize.return_value = {u'activities': [
+            {u'author': u'pappacena', u'date': u'2010-10-10 13:10:00',
+             u'event': u'Task moved', u'taskid': u'10', u'text': u'foo'}]}
+        mk_post_message.side_effect = SlackError(u'channel_not_found')
+
+        with mock.patch.object(feeder.logger, 'exception'):
+            with freeze_time('2010-10-10 14:00:00'):
+                self.assertFalse(self.obj.run())
+            mk_get_kanbanize.return_value = {u'activities': []}
+            with freeze_time('2010-10-10 14:00:30'):
+                self.assertTrue(self.obj.run())
+
+        self.assertEqual(2, mk_post_message.call_count)
+        self.assertEqual([u'channel_not_found'], [
+            dead_letter[2] for dead_letter in
+            self.obj.checkpoint_store.get_dead_letters(
+                                                *self.obj.checkpoint_key)])
+        self.assertEqual([], self.obj.checkpoint_store.get_outbox(
+                                                *self.obj.checkpoint_key))
+
+    @mock.patch.object(feeder.Feeder, '_post_slack_message')
+    @mock.patch.object(feeder.Feeder, '_parse_kanbanize_activities')
+    @mock.patch.object(feeder.Feeder, '_get_kanbanize_board_activities')
+    def test_run_without_activities(self, mk_get_kanbanize,
+                                    mk_parse_kanbanize, mk_post_message):
+        mk_parse_kanbanize.return_value = []
+
+        self.assertTrue(self.obj.run())
+        self.assertFalse(mk_post_message.called)
+
+    def test_post_slack_attachments_streaming(self):
+        """
+            each message must be posted before the attachments of the next
+            one are built
+        """
+        self.obj.slack_opts['max_attachments'] = 1
+        events = []
+
+        def attachments():
+            for i in range(2):
+                events.append('built %s' % i)
+                yield {u'fields': [{u'value': unicode(i)}]}
+
+        def post_message(**kwargs):
+            events.append('posted %s' % json.loads(kwargs['attachments'])[0][
+                                                        u'fields'][0][u'value'])
+            return True
+
+        with mock.patch.object(feeder.Feeder, '_post_slack_message',
+                               side_effect=post_message):
+            self.obj._post_slack_attachments(attachments())
+
+        self.assertEqual(['built 0', 'posted 0', 'built 1', 'posted 1'],
+                         events)
+
     @mock.patch.object(feeder.Feeder, '_save_last_action_time')
     @mock.patch.object(feeder.Feeder, '_get_last_action_time')
     @mock.patch('dateutil.tz.tzlocal')
@@ -612,10 +1545,1158 @@ class TestFeederClass(unittest.TestCase):
             }
         ]
         self.assertEqual(exp_ret, ret)
+        self.assertFalse(save_last_time.called)
 
+        self.obj._save_checkpoint()
         save_last_time.assert_called_with(
             datetime.datetime(2010, 10, 10, 13, 40, 00)
         )
 
+
+class TestDatesModule(unittest.TestCase):
+
+    def test_parse_kanbanize_date(self):
+        self.assertEqual(datetime.datetime(2014, 10, 2, 20, 21, 6),
+                         dates.parse_kanbanize_date(u'2014-10-02 20:21:06'))
+
+    def test_parse_kanbanize_date_other_format(self):
+        self.assertRaises(ValueError, dates.parse_kanbanize_date,
+                          u'02/10/2014 20:21:06')
+
+    def test_format_kanbanize_date(self):
+        self.assertEqual(u'2014-10-02 08:01:06', dates.format_kanbanize_date(
+                            datetime.datetime(2014, 10, 2, 8, 1, 6, 123)))
+
+    def test_utc_to_local_memoize_by_hour(self):
+        converter = dates.DateConverter(tz.tzoffset(None, -10800))
+
+        self.assertEqual(datetime.datetime(2014, 10, 2, 17, 21, 6),
+                         converter.utc_to_local(
+                            datetime.datetime(2014, 10, 2, 20, 21, 6)))
+        self.assertEqual(datetime.datetime(2014, 10, 2, 17, 59, 59),
+                         converter.utc_to_local(
+                            datetime.datetime(2014, 10, 2, 20, 59, 59)))
+        self.assertEqual([datetime.datetime(2014, 10, 2, 20)],
+                         list(converter.offsets))
+
+    def test_utc_to_local_dst(self):
+        zone = tz.gettz('America/New_York')
+        converter = dates.DateConverter(zone)
+
+        # DST started at 2014-03-09 07:00 UTC
+        for naive_utc in [datetime.datetime(2014, 3, 9, 6, 59, 59),
+                          datetime.datetime(2014, 3, 9, 7, 0, 0),
+                          datetime.datetime(2014, 11, 2, 5, 30, 0),
+                          datetime.datetime(2014, 11, 2, 6, 30, 0)]:
+            exp = naive_utc.replace(tzinfo=tz.tzutc()).astimezone(
+                                                zone).replace(tzinfo=None)
+            self.assertEqual(exp, converter.utc_to_local(naive_utc))
+
+    def test_utc_to_local_dst_not_aligned_to_hour(self):
+        # Lord Howe DST changes by 30 minutes at 2:00 local (15:30 UTC)
+        zone = tz.gettz('Australia/Lord_Howe')
+        converter = dates.DateConverter(zone)
+
+        for naive_utc in [datetime.datetime(2014, 10, 4, 15, 29, 59),
+                          datetime.datetime(2014, 10, 4, 15, 30, 0)]:
+            exp = naive_utc.replace(tzinfo=tz.tzutc()).astimezone(
+                                                zone).replace(tzinfo=None)
+            self.assertEqual(exp, converter.utc_to_local(naive_utc))
+
+    def test_convert_utc_strings(self):
+        converter = dates.DateConverter(tz.tzoffset(None, -10800))
+
+        ret = converter.convert_utc_strings([u'2014-10-02 20:21:06',
+                                             u'2014-10-02 20:21:06',
+                                             u'2014-10-02 02:00:00'])
+
+        exp_ret = {
+            u'2014-10-02 20:21:06': (datetime.datetime(2014, 10, 2, 20, 21, 6),
+                                     u'2014-10-02 17:21:06'),
+            u'2014-10-02 02:00:00': (datetime.datetime(2014, 10, 2, 2, 0, 0),
+                                     u'2014-10-01 23:00:00')
+        }
+        self.assertEqual(exp_ret, ret)
+
+    def test_local_to_utc_string(self):
+        converter = dates.DateConverter(tz.tzoffset(None, -10800))
+
+        self.assertEqual(u'2014-10-02 20:21:06',
+                         converter.local_to_utc_string(
+                            datetime.datetime(2014, 10, 2, 17, 21, 6)))
+
+
+class TestMultiFeederClass(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = feeder.MultiFeeder("foo_kanbanize_api_key", [4, 5, 6],
+                                      "foo_slack_token", "foo_slack_channel",
+                                      max_workers=2)
+
+    def test_board_feeder_shares_clients(self):
+        fee = self.obj._get_board_feeder(5)
+
+        self.assertIs(self.obj.slack_client, fee.slack_client)
+        self.assertIs(self.obj.kanbanize_client, fee.kanbanize_client)
+        self.assertIs(self.obj.checkpoint_store, fee.checkpoint_store)
+        self.assertIs(self.obj.io_core, fee.io_core)
+        self.assertEqual(5, fee.kanbanize_opts['board_id'])
+
+    @mock.patch.object(feeder.Feeder, '_post_slack_message')
+    @mock.patch.object(feeder.Feeder, '_get_kanbanize_board_activities')
+    def test_run_keeps_formatter_memo(self, mk_get_kanbanize,
+                                      mk_post_message):
+        self.obj.checkpoint_store = checkpoint.CheckpointStore(':memory:')
+        mk_get_kanbanize.return_value = {u'activities': [
+            {u'author': u'pappacena', u'date': u'2010-10-10 13:10:00',
+             u'event': u'Task moved', u'taskid': u'1', u'text': u'foo'}]}
+        mk_post_message.return_value = True
+
+        self.obj.run()
+        memoized_formatter = self.obj.memoized_formatter
+        self.assertIsNotNone(memoized_formatter)
+        self.obj.run()
+
+        self.assertIs(memoized_formatter, self.obj.memoized_formatter)
+        self.assertEqual(1, memoized_formatter.misses)
+
+    @mock.patch.object(feeder.Feeder, 'run')
+    def test_run_isolates_board_errors(self, mk_run):
+        mk_run.side_effect = [True, Exception('boom'), True]
+
+        ret = self.obj.run()
+
+        self.assertEqual(3, mk_run.call_count)
+        self.assertEqual(sorted([True, True, False]), sorted(ret.values()))
+        self.assertEqual([4, 5, 6], sorted(ret.keys()))
+
+    def test_board_feeder_with_router(self):
+        self.obj.router = routing.Router([routing.Route(u'#dev')],
+                                         u'foo_slack_channel')
+
+        fee = self.obj._get_board_feeder(5)
+
+        self.assertIsInstance(fee, feeder.RoutedFeeder)
+        self.assertIs(self.obj.kanbanize_client, fee.kanbanize_client)
+        self.assertEqual([u'#dev', u'foo_slack_channel'],
+                         [channel_feeder.slack_opts['channel']
+                          for channel_feeder in fee.channel_feeders])
+        for channel_feeder in fee.channel_feeders:
+            self.assertIs(self.obj.checkpoint_store,
+                          channel_feeder.checkpoint_store)
+            self.assertIs(self.obj.io_core, channel_feeder.io_core)
+
+
+class TestRoutedFeederClass(unittest.TestCase):
+
+    def setUp(self):
+        self.router = routing.Router([
+            routing.Route(u'#dev', events=[u'Comment added']),
+            routing.Route(u'#mgmt', events=[u'Task archived'])],
+            u'#general')
+        self.obj = feeder.RoutedFeeder(
+                    "foo_kanbanize_api_key", 4, "foo_slack_token",
+                    self.router,
+                    checkpoint_store=checkpoint.CheckpointStore(':memory:'))
+        self.feeders = dict((channel_feeder.slack_opts['channel'],
+                             channel_feeder)
+                            for channel_feeder in self.obj.channel_feeders)
+
+    def _raw_activity(self, minute, event):
+        return {u'author': u'pappacena', u'event': event,
+                u'date': u'2010-10-10 13:%02d:00' % minute,
+                u'taskid': unicode(minute), u'text': u'foo %s' % minute}
+
+    @mock.patch.object(SlackClient, 'chat_post_message')
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_run(self, mk_get_activities, mk_post_message):
+        mk_get_activities.return_value = {u'activities': [
+            self._raw_activity(12, u'Comment added'),
+            self._raw_activity(11, u'Task archived'),
+            self._raw_activity(10, u'Comment added')]}
+        mk_post_message.return_value = {u'ok': True}
+
+        with freeze_time('2010-10-10 14:00:00'):
+            self.assertTrue(self.obj.run())
+
+        # one fetch for the 3 channels
+        self.assertEqual(1, mk_get_activities.call_count)
+        posted = dict((call[0][0], call[1]['attachments'])
+                      for call in mk_post_message.call_args_list)
+        self.assertEqual([u'#dev', u'#mgmt'], sorted(posted))
+        self.assertIn(u'foo 10', posted[u'#dev'])
+        self.assertIn(u'foo 12', posted[u'#dev'])
+        self.assertNotIn(u'foo 11', posted[u'#dev'])
+        self.assertIn(u'foo 11', posted[u'#mgmt'])
+        # every channel checkpoints the whole fetch, even without activities
+        for channel_feeder in self.obj.channel_feeders:
+            self.assertEqual(datetime.datetime(2010, 10, 10, 13, 12),
+                             channel_feeder._get_last_action_time())
+
+    @mock.patch.object(SlackClient, 'chat_post_message')
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_run_channel_checkpoints(self, mk_get_activities,
+                                     mk_post_message):
+        """
+            a channel whose message was not posted waits in the outbox, the
+            others keep going from their own checkpoint
+        """
+        mk_get_activities.return_value = {u'activities': [
+            self._raw_activity(11, u'Task archived'),
+            self._raw_activity(10, u'Comment added')]}
+        mk_post_message.side_effect = lambda channel, text, **params: {
+                                            u'ok': channel != u'#mgmt'}
+
+        with freeze_time('2010-10-10 14:00:00'):
+            self.assertFalse(self.obj.run())
+        self.assertEqual(None, self.feeders[u'#mgmt']._get_last_action_time())
+        self.assertEqual(datetime.datetime(2010, 10, 10, 13, 11),
+                         self.feeders[u'#dev']._get_last_action_time())
+
+        mk_get_activities.return_value = {u'activities': [
+            self._raw_activity(12, u'Comment added'),
+            self._raw_activity(11, u'Task archived'),
+            self._raw_activity(10, u'Comment added')]}
+        mk_post_message.reset_mock()
+        with freeze_time('2010-10-10 14:00:10'):
+            self.assertFalse(self.obj.run())
+        # #mgmt is waiting for its retry, #dev only posts the new activity
+        self.assertEqual([u'#dev'], [call[0][0] for call in
+                                     mk_post_message.call_args_list])
+        attachments = mk_post_message.call_args[1]['attachments']
+        self.assertIn(u'foo 12', attachments)
+        self.assertNotIn(u'foo 10', attachments)
+
+        mk_post_message.reset_mock()
+        mk_post_message.side_effect = None
+        mk_post_message.return_value = {u'ok': True}
+        with freeze_time('2010-10-10 14:01:00'):
+            self.assertTrue(self.obj.run())
+        self.assertEqual([u'#mgmt'], [call[0][0] for call in
+                                      mk_post_message.call_args_list])
+        for channel_feeder in self.obj.channel_feeders:
+            self.assertEqual(datetime.datetime(2010, 10, 10, 13, 12),
+                             channel_feeder._get_last_action_time())
+        self.assertEqual(3, mk_get_activities.call_count)
+
+    @mock.patch.object(Kanbanize, 'get_board_activities')
+    def test_run_fetches_from_oldest_checkpoint(self, mk_get_activities):
+        mk_get_activities.return_value = {u'activities': []}
+        self.feeders[u'#dev']._save_last_action_time(
+                                    datetime.datetime(2010, 10, 10, 13, 30))
+        self.feeders[u'#mgmt']._save_last_action_time(
+                                    datetime.datetime(2010, 10, 10, 12, 30))
+        self.feeders[u'#general']._save_last_action_time(
+                                    datetime.datetime(2010, 10, 10, 13, 0))
+        converter = self.obj.board_feeder._get_date_converter()
+
+        with freeze_time('2010-10-10 14:00:00'):
+            self.assertTrue(self.obj.run())
+
+        self.assertEqual(converter.local_to_utc_string(
+                                converter.utc_to_local(datetime.datetime(
+                                            2010, 10, 10, 12, 25))),
+                         mk_get_activities.call_args[0][1])
+
+
+class TestRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = routing.Router([
+            routing.Route(u'#dev', events=[u'Comment added',
+                                           u'Task moved']),
+            routing.Route(u'#mgmt', events=u'Task archived',
+                          authors=[u'mportela']),
+            routing.Route(u'#task', taskids=[125]),
+            routing.Route(u'#alerts', text=u'(?i)urgent')], u'#general')
+
+    def _match(self, event=u'Task updated', author=u'pappacena',
+               taskid=u'1', text=u'foo'):
+        return self.obj.match({u'event': event, u'author': author,
+                               u'taskid': taskid, u'text': text})
+
+    def test_match(self):
+        self.assertEqual((u'#dev',), self._match(event=u'Task moved'))
+        self.assertEqual((u'#mgmt',), self._match(event=u'Task archived',
+                                                  author=u'mportela'))
+        # all the criteria of a route must match
+        self.assertEqual((u'#general',), self._match(event=u'Task archived'))
+        self.assertEqual((u'#task',), self._match(taskid=u'125'))
+        self.assertEqual((u'#dev', u'#task', u'#alerts'),
+                         self._match(event=u'Comment added', taskid=125,
+                                     text=u'URGENT: foo'))
+        self.assertEqual((u'#general',), self._match())
+
+    def test_match_without_default_channel(self):
+        obj = routing.Router([routing.Route(u'#dev', events=[u'Task moved']),
+                              routing.Route(u'#dev', text=u'foo')])
+
+        self.assertEqual([u'#dev'], obj.channels)
+        self.assertEqual((u'#dev',), obj.match({u'event': u'Task moved',
+                                                u'text': u'foo'}))
+        self.assertEqual((), obj.match({u'event': u'Task updated',
+                                        u'text': u'bar'}))
+
+    def test_route(self):
+        ret = self.obj.route([
+            {u'event': u'Task moved', u'author': u'x', u'taskid': u'1',
+             u'text': u'urgent'},
+            {u'event': u'Task updated', u'author': u'x', u'taskid': u'2',
+             u'text': u''},
+            {u'event': u'Comment added', u'author': u'x', u'taskid': u'3',
+             u'text': u''}])
+
+        self.assertEqual({u'#dev': set([0, 2]), u'#mgmt': set(),
+                          u'#task': set(), u'#alerts': set([0]),
+                          u'#general': set([1])}, ret)
+
+    def test_from_file(self):
+        path = tempfile.mktemp(suffix='.json')
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as file:
+            json.dump([{u'channel': u'#dev', u'events': [u'Comment added']},
+                       {u'channel': u'#all'}], file)
+
+        obj = routing.Router.from_file(path, u'#general')
+
+        self.assertEqual([u'#dev', u'#all', u'#general'], obj.channels)
+        self.assertEqual((u'#dev', u'#all'),
+                         obj.match({u'event': u'Comment added'}))
+        self.assertEqual((u'#all',), obj.match({u'event': u'Task moved'}))
+
+
+class TestIOCore(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = concurrency.IOCore(max_kanbanize_calls=2,
+                                      max_slack_calls=1)
+        self.addCleanup(self.obj.close)
+
+    def test_call(self):
+        self.assertEqual(3, self.obj.call(concurrency.SLACK, sum, [1, 2]))
+        self.assertEqual(3, self.obj.submit(concurrency.SLACK, sum,
+                                            [1, 2]).get(5))
+
+    def test_map_limits_calls_in_flight(self):
+        lock = threading.Lock()
+        in_flight = [0]
+        max_in_flight = [0]
+
+        def call(item):
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return item * 2
+
+        self.assertEqual([i * 2 for i in range(8)],
+                         self.obj.map(concurrency.KANBANIZE, call, range(8)))
+        self.assertLessEqual(max_in_flight[0], 2)
+
+        max_in_flight[0] = 0
+        self.obj.map(concurrency.SLACK, call, range(4))
+        self.assertLessEqual(max_in_flight[0], 1)
+
+
+class TestStats(unittest.TestCase):
+
+    def test_render(self):
+        obj = stats.Metrics()
+        obj.incr('messages_posted_total', board=4, status='ok')
+        obj.incr('messages_posted_total', 2, board=4, status='ok')
+        obj.observe('payload_bytes', 700, board=4)
+        obj.observe('payload_bytes', 100000, board=4)
+
+        self.assertEqual(
+            '# TYPE slack_kanbanize_messages_posted_total counter\n'
+            'slack_kanbanize_messages_posted_total{board="4",status="ok"} 3\n'
+            '# TYPE slack_kanbanize_payload_bytes histogram\n'
+            'slack_kanbanize_payload_bytes_bucket{board="4",le="500"} 0\n'
+            'slack_kanbanize_payload_bytes_bucket{board="4",le="1000"} 1\n'
+            'slack_kanbanize_payload_bytes_bucket{board="4",le="2000"} 1\n'
+            'slack_kanbanize_payload_bytes_bucket{board="4",le="4000"} 1\n'
+            'slack_kanbanize_payload_bytes_bucket{board="4",le="8000"} 1\n'
+            'slack_kanbanize_payload_bytes_bucket{board="4",le="16000"} 1\n'
+            'slack_kanbanize_payload_bytes_bucket{board="4",le="32000"} 1\n'
+            'slack_kanbanize_payload_bytes_bucket{board="4",le="+Inf"} 2\n'
+            'slack_kanbanize_payload_bytes_sum{board="4"} 100700\n'
+            'slack_kanbanize_payload_bytes_count{board="4"} 2\n',
+            obj.render())
+
+    def test_timer_and_textfile(self):
+        obj = stats.Metrics()
+        with obj.timer('fetch_seconds', board=4):
+            pass
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'slack_kanbanize.prom')
+
+        obj.write_textfile(path)
+
+        with open(path) as file:
+            content = file.read()
+        self.assertIn('slack_kanbanize_fetch_seconds_count{board="4"} 1\n',
+                      content)
+        self.assertEqual(['slack_kanbanize.prom'], os.listdir(directory))
+
+    def test_statsd(self):
+        statsd = stats.StatsdClient('localhost', 8125)
+        statsd.socket = mock.Mock()
+        obj = stats.Metrics(statsd)
+
+        obj.incr('messages_posted_total', board=4, status='ok')
+        obj.observe('slack_post_seconds', 0.25, board=4)
+        obj.observe('payload_bytes', 700, board=4)
+
+        self.assertEqual([
+            mock.call('slack_kanbanize.messages_posted_total.board_4.'
+                      'status_ok:1|c', ('localhost', 8125)),
+            mock.call('slack_kanbanize.slack_post_seconds.board_4:250|ms',
+                      ('localhost', 8125)),
+            mock.call('slack_kanbanize.payload_bytes.board_4:700|h',
+                      ('localhost', 8125))],
+            statsd.socket.sendto.call_args_list)
+
+    def test_null_metrics(self):
+        with stats.NULL_METRICS.timer('fetch_seconds', board=4):
+            stats.NULL_METRICS.incr('attachments_total', board=4)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_run_every(self):
+        job = mock.Mock(return_value=True)
+        obj = profiling.Profiler(os.path.join(self.directory, 'profiles'),
+                                 '4-5', every=2)
+
+        with freeze_time('2012-01-14 10:00:00'):
+            self.assertTrue(obj.run(job, 'foo'))
+        with freeze_time('2012-01-14 10:01:00'):
+            self.assertTrue(obj.run(job, 'foo'))
+        # a new profiler (as in a new process) keeps the count
+        obj = profiling.Profiler(os.path.join(self.directory, 'profiles'),
+                                 '4-5', every=2)
+        with freeze_time('2012-01-14 10:02:00'):
+            self.assertTrue(obj.run(job, 'foo'))
+
+        self.assertEqual([mock.call('foo')] * 3, job.call_args_list)
+        profiles = sorted(name for name in os.listdir(
+                                os.path.join(self.directory, 'profiles'))
+                          if name.endswith('.pstats'))
+        self.assertEqual(['slack-kanbanize-4-5-20120114T100000.pstats',
+                          'slack-kanbanize-4-5-20120114T100200.pstats'],
+                         profiles)
+        pstats.Stats(os.path.join(self.directory, 'profiles', profiles[0]))
+
+    def test_run_long_label(self):
+        job = mock.Mock(return_value=True)
+        label = '-'.join(str(board_id) for board_id in range(1000, 1065))
+        obj = profiling.Profiler(self.directory, label)
+
+        with freeze_time('2012-01-14 10:00:00'):
+            self.assertTrue(obj.run(job))
+
+        self.assertLessEqual(len(obj.label), profiling.MAX_LABEL_LENGTH)
+        names = os.listdir(self.directory)
+        self.assertIn('slack-kanbanize-%s-20120114T100000.pstats' %
+                      obj.label, names)
+        with open(os.path.join(self.directory,
+                               'slack-kanbanize-%s-20120114T100000.label.txt'
+                               % obj.label)) as file:
+            self.assertEqual(label, file.read().strip())
+
+    def test_run_count_error(self):
+        job = mock.Mock(return_value=True)
+        obj = profiling.Profiler(self.directory, '4')
+
+        with mock.patch.object(obj, '_count_run',
+                               side_effect=IOError(36, 'File name too long')):
+            self.assertTrue(obj.run(job))
+        self.assertEqual(1, job.call_count)
+
+    def test_multi_feeder_profiles_boards(self):
+        obj = feeder.MultiFeeder("foo_kanbanize_api_key", [4, 5],
+                                 "foo_slack_token", "foo_slack_channel",
+                                 checkpoint_store=checkpoint.CheckpointStore(
+                                                                ':memory:'),
+                                 profiler=profiling.Profiler(
+                                        self.directory, 'boards',
+                                        trace_memory=False))
+
+        with mock.patch.object(feeder.Feeder, '_parse_kanbanize_activities',
+                               return_value=[]) as mk_parse:
+            with mock.patch.object(feeder.Feeder,
+                                   '_get_kanbanize_board_activities',
+                                   return_value={u'activities': []}):
+                self.assertEqual({4: True, 5: True}, obj.run())
+
+        self.assertEqual(2, mk_parse.call_count)
+        profiles = sorted(name for name in os.listdir(self.directory)
+                          if name.endswith('.pstats'))
+        self.assertEqual(['slack-kanbanize-4-', 'slack-kanbanize-5-'],
+                         [name[:18] for name in profiles])
+        # the profile of the worker thread has the work of the board
+        functions = [function for filename, line, function in
+                     pstats.Stats(os.path.join(self.directory,
+                                               profiles[0])).stats]
+        self.assertIn('_flush_outbox', functions)
+
+
+class TestTemplateFormatter(unittest.TestCase):
+
+    def test_default_config(self):
+        obj = templates.TemplateFormatter()
+
+        self.assertEqual(u":rocket: User: *pappacena* Event: Task moved:"
+                         u" From 'Backlog' to 'J\xe1 detalhados'",
+                         obj({u'author': u'pappacena', u'event': u'Task moved',
+                              u'text': u"From 'Backlog' to 'J\xe1 detalhados'"}))
+        self.assertEqual(u"User: *pappacena* Event: _Foo other event_:"
+                         u" {foo}",
+                         obj({u'author': u'pappacena',
+                              u'event': u'Foo other event',
+                              u'text': u'{foo}'}))
+
+    def test_invalid_config(self):
+        self.assertRaises(ValueError, templates.TemplateFormatter,
+                          {u'events': {u'Comment added': u'{autor}: {text}'}})
+        self.assertRaises(ValueError, templates.TemplateFormatter,
+                          {u'template': u'{emoji} {0}'})
+        self.assertRaises(ValueError, templates.TemplateFormatter,
+                          {u'fallback': u'{author} {text'})
+
+    def test_invalid_config_file(self):
+        path = tempfile.mktemp(suffix='.json')
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as file:
+            json.dump({u'fallback': u'{autor}'}, file)
+
+        self.assertRaises(ValueError, templates.TemplateFormatter.from_file,
+                          path)
+
+    def test_custom_config(self):
+        obj = templates.TemplateFormatter({
+            u'fallback': u'{author}: {event}',
+            u'emoji': {u'Task moved': u':{rocket}:'},
+            u'events': {u'Comment added': u'{author} said: {text}'}
+        })
+
+        self.assertEqual(u':{rocket}: User: *pappacena* Event: Task moved:'
+                         u' foo',
+                         obj({u'author': u'pappacena', u'event': u'Task moved',
+                              u'text': u'foo'}))
+        self.assertEqual(u'pappacena said: foo',
+                         obj({u'author': u'pappacena',
+                              u'event': u'Comment added', u'text': u'foo'}))
+        self.assertEqual(u'pappacena: Task archived',
+                         obj({u'author': u'pappacena',
+                              u'event': u'Task archived', u'text': u'foo'}))
+
+    def test_format_batch(self):
+        obj = templates.TemplateFormatter({u'fallback': u'{text}'})
+
+        self.assertEqual([u'foo', u'bar'], obj.format_batch([
+            {u'author': u'pappacena', u'event': u'Other', u'text': u'foo'},
+            {u'author': u'pappacena', u'event': u'Other', u'text': u'bar'}]))
+
+    def test_from_file(self):
+        path = tempfile.mktemp()
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as file:
+            json.dump({u'events': {u'Task moved': u'moved by {author}'}},
+                      file)
+
+        obj = templates.TemplateFormatter.from_file(path)
+
+        self.assertEqual(u'moved by pappacena',
+                         obj({u'author': u'pappacena', u'event': u'Task moved',
+                              u'text': u'foo'}))
+
+
+class TestFormatters(unittest.TestCase):
+
+    def test_format_activities(self):
+        activities = [{u'text': u'foo'}, {u'text': u'bar'}]
+
+        self.assertEqual([u'foo', u'bar'], formatters.format_activities(
+                                lambda activity: activity[u'text'],
+                                activities))
+
+        batch_function = mock.Mock(return_value=[u'1', u'2'])
+        obj = formatters.batch_formatter(batch_function)
+        self.assertTrue(formatters.is_batch_formatter(obj))
+        self.assertEqual([u'1', u'2'],
+                         formatters.format_activities(obj, activities))
+        batch_function.assert_called_once_with(activities)
+
+        self.assertFalse(formatters.is_batch_formatter(mock.Mock()))
+
+    def test_threaded_formatter(self):
+        def formatter(activity):
+            if activity[u'text'] == u'error':
+                raise ValueError(u'error')
+            return activity[u'text'].upper()
+
+        obj = formatters.ThreadedFormatter(
+                            formatter, lambda activity: u'fallback', 2)
+        self.addCleanup(obj.close)
+
+        self.assertEqual([u'FOO', u'fallback', u'BAR'], obj.format_batch([
+                            {u'text': u'foo'}, {u'text': u'error'},
+                            {u'text': u'bar'}]))
+        self.assertEqual(u'FOO', obj({u'text': u'foo'}))
+
+    def test_threaded_formatter_timeout(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def formatter(activity):
+            if activity[u'text'] == u'slow':
+                release.wait(5)
+            return activity[u'text']
+
+        obj = formatters.ThreadedFormatter(
+                            formatter, lambda activity: u'fallback', 2, 0.05)
+        self.addCleanup(obj.close)
+
+        self.assertEqual([u'fallback', u'foo'], obj.format_batch([
+                            {u'text': u'slow'}, {u'text': u'foo'}]))
+
+    def test_threaded_formatter_deadline(self):
+        """
+            a hung formatter costs one timeout per batch, not one per
+            activity, and its backlog is abandoned
+        """
+        release = threading.Event()
+        self.addCleanup(release.set)
+        formatter = mock.Mock(side_effect=lambda activity: release.wait(5))
+        obj = formatters.ThreadedFormatter(
+                            formatter, lambda activity: u'fallback', 2, 0.1)
+        self.addCleanup(obj.close)
+
+        start = time.time()
+        self.assertEqual([u'fallback'] * 20, obj.format_batch(
+                                        [{u'text': u'foo'}] * 20))
+        self.assertLess(time.time() - start, 1)
+        # while the workers are hung, the next batches use the fallback
+        start = time.time()
+        self.assertEqual([u'fallback'] * 5, obj.format_batch(
+                                        [{u'text': u'foo'}] * 5))
+        self.assertLess(time.time() - start, 0.05)
+
+        release.set()
+        for i in range(50):
+            if not obj.in_flight:
+                break
+            time.sleep(0.05)
+        # the activities queued after the deadline were abandoned
+        self.assertEqual(0, obj.in_flight)
+        self.assertEqual(2, formatter.call_count)
+
+    def test_threaded_formatter_concurrent_batches(self):
+        """
+            batches formatted at the same time (ex: by the feeders of a
+            MultiFeeder) share the workers, none goes to the fallback
+        """
+        def formatter(activity):
+            time.sleep(0.01)
+            return activity[u'text']
+
+        obj = formatters.ThreadedFormatter(
+                            formatter, lambda activity: u'fallback', 2, 5)
+        self.addCleanup(obj.close)
+        results = {}
+
+        def format_batch(name):
+            results[name] = obj.format_batch([{u'text': name}] * 20)
+        threads = [threading.Thread(target=format_batch, args=(name,))
+                   for name in (u'a', u'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual({u'a': [u'a'] * 20, u'b': [u'b'] * 20}, results)
+        self.assertEqual(0, obj.in_flight)
+
+    def test_memoized_formatter(self):
+        formatter = mock.Mock(side_effect=lambda activity: activity[u'text'])
+        obj = formatters.MemoizedFormatter(formatter, 2)
+        foo = {u'event': u'Task moved', u'author': u'bot', u'text': u'foo'}
+        bar = {u'event': u'Task moved', u'author': u'bot', u'text': u'bar'}
+        baz = {u'event': u'Task moved', u'author': u'bot', u'text': u'baz'}
+
+        self.assertEqual([u'foo', u'foo', u'bar'],
+                         obj.format_batch([foo, dict(foo), bar]))
+        self.assertEqual(2, formatter.call_count)
+        self.assertEqual((1, 2), (obj.hits, obj.misses))
+
+        # foo is the most recently used, so bar is evicted
+        self.assertEqual(u'foo', obj(foo))
+        self.assertEqual(u'baz', obj(baz))
+        self.assertEqual(u'bar', obj(bar))
+        self.assertEqual(4, formatter.call_count)
+        self.assertEqual((2, 4), (obj.hits, obj.misses))
+
+    def test_memoized_threaded_formatter_fallback(self):
+        """
+            the fallback messages are not memoized, the activity is formatted
+            again once the formatter recovers
+        """
+        failing = [True]
+
+        @formatters.pure_formatter
+        def formatter(activity):
+            if failing[0]:
+                raise ValueError(u'error')
+            return activity[u'text'].upper()
+
+        threaded = formatters.ThreadedFormatter(
+                            formatter, lambda activity: u'fallback', 2)
+        self.addCleanup(threaded.close)
+        obj = formatters.MemoizedFormatter(threaded)
+        foo = {u'event': u'Task moved', u'author': u'bot', u'text': u'foo'}
+
+        self.assertTrue(formatters.is_pure_formatter(threaded))
+        self.assertEqual([u'fallback'], obj.format_batch([foo]))
+        failing[0] = False
+        self.assertEqual([u'FOO'], obj.format_batch([foo]))
+        failing[0] = True
+        self.assertEqual([u'FOO'], obj.format_batch([foo]))
+
+    def test_memoized_batch_formatter(self):
+        batch_function = mock.Mock(side_effect=lambda activities: [
+                                    activity[u'text']
+                                    for activity in activities])
+        obj = formatters.MemoizedFormatter(
+                            formatters.batch_formatter(batch_function))
+        foo = {u'event': u'Task moved', u'author': u'bot', u'text': u'foo'}
+
+        self.assertEqual([u'foo', u'foo'], obj.format_batch([foo, foo]))
+        self.assertEqual([u'foo'], obj.format_batch([foo]))
+        batch_function.assert_called_once_with([foo])
+
+    def test_pure_formatter(self):
+        @formatters.pure_formatter
+        def formatter(activity):
+            return activity[u'text']
+
+        self.assertTrue(formatters.is_pure_formatter(formatter))
+        self.assertTrue(formatters.is_pure_formatter(
+                                    formatters.batch_formatter(formatter)))
+        self.assertTrue(formatters.is_pure_formatter(
+                                    templates.DEFAULT_FORMATTER))
+        self.assertFalse(formatters.is_pure_formatter(lambda activity: u''))
+        self.assertFalse(formatters.is_pure_formatter(mock.Mock()))
+
+
+class TestChunker(unittest.TestCase):
+
+    def _attachment(self, value):
+        return {u'color': u'good',
+                u'fields': [{u'title': u'Task', u'value': u'<link|133>',
+                             u'short': True},
+                            {u'value': value}]}
+
+    def test_split_field_value(self):
+        self.assertEqual([u'aaa\nbb', u'cccc', u'ddddd…'],
+                         chunker.split_field_value(
+                                        u'aaa\nbb\ncccc\nddddddddd', 6))
+
+    def test_split_attachment_small(self):
+        attachment = self._attachment(u'foo')
+
+        self.assertEqual([attachment], chunker.split_attachment(attachment))
+
+    def test_split_attachment_continues_last_field(self):
+        ret = chunker.split_attachment(self._attachment(u'aaa\nbbb\nccc'),
+                                       max_field_length=10)
+
+        self.assertEqual([self._attachment(u'aaa\nbbb'),
+                          self._attachment(u'ccc')], ret)
+
+    def test_chunk_attachments_by_count(self):
+        attachments = [self._attachment(unicode(i)) for i in range(5)]
+
+        ret = list(chunker.chunk_attachments(attachments, max_attachments=2))
+
+        self.assertEqual([attachments[0:2], attachments[2:4], attachments[4:]],
+                         ret)
+
+    def test_chunk_attachments_by_bytes(self):
+        attachments = [self._attachment(u'x' * 100) for i in range(5)]
+        attachment_bytes = len(json.dumps(attachments[0]))
+
+        ret = list(chunker.chunk_attachments(
+                                attachments,
+                                max_bytes=attachment_bytes * 2 + 10))
+
+        self.assertEqual([2, 2, 1], [len(chunk) for chunk in ret])
+        for chunk in ret:
+            self.assertTrue(len(json.dumps(chunk)) <= attachment_bytes * 2 + 10)
+
+    def test_chunk_attachments_empty(self):
+        self.assertEqual([], list(chunker.chunk_attachments([])))
+
+    def test_chunk_attachments_json(self):
+        attachments = [self._attachment(u'J\xe1 %s' % i) for i in range(5)]
+
+        ret = list(chunker.chunk_attachments_json(attachments,
+                                                  max_attachments=2))
+
+        self.assertEqual([json.dumps(attachments[0:2]),
+                          json.dumps(attachments[2:4]),
+                          json.dumps(attachments[4:])], ret)
+
+    def test_get_json_dumps(self):
+        self.assertEqual(json.dumps, chunker.get_json_dumps())
+        self.assertRaises(ImportError, chunker.get_json_dumps, u'foo')
+
+
+class TestActivityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mktemp()
+        self.addCleanup(os.remove, self.path)
+        self.obj = activity_cache.ActivityCache(self.path)
+
+    @freeze_time("2012-01-14 13:20:00")
+    def test_put_get_hours(self):
+        hour = datetime.datetime(2012, 1, 14, 10)
+        self.obj.put_hours('account', 4, {
+            hour: [{u'date': u'2012-01-14 10:10:00'}],
+            hour + dates.ONE_HOUR: []})
+
+        self.assertEqual({hour: [{u'date': u'2012-01-14 10:10:00'}],
+                          hour + dates.ONE_HOUR: []},
+                         self.obj.get_hours('account', 4, [
+                                hour, hour + dates.ONE_HOUR,
+                                hour + dates.ONE_HOUR * 2]))
+        self.assertEqual({}, self.obj.get_hours('account', 5, [hour]))
+        self.assertEqual({}, self.obj.get_hours('other', 4, [hour]))
+
+    @freeze_time("2012-01-14 13:20:00")
+    def test_eviction(self):
+        old_hour = datetime.datetime(2012, 1, 1, 10)
+        self.obj.put_hours('account', 4, {old_hour: []})
+        self.obj.put_hours('account', 4, {
+                                    datetime.datetime(2012, 1, 14, 10): []})
+
+        self.assertEqual({}, self.obj.get_hours('account', 4, [old_hour]))
+
+
+class TestRateBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mktemp()
+        self.addCleanup(os.remove, self.path)
+        self.now = 1000.0
+        self.budget = self._budget()
+
+    def _budget(self, api_key='foo_kanbanize_api_key'):
+        return rate_limit.RateBudget(api_key, capacity=3, period=3600,
+                                     path=self.path, clock=lambda: self.now)
+
+    def test_acquire_until_exhausted(self):
+        self.assertEqual([True, True, True, False],
+                         [self.budget.try_acquire() for i in range(4)])
+        self.assertEqual(0, self.budget.remaining())
+        self.assertEqual(1200, self.budget.wait_time())
+
+    def test_refill(self):
+        for i in range(3):
+            self.budget.try_acquire()
+        self.now += 1800
+
+        self.assertEqual(1.5, self.budget.remaining())
+        self.assertTrue(self.budget.try_acquire())
+        self.assertFalse(self.budget.try_acquire())
+
+        self.now += 36000
+        self.assertEqual(3, self.budget.remaining())
+
+    def test_shared_by_api_key(self):
+        other = self._budget()
+        for i in range(3):
+            other.try_acquire()
+
+        self.assertFalse(self.budget.try_acquire())
+        self.assertTrue(self._budget('other_api_key').try_acquire())
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = transport.Transport(pool_size=4, timeout=5)
+
+    def test_clients_share_connection_pool(self):
+        kanbanize_client = self.obj.kanbanize_client("foo_kanbanize_api_key")
+        slack_client = self.obj.slack_client("foo_slack_token")
+
+        self.assertIs(self.obj.adapter,
+                      kanbanize_client.get_adapter('https://kanbanize.com'))
+        self.assertIs(self.obj.adapter,
+                      slack_client.transport.session.get_adapter(
+                                                    'https://slack.com'))
+        self.assertEqual(4, self.obj.adapter._pool_maxsize)
+
+    @mock.patch('requests.Session.request')
+    def test_kanbanize_request_timeout(self, mk_request):
+        kanbanize_client = self.obj.kanbanize_client("foo_kanbanize_api_key")
+
+        kanbanize_client.request('POST', '/foo', format='json')
+
+        self.assertEqual(5, mk_request.call_args[1]['timeout'])
+
+    def test_slack_chat_post_message(self):
+        slack_client = self.obj.slack_client("foo_slack_token")
+        self.obj.session = mock.Mock()
+        self.obj.session.post.return_value.status_code = 200
+        self.obj.session.post.return_value.json.return_value = {u'ok': True}
+
+        ret = slack_client.chat_post_message("foo_slack_channel", None,
+                                             username="slackbot")
+
+        self.assertEqual({u'ok': True}, ret)
+        self.obj.session.post.assert_called_once_with(
+            'https://slack.com/api/chat.postMessage',
+            data={'channel': "foo_slack_channel", 'text': None,
+                  'token': "foo_slack_token", 'username': "slackbot"},
+            timeout=5)
+
+    def test_slack_chat_post_message_http_error(self):
+        slack_client = self.obj.slack_client("foo_slack_token")
+        self.obj.session = mock.Mock()
+        self.obj.session.post.return_value.status_code = 429
+
+        ret = slack_client.chat_post_message("foo_slack_channel", u'foo')
+
+        self.assertFalse(ret[u'ok'])
+
+
+class TestSchedulerClass(unittest.TestCase):
+
+    def test_run_forever_until_stop(self):
+        calls = []
+
+        def job():
+            calls.append(1)
+            if len(calls) == 3:
+                obj.stop()
+
+        obj = scheduler.Scheduler(job, interval=0)
+        obj.run_forever()
+
+        self.assertEqual(3, len(calls))
+
+    def test_job_errors_dont_stop_scheduler(self):
+        calls = []
+
+        def job():
+            calls.append(1)
+            if len(calls) == 1:
+                raise Exception('boom')
+            obj.stop()
+
+        obj = scheduler.Scheduler(job, interval=0)
+        obj.run_forever()
+
+        self.assertEqual(2, len(calls))
+
+    def test_next_delay(self):
+        obj = scheduler.Scheduler(mock.Mock(), interval=60)
+
+        self.assertEqual(50, obj._next_delay(10))
+        self.assertEqual(0, obj._next_delay(70))
+
+    @mock.patch('random.uniform')
+    def test_next_delay_with_jitter(self, mk_uniform):
+        mk_uniform.return_value = 3
+        obj = scheduler.Scheduler(mock.Mock(), interval=60, jitter=5)
+
+        self.assertEqual(53, obj._next_delay(10))
+        mk_uniform.assert_called_once_with(0, 5)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_generate_activities(self):
+        raw_data = benchmarks.generate_activities(50, tasks=5, authors=2,
+                                                  events=3)
+        raw_activities = raw_data[u'activities']
+
+        self.assertEqual(50, len(raw_activities))
+        self.assertTrue(len(set(a[u'taskid'] for a in raw_activities)) <= 5)
+        self.assertTrue(len(set(a[u'author'] for a in raw_activities)) <= 2)
+        self.assertTrue(set(a[u'event'] for a in raw_activities) <=
+                        set(benchmarks.EVENTS[:3]))
+        self.assertEqual(raw_data, benchmarks.generate_activities(
+                                        50, tasks=5, authors=2, events=3))
+
+    def test_bench_stages(self):
+        ret = benchmarks.bench_stages(activities=20, tasks=4, repeat=2)
+
+        self.assertEqual(set(['_get_kanbanize_board_activities',
+                              '_parse_kanbanize_activities',
+                              '_format_slack_messages', 'json_dumps', 'run']),
+                         set(ret))
+        self.assertEqual(set(['min', 'median', 'mean', 'max']),
+                         set(ret['run']))
+
+    def test_run_with_stubs(self):
+        raw_data = benchmarks.generate_activities(20, tasks=4)
+        obj = benchmarks.build_feeder(raw_data)
+
+        self.assertTrue(obj.run())
+        self.assertEqual(1, obj.kanbanize_client.calls)
+        self.assertEqual(1, obj.slack_client.calls)
+        self.assertTrue(obj.slack_client.posted_bytes > 0)
+
+    def test_bench_replay(self):
+        path = tempfile.mktemp(suffix='.jsonl.gz')
+        self.addCleanup(os.remove, path)
+        for board_id, seed in ((4, 0), (4, 1), (5, 2)):
+            client = cassette.RecordingKanbanize(
+                        benchmarks.StubKanbanize(benchmarks.generate_activities(
+                                        10, tasks=2, seed=seed)), path)
+            client.get_board_activities(board_id, u'2014-10-02 19:00:00',
+                                        u'2014-10-02 21:00:00')
+
+        ret = benchmarks.bench_replay(path)
+
+        self.assertEqual(2, ret['boards'])
+        self.assertEqual(3, ret['responses'])
+        self.assertEqual(30, ret['activities'])
+        self.assertEqual(3, ret['runs'])
+        self.assertEqual(3, ret['slack_calls'])
+
+
+class TestCassette(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mktemp(suffix='.jsonl.gz')
+        self.addCleanup(lambda: os.path.exists(self.path) and
+                        os.remove(self.path))
+
+    def test_record(self):
+        client = mock.Mock()
+        client.get_board_activities.side_effect = [
+            {u'activities': [{u'text': u'foo'}]}, {u'activities': []}]
+        clock = mock.Mock(side_effect=[10.0, 12.5])
+        obj = cassette.RecordingKanbanize(client, self.path, clock)
+
+        self.assertEqual({u'activities': [{u'text': u'foo'}]},
+                         obj.get_board_activities(4, u'2014-10-02 19:00:00',
+                                                  u'2014-10-02 21:00:00'))
+        obj.get_board_activities(4, u'2014-10-02 19:00:00',
+                                 u'2014-10-02 21:00:00', page=2)
+
+        self.assertEqual([
+            {u'time': 10.0, u'boardid': 4,
+             u'fromdate': u'2014-10-02 19:00:00',
+             u'todate': u'2014-10-02 21:00:00', u'kwargs': {},
+             u'response': {u'activities': [{u'text': u'foo'}]}},
+            {u'time': 12.5, u'boardid': 4,
+             u'fromdate': u'2014-10-02 19:00:00',
+             u'todate': u'2014-10-02 21:00:00', u'kwargs': {u'page': 2},
+             u'response': {u'activities': []}}],
+            cassette.read_cassette(self.path))
+        self.assertIs(client.apikey, obj.apikey)
+
+    def test_replay(self):
+        records = [
+            {u'time': 100.0, u'boardid': 4, u'response': u'first'},
+            {u'time': 101.0, u'boardid': 5, u'response': u'other'},
+            {u'time': 104.0, u'boardid': 4, u'response': u'second'}]
+        now = [0.0]
+        sleep = mock.Mock(side_effect=lambda seconds: now.__setitem__(
+                                                    0, now[0] + seconds))
+        obj = cassette.ReplayKanbanize(records, speed=2, clock=lambda: now[0],
+                                       sleep=sleep)
+
+        self.assertEqual(u'first', obj.get_board_activities(4, None, None))
+        self.assertEqual(u'second', obj.get_board_activities(4, None, None))
+        # 4 seconds recorded, at twice the speed
+        self.assertEqual(2.0, now[0])
+        self.assertEqual(u'other', obj.get_board_activities(5, None, None))
+        self.assertEqual(1, sleep.call_count)
+        self.assertEqual(0, obj.remaining())
+        self.assertRaises(cassette.CassetteExhausted,
+                          obj.get_board_activities, 4, None, None)
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_fake_kanbanize_pages(self):
+        # one activity every 30 seconds, until 20:00:00
+        server = loadtest.FakeKanbanizeServer(rate=2, page_size=2,
+                                              clock=lambda: 1412280000)
+        server.start()
+        self.addCleanup(server.stop)
+        obj_transport = transport.Transport()
+        self.addCleanup(obj_transport.close)
+        client = loadtest.HttpKanbanize(server.url, u'foo', obj_transport)
+
+        ret = client.get_board_activities(4, u'2014-10-02 19:58:50',
+                                          u'2014-10-02 21:00:00')
+        self.assertEqual(3, ret[u'allactivities'])
+        self.assertEqual([u'2014-10-02 20:00:00', u'2014-10-02 19:59:30'],
+                         [activity[u'date']
+                          for activity in ret[u'activities']])
+        self.assertEqual(u'Activity 47076000 @1412280000',
+                         ret[u'activities'][0][u'text'])
+        ret = client.get_board_activities(4, u'2014-10-02 19:58:50',
+                                          u'2014-10-02 21:00:00', page=2)
+        self.assertEqual([u'2014-10-02 19:59:00'],
+                         [activity[u'date']
+                          for activity in ret[u'activities']])
+        self.assertIsInstance(client.get_board_activities(
+                    4, u'2014-10-02 21:00:00', u'2014-10-02 22:00:00'),
+                    unicode)
+        self.assertEqual(3, server.calls)
+
+    def test_fake_slack(self):
+        server = loadtest.FakeSlackServer(error_rate=0.5, rate_limit=3,
+                                          clock=lambda: 1412280010)
+        server.start()
+        self.addCleanup(server.stop)
+        obj_transport = transport.Transport()
+        self.addCleanup(obj_transport.close)
+        client = obj_transport.slack_client(u'foo', u'%s/api' % server.url)
+
+        ret = [client.chat_post_message(u'#foo', None, attachments=json.dumps(
+                            [{u'fields': [{u'value': u'bar @1412280000'}]}]))
+               for i in range(5)]
+
+        self.assertEqual(2, server.rate_limited)
+        self.assertEqual(3, server.messages + server.errors)
+        self.assertEqual(server.messages,
+                         sum(1 for result in ret if result[u'ok']))
+        self.assertEqual([10] * server.messages, server.latencies)
+
+    def test_run_load(self):
+        ret = loadtest.run_load(boards=2, rate=60, runs=2, interval=0,
+                                max_workers=2)
+
+        self.assertEqual(2, ret['runs'])
+        self.assertEqual(0, ret['failed_board_runs'])
+        self.assertEqual(0, ret['slack_errors'])
+        # the first run posts the last minute of the 2 boards
+        self.assertGreaterEqual(ret['activities_posted'], 2 * 60)
+        self.assertGreater(ret['slack_messages'], 0)
+        self.assertLess(ret['latency_seconds']['p50'], 120)
+
+    def test_percentiles(self):
+        self.assertEqual({'p50': 51, 'p90': 91, 'p99': 100},
+                         loadtest.percentiles(range(1, 101)))
+        self.assertEqual({'p50': None}, loadtest.percentiles([], (50,)))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+# coding=utf-8
+
+import requests
+from requests.adapters import HTTPAdapter
+from python_kanbanize.wrapper import Kanbanize
+from pyslack import SlackClient
+
+SLACK_API_URL = 'https://slack.com/api'
+
+
+class Transport(object):
+    """
+    Pool of keep-alive HTTP connections shared by the kanbanize and slack
+    clients, so repeated calls (many boards, daemon mode) reuse connections
+    instead of doing a new TLS handshake each time.
+    """
+
+    def __init__(self, pool_size=10, timeout=30, max_retries=0):
+        """
+            Arguments:
+            @pool_size - max connections kept open per host, should be at
+                         least the number of boards collected at same time
+            @timeout - seconds to wait for each http request
+            @max_retries - retries of failed connections (not of requests
+                           the server has received)
+        """
+        self.timeout = timeout
+        self.adapter = HTTPAdapter(pool_connections=pool_size,
+                                   pool_maxsize=pool_size,
+                                   max_retries=max_retries)
+        self.session = self.mount(requests.Session())
+
+    def mount(self, session):
+        """
+            Make session use the connection pool
+            Return the session
+        """
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        return session
+
+    def kanbanize_client(self, kanbanize_api_key):
+        return PooledKanbanize(kanbanize_api_key, self)
+
+    def slack_client(self, slack_token, api_url=SLACK_API_URL):
+        return PooledSlackClient(slack_token, self, api_url)
+
+    def close(self):
+        self.adapter.close()
+
+
+class PooledKanbanize(Kanbanize):
+    """
+    Kanbanize (a requests.Session) using the connections of a Transport
+    """
+
+    def __init__(self, apikey, transport, **kwargs):
+        super(PooledKanbanize, self).__init__(apikey, **kwargs)
+        self.transport = transport
+        transport.mount(self)
+
+    def request(self, method, url=None, data=None, headers=None, **kwargs):
+        kwargs.setdefault('timeout', self.transport.timeout)
+        return super(PooledKanbanize, self).request(method, url, data,
+                                                    headers, **kwargs)
+
+
+class PooledSlackClient(SlackClient):
+    """
+    SlackClient posting messages with the session of a Transport
+    """
+
+    def __init__(self, token, transport, api_url=SLACK_API_URL):
+        super(PooledSlackClient, self).__init__(token)
+        self.transport = transport
+        self.api_url = api_url
+
+    def chat_post_message(self, channel, text, **params):
+        params.update({'channel': channel, 'text': text,
+                       'token': self.token})
+        response = self.transport.session.post(
+                                    '%s/chat.postMessage' % self.api_url,
+                                    data=params,
+                                    timeout=self.transport.timeout)
+        if response.status_code != 200:
+            return {u'ok': False, u'error': u'http status %s' %
+                                            response.status_code}
+        return response.json()